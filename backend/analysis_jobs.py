@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 非同步分析工作
+圖像與數學公式分析可以改為送出後立即回傳工作 ID，模型呼叫在背景完成，
+結果存在 jobs.db 的 analysis_jobs 表中（保留 ttl 秒），任何 worker 行程都能查詢。
+
+- 使用者自帶的 API Key 只留在執行工作的行程記憶體中，不寫入資料庫
+  （因此分析工作不經過 jobs.py 的持久佇列，而由 web 行程內有上限的工作池執行）
+- 客戶端帶 Idempotency-Key 重送時取得同一個工作；相同的 key 但內容不同時視為衝突
+- 執行中的工作超過 stale_after 秒未完成（例如行程已結束）時回報為 failed
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+class IdempotencyConflict(Exception):
+    """同一個 Idempotency-Key 用於不同的請求內容"""
+
+
+def job_id_for(namespace: str, idempotency_key: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{idempotency_key}".encode("utf-8")).hexdigest()[:32]
+
+
+def request_hash(kind: str, body: Any) -> str:
+    return hashlib.sha256(f"{kind}\0{json.dumps(body, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+
+class AnalysisJobStore:
+    def __init__(self, path: Path, ttl: float = 86400, stale_after: float = 600, busy_timeout: float = 5.0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.busy_timeout = busy_timeout
+        with _schema_lock:
+            if str(self.path) not in _schema_ready:
+                conn = self.connect()
+                try:
+                    with conn:
+                        conn.execute("""
+                            CREATE TABLE IF NOT EXISTS analysis_jobs (
+                                id TEXT PRIMARY KEY,
+                                kind TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                request_hash TEXT,
+                                created_at REAL NOT NULL,
+                                updated_at REAL NOT NULL,
+                                expires_at REAL NOT NULL,
+                                result TEXT,
+                                error TEXT
+                            )
+                        """)
+                        conn.execute(
+                            "CREATE INDEX IF NOT EXISTS idx_analysis_jobs_expires_at ON analysis_jobs(expires_at)"
+                        )
+                finally:
+                    conn.close()
+                _schema_ready.add(str(self.path))
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level="IMMEDIATE")
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def create(self, job_id: str, kind: str, body_hash: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """建立工作，回傳 (工作, 是否新建)；已有未過期的同 ID 工作時回傳該工作"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                # 過期的同 ID 工作視為不存在
+                conn.execute("DELETE FROM analysis_jobs WHERE id = ? AND expires_at <= ?", (job_id, now))
+                created = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO analysis_jobs (id, kind, status, request_hash, created_at, updated_at, expires_at)
+                    VALUES (?, ?, 'queued', ?, ?, ?, ?)
+                    """,
+                    (job_id, kind, body_hash, now, now, now + self.ttl),
+                ).rowcount == 1
+                row = conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not created and (row["kind"] != kind or row["request_hash"] != body_hash):
+            raise IdempotencyConflict(f"Idempotency key already used for a different request (job {job_id})")
+        return self._to_dict(row, now), created
+
+    def mark_running(self, job_id: str):
+        self._update(job_id, RUNNING)
+
+    def succeed(self, job_id: str, result: Any):
+        self._update(job_id, SUCCEEDED, result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id: str, error: str):
+        self._update(job_id, FAILED, error=error)
+
+    def _update(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE analysis_jobs SET status = ?, updated_at = ?, result = ?, error = ?,
+                        expires_at = CASE WHEN ? IN ('succeeded', 'failed') THEN ? ELSE expires_at END
+                    WHERE id = ?
+                    """,
+                    (status, now, result, error, status, now + self.ttl, job_id),
+                )
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取得工作狀態；不存在或已過期時回傳 None"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM analysis_jobs WHERE id = ? AND expires_at > ?", (job_id, now)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row, now) if row else None
+
+    def purge(self) -> int:
+        conn = self.connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM analysis_jobs WHERE expires_at <= ?", (time.time(),)).rowcount
+        finally:
+            conn.close()
+
+    def _to_dict(self, row: sqlite3.Row, now: float) -> Dict[str, Any]:
+        job = {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "expires_at": row["expires_at"],
+        }
+        if job["status"] not in FINISHED and now - row["updated_at"] > self.stale_after:
+            job["status"] = FAILED
+            job["error"] = "Job was interrupted"
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
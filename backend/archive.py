@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 會話封存
+長時間沒有新訊息的會話，其訊息會壓縮後移到獨立的封存資料庫（archive.db），
+熱資料庫只保留 conversations 列（is_archived = 1），讓常用資料留在頁面快取中。
+
+每個會話的訊息以 NDJSON 壓縮成一個 blob（有安裝 zstandard 時用 zstd，否則用 zlib）。
+搬移順序讓中途崩潰也不會遺失資料：
+- 封存：先提交封存資料庫，再於熱資料庫刪除訊息並標記 is_archived
+- 還原：先將訊息寫回熱資料庫並清除標記，再刪除封存列
+兩邊都可重複執行（封存列以 INSERT OR REPLACE 寫入、還原時略過已存在的訊息）。
+"""
+
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import List, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# zstd 壓縮等級（3 為預設，速度與壓縮率的平衡點）
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    """壓縮資料，回傳 (codec, blob)"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive blob is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+
+def connect(archive_path: Path) -> sqlite3.Connection:
+    """開啟封存資料庫並建立資料表"""
+    conn = sqlite3.connect(archive_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_conversations (
+            conversation_id TEXT PRIMARY KEY,
+            archived_at INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL
+        )
+    """)
+    return conn
+
+
+def idle_conversations(conn: sqlite3.Connection, idle_before: int, limit: int) -> List[str]:
+    """最後更新早於 idle_before 且尚未封存的會話"""
+    rows = conn.execute(
+        """
+        SELECT id FROM conversations
+        WHERE is_archived = 0 AND updated_at < ?
+        ORDER BY updated_at
+        LIMIT ?
+        """,
+        (idle_before, limit),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def archive_conversations(conn: sqlite3.Connection, archive_path: Path, idle_before: int, limit: int) -> List[str]:
+    """封存一批閒置會話，回傳已封存的會話 ID"""
+    conversation_ids = idle_conversations(conn, idle_before, limit)
+    if not conversation_ids:
+        return []
+
+    payloads = []
+    for conversation_id in conversation_ids:
+        cursor = conn.execute(
+            "SELECT * FROM chat_messages WHERE conversation_id = ? ORDER BY timestamp, id", (conversation_id,)
+        )
+        columns = [description[0] for description in cursor.description]
+        lines = [json.dumps(dict(zip(columns, row)), ensure_ascii=False) for row in cursor]
+        codec, blob = compress("\n".join(lines).encode("utf-8"))
+        payloads.append((conversation_id, len(lines), codec, blob))
+
+    archive = connect(archive_path)
+    try:
+        with archive:
+            archive.executemany(
+                """
+                INSERT OR REPLACE INTO archived_conversations
+                    (conversation_id, archived_at, message_count, codec, payload)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(cid, int(time.time()), count, codec, blob) for cid, count, codec, blob in payloads],
+            )
+    finally:
+        archive.close()
+
+    archived = []
+    with conn:
+        # 先取得寫入鎖，確認訊息數與刪除之間不會有其他行程寫入
+        conn.execute("BEGIN IMMEDIATE")
+        for conversation_id, count, _, _ in payloads:
+            # 封存期間有新訊息寫入（訊息數不同）時保留在熱資料庫，下次再封存
+            current = conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()[0]
+            if current != count:
+                continue
+            conn.execute("DELETE FROM chat_messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("UPDATE conversations SET is_archived = 1 WHERE id = ?", (conversation_id,))
+            archived.append(conversation_id)
+    return archived
+
+
+def is_archived(conn: sqlite3.Connection, conversation_id: str) -> bool:
+    row = conn.execute("SELECT is_archived FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+    return bool(row and row[0])
+
+
+def rehydrate(conn: sqlite3.Connection, archive_path: Path, conversation_id: str) -> int:
+    """將封存的會話還原到熱資料庫，回傳還原的訊息數"""
+    if not Path(archive_path).exists():
+        return 0
+    archive = connect(archive_path)
+    try:
+        row = archive.execute(
+            "SELECT codec, payload FROM archived_conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        messages = []
+        if row:
+            text = decompress(row[0], row[1]).decode("utf-8")
+            messages = [json.loads(line) for line in text.splitlines() if line]
+
+        columns = {info[1] for info in conn.execute("PRAGMA table_info(chat_messages)")}
+        with conn:
+            for message in messages:
+                fields = [field for field in message if field in columns]
+                conn.execute(
+                    f"INSERT OR IGNORE INTO chat_messages ({', '.join(fields)}) "
+                    f"VALUES ({', '.join('?' for _ in fields)})",
+                    [message[field] for field in fields],
+                )
+            conn.execute("UPDATE conversations SET is_archived = 0 WHERE id = ?", (conversation_id,))
+
+        with archive:
+            archive.execute("DELETE FROM archived_conversations WHERE conversation_id = ?", (conversation_id,))
+    finally:
+        archive.close()
+
+    if messages:
+        logger.info(f"Rehydrated {len(messages)} archived messages of conversation {conversation_id}")
+    return len(messages)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 筆劃簡化基準測試
+以模擬的手繪筆劃（指標事件密度、含抖動）比較不同容許誤差下的點數縮減、
+幾何誤差（原始點到簡化折線的距離）與視覺誤差（縮圖像素差異比例）。
+
+用法：python bench_simplify.py [--strokes 200] [--tolerances 0.5,0.75,1,2]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from render import THUMBNAIL_SIZES, rasterize, stroke_points
+from simplify import polyline_error, simplify_strokes
+
+
+def synthetic_strokes(count: int, seed: int = 0):
+    """產生類似手繪的筆劃：曲線、直線與手寫轉折，每 1～3 像素一個點"""
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for index in range(count):
+        samples = int(rng.integers(80, 400))
+        t = np.linspace(0, 1, samples)
+        origin = rng.uniform(50, 750, 2)
+        kind = index % 3
+        if kind == 0:
+            radius = rng.uniform(20, 120)
+            angle = t * rng.uniform(np.pi, 2 * np.pi)
+            xy = origin + radius * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+        elif kind == 1:
+            xy = origin + np.outer(t, rng.uniform(-300, 300, 2))
+        else:
+            xy = origin + np.stack([t * rng.uniform(100, 300), 30 * np.sin(t * rng.uniform(6, 20))], axis=1)
+        xy += rng.normal(0, 0.3, xy.shape)
+        strokes.append({
+            "id": f"s{index}",
+            "color": "#000000",
+            "size": int(rng.integers(2, 6)),
+            "points": [
+                {"x": float(x), "y": float(y), "pressure": 0.5, "timestamp": step * 8}
+                for step, (x, y) in enumerate(xy)
+            ],
+        })
+    return strokes
+
+
+def visual_error(raw_strokes, simplified_strokes, size: str = "large") -> float:
+    """兩組筆劃繪製後不同像素的比例"""
+    canvas = {"width": 800, "height": 800}
+    before = np.asarray(rasterize({"canvas": canvas, "strokes": raw_strokes}, THUMBNAIL_SIZES[size]))
+    after = np.asarray(rasterize({"canvas": canvas, "strokes": simplified_strokes}, THUMBNAIL_SIZES[size]))
+    return float(np.any(before != after, axis=2).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="筆劃簡化基準測試")
+    parser.add_argument("--strokes", type=int, default=200)
+    parser.add_argument("--tolerances", default="0.25,0.5,0.75,1,2,4")
+    args = parser.parse_args()
+
+    strokes = synthetic_strokes(args.strokes)
+    print(f"{'tolerance':>9} {'points':>15} {'kept':>6} {'max err':>8} {'mean err':>8} {'pixels':>7} {'ms':>7}")
+
+    for tolerance in (float(value) for value in args.tolerances.split(",")):
+        started = time.perf_counter()
+        simplified, stats = simplify_strokes(strokes, tolerance)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        errors = np.concatenate([
+            polyline_error(stroke_points(raw), stroke_points(done))
+            for raw, done in zip(strokes, simplified)
+        ])
+        kept = stats["points_after"] / stats["points_before"]
+        print(
+            f"{tolerance:>9.2f} {stats['points_before']:>7}->{stats['points_after']:<7} {kept:>6.1%} "
+            f"{errors.max():>8.2f} {errors.mean():>8.3f} {visual_error(strokes, simplified):>7.2%} {elapsed:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
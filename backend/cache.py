@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 回應快取
+以 LRU 淘汰、依位元組總量限制大小的記憶體快取，儲存預先序列化的 JSON 回應。
+多個 worker 行程各有自己的快取，失效標籤經由共用資料庫的 cache_invalidations 表傳給其他行程。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set
+
+
+class ResponseCache:
+    """預先序列化回應的 LRU 快取，支援以標籤精準失效"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entries: int = 2048):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._entry_tags: Dict[Hashable, Set[str]] = {}
+        self._tag_keys: Dict[str, Set[Hashable]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # 每次失效都遞增；讀取資料庫期間若有失效，結果就不寫入快取
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """取得快取內容，命中時移到最近使用的位置"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key: Hashable, body: bytes, tags: Iterable[str] = (), generation: Optional[int] = None):
+        """寫入快取；若 generation 之後發生過失效則略過，避免存入過期資料"""
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._remove(key)
+            self._entries[key] = body
+            self._size += len(body)
+
+            entry_tags = set(tags)
+            self._entry_tags[key] = entry_tags
+            for tag in entry_tags:
+                self._tag_keys.setdefault(tag, set()).add(key)
+
+            while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate(self, *tags: str):
+        """移除帶有任一指定標籤的快取項目"""
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tag_keys.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._entry_tags.clear()
+            self._tag_keys.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """快取統計資訊"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key: Hashable):
+        body = self._entries.pop(key, None)
+        if body is None:
+            return
+        self._size -= len(body)
+        for tag in self._entry_tags.pop(key, ()):
+            keys = self._tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_keys[tag]
+
+
+def ensure_invalidation_log(cursor):
+    """建立跨行程的快取失效紀錄表（與 database/init_db.py 保持一致）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tags TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+
+
+class SharedInvalidation:
+    """讓多個 worker 行程的 ResponseCache 一起失效
+
+    寫入端以 publish 在共用資料庫記錄失效標籤（隨寫入交易一起提交），
+    每次查詢快取前以 sync 套用其他行程新增的紀錄（沒有新紀錄時只是一次主鍵範圍查詢）。
+    自己的紀錄也會再套用一次，只會多一次快取未命中。
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+        self.last_seq: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def publish(self, conn: sqlite3.Connection, *tags: str):
+        """記錄失效標籤並讓本行程的快取失效；交易由呼叫端提交"""
+        conn.execute(
+            "INSERT INTO cache_invalidations (tags, created_at) VALUES (?, ?)", (json.dumps(tags), time.time())
+        )
+        self.cache.invalidate(*tags)
+
+    def sync(self, conn: sqlite3.Connection):
+        """套用上次同步之後的失效紀錄；第一次同步或有紀錄已被清除而漏接時清空快取"""
+        with self._lock:
+            if self.last_seq is None:
+                self.last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations").fetchone()[0]
+                self.cache.clear()
+                return
+            rows = conn.execute(
+                "SELECT seq, tags FROM cache_invalidations WHERE seq > ? ORDER BY seq", (self.last_seq,)
+            ).fetchall()
+            if not rows:
+                return
+            if rows[0][0] != self.last_seq + 1:
+                self.cache.clear()
+            else:
+                self.cache.invalidate(*{tag for _, tags in rows for tag in json.loads(tags)})
+            self.last_seq = rows[-1][0]
+
+    @staticmethod
+    def purge(conn: sqlite3.Connection, older_than: float) -> int:
+        """刪除舊紀錄（保留最新一筆，讓落後的行程能發現漏接）"""
+        with conn:
+            return conn.execute(
+                """
+                DELETE FROM cache_invalidations
+                WHERE created_at < ? AND seq < (SELECT MAX(seq) FROM cache_invalidations)
+                """,
+                (older_than,),
+            ).rowcount
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 聊天記錄全文搜尋
+FTS5 trigram 索引放在獨立的 search.db，熱資料庫只多一個待索引佇列：
+- chat_messages 的 AFTER INSERT 觸發器把訊息 ID 放入 chat_search_queue（寫入路徑只多一列）
+- 背景工作分批讀取佇列，寫入 search.db 的 message_fts 後再清除佇列
+- 封存到 archive.db 的訊息仍留在索引中，搜尋結果可直接開啟（開啟時會自動還原）
+
+trigram 以三個字元為單位，中日韓文字不需斷詞。兩個字元的中日韓詞（如「函數」）改查
+message_bigram_fts：每段中日韓文字拆成重疊的二元組，以 unicode61 斷詞後每個二元組即一個 token；
+其餘少於三個字元的詞（單字、英數縮寫）才用 LIKE 比對。
+"""
+
+import re
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# 每批索引的訊息數
+INDEX_BATCH_SIZE = 500
+
+# trigram 能以 MATCH 查詢的最短詞長
+MIN_MATCH_LENGTH = 3
+
+# 中日韓文字（假名、漢字、諺文），拆成二元組索引
+CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]{2,}")
+
+# 片段長度（trigram 的 token 約等於字元）
+SNIPPET_TOKENS = 16
+SNIPPET_CHARS = 40
+HIGHLIGHT = ("<mark>", "</mark>")
+ELLIPSIS = "…"
+
+
+def ensure_queue(cursor):
+    """在熱資料庫建立待索引佇列與觸發器；第一次建立時把既有訊息全部排入"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'chat_messages_search_queue'"
+    ).fetchone()
+    cursor.execute("CREATE TABLE IF NOT EXISTS chat_search_queue (message_id TEXT PRIMARY KEY)")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_queue
+        AFTER INSERT ON chat_messages
+        BEGIN
+            INSERT OR IGNORE INTO chat_search_queue (message_id) VALUES (new.id);
+        END
+    """)
+    if not exists:
+        cursor.execute("INSERT OR IGNORE INTO chat_search_queue (message_id) SELECT id FROM chat_messages")
+
+
+def cjk_bigrams(text: Optional[str]) -> str:
+    """將文字中每段中日韓文字拆成重疊的二元組，以空白分隔（「微積分」→「微積 積分」）"""
+    return " ".join(
+        run[i:i + 2] for run in CJK_RUN.findall(text or "") for i in range(len(run) - 1)
+    )
+
+
+def is_bigram_term(term: str) -> bool:
+    """兩個字元且都是中日韓文字的詞可查二元組索引"""
+    return len(term) == 2 and CJK_RUN.fullmatch(term) is not None
+
+
+def ensure_bigram_index(conn: sqlite3.Connection):
+    """建立二元組索引；舊版索引第一次開啟時由 message_fts 回填"""
+    exists = "SELECT 1 FROM sqlite_master WHERE name = 'message_bigram_fts'"
+    if conn.execute(exists).fetchone():
+        return
+    conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # 其他行程可能已在等待期間建立
+        if conn.execute(exists).fetchone():
+            return
+        conn.execute("CREATE VIRTUAL TABLE message_bigram_fts USING fts5(grams, tokenize='unicode61')")
+        conn.execute("""
+            INSERT INTO message_bigram_fts (rowid, grams)
+            SELECT rowid, cjk_bigrams(message) FROM message_fts WHERE cjk_bigrams(message) != ''
+        """)
+
+
+def connect(index_path: Path) -> sqlite3.Connection:
+    """開啟搜尋索引資料庫並建立資料表"""
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(message, tokenize='trigram')")
+    ensure_bigram_index(conn)
+    # rowid 與 message_fts 的 rowid 相同；message_id 唯一，重複排入（例如封存後還原）時不會重複索引
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS indexed_messages (
+            rowid INTEGER PRIMARY KEY,
+            message_id TEXT NOT NULL UNIQUE,
+            conversation_id TEXT NOT NULL,
+            sender TEXT,
+            timestamp INTEGER
+        )
+    """)
+    return conn
+
+
+def index_pending(conn: sqlite3.Connection, index_path: Path, batch_size: int = INDEX_BATCH_SIZE,
+                  max_batches: Optional[int] = None) -> int:
+    """索引佇列中的訊息，回傳新索引的訊息數
+
+    先提交 search.db 再清除佇列；中途中斷時重新處理同一批，已索引的訊息以 message_id 略過。
+    多個行程同時執行也安全（search.db 的寫入交易會互相等待）。
+    """
+    indexed = 0
+    batches = 0
+    index = None
+    try:
+        while max_batches is None or batches < max_batches:
+            ids = [row[0] for row in conn.execute(
+                "SELECT message_id FROM chat_search_queue LIMIT ?", (batch_size,)
+            )]
+            if not ids:
+                break
+            batches += 1
+
+            placeholders = ", ".join("?" for _ in ids)
+            rows = conn.execute(
+                f"SELECT id, conversation_id, sender, message, timestamp FROM chat_messages WHERE id IN ({placeholders})",
+                ids,
+            ).fetchall()
+
+            if index is None:
+                index = connect(index_path)
+            with index:
+                for message_id, conversation_id, sender, message, timestamp in rows:
+                    cursor = index.execute(
+                        """
+                        INSERT OR IGNORE INTO indexed_messages (message_id, conversation_id, sender, timestamp)
+                        VALUES (?, ?, ?, ?)
+                        """,
+                        (message_id, conversation_id or "", sender, timestamp),
+                    )
+                    if cursor.rowcount:
+                        index.execute(
+                            "INSERT INTO message_fts (rowid, message) VALUES (?, ?)",
+                            (cursor.lastrowid, message or ""),
+                        )
+                        grams = cjk_bigrams(message)
+                        if grams:
+                            index.execute(
+                                "INSERT INTO message_bigram_fts (rowid, grams) VALUES (?, ?)",
+                                (cursor.lastrowid, grams),
+                            )
+                        indexed += 1
+
+            with conn:
+                conn.execute(f"DELETE FROM chat_search_queue WHERE message_id IN ({placeholders})", ids)
+    finally:
+        if index is not None:
+            index.close()
+    return indexed
+
+
+def pending_count(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM chat_search_queue").fetchone()[0]
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str], List[str]]:
+    """將查詢字串分成以 trigram MATCH 的長詞、以二元組 MATCH 的中日韓雙字詞與需用 LIKE 的短詞"""
+    terms = [term for term in re.split(r"\s+", query.strip()) if term]
+    long_terms = [term for term in terms if len(term) >= MIN_MATCH_LENGTH]
+    bigram_terms = [term for term in terms if is_bigram_term(term)]
+    short_terms = [term for term in terms if len(term) < MIN_MATCH_LENGTH and not is_bigram_term(term)]
+    return long_terms, bigram_terms, short_terms
+
+
+def fts_phrase(term: str) -> str:
+    """將詞包成 FTS5 片語（避免運算子與標點被解析）"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def like_pattern(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def make_snippet(text: str, terms: List[str]) -> str:
+    """LIKE 查詢沒有 FTS 片段可用時，以第一個命中的詞為中心截取片段並標示"""
+    lowered = text.lower()
+    positions = [(lowered.find(term.lower()), term) for term in terms]
+    positions = [(position, term) for position, term in positions if position >= 0]
+    if not positions:
+        return text[:SNIPPET_CHARS * 2]
+
+    position, term = min(positions)
+    start = max(0, position - SNIPPET_CHARS)
+    end = min(len(text), position + len(term) + SNIPPET_CHARS)
+    snippet = text[start:end]
+    for other in sorted({term for _, term in positions}, key=len, reverse=True):
+        snippet = re.sub(re.escape(other), lambda match: HIGHLIGHT[0] + match.group(0) + HIGHLIGHT[1],
+                         snippet, flags=re.IGNORECASE)
+    return (ELLIPSIS if start else "") + snippet + (ELLIPSIS if end < len(text) else "")
+
+
+def search(index_path: Path, query: str, limit: int = 200) -> List[Dict[str, Any]]:
+    """搜尋訊息，依相關度排序回傳 [{message_id, conversation_id, sender, timestamp, snippet, score}]
+
+    有長詞時以 trigram MATCH 篩選並用 bm25 排序，中日韓雙字詞以二元組索引篩選；
+    只有雙字詞時改由二元組索引篩選排序。短詞再以 LIKE 過濾；只有短詞時依時間由新到舊。
+    """
+    long_terms, bigram_terms, short_terms = parse_query(query)
+    if not long_terms and not bigram_terms and not short_terms:
+        return []
+    if not Path(index_path).exists():
+        return []
+
+    source = "message_fts"
+    where = []
+    params: List[Any] = []
+    if long_terms:
+        where.append("message_fts MATCH ?")
+        params.append(" AND ".join(fts_phrase(term) for term in long_terms))
+        if bigram_terms:
+            where.append(
+                "message_fts.rowid IN (SELECT rowid FROM message_bigram_fts WHERE message_bigram_fts MATCH ?)"
+            )
+            params.append(" AND ".join(fts_phrase(term) for term in bigram_terms))
+    elif bigram_terms:
+        source = "message_bigram_fts JOIN message_fts ON message_fts.rowid = message_bigram_fts.rowid"
+        where.append("message_bigram_fts MATCH ?")
+        params.append(" AND ".join(fts_phrase(term) for term in bigram_terms))
+    for term in short_terms:
+        where.append("message_fts.message LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(term))
+
+    if long_terms:
+        select = (
+            f"snippet(message_fts, 0, '{HIGHLIGHT[0]}', '{HIGHLIGHT[1]}', '{ELLIPSIS}', {SNIPPET_TOKENS}), "
+            "bm25(message_fts)"
+        )
+        order = "bm25(message_fts)"
+    elif bigram_terms:
+        # 二元組索引的 token 不是原文，片段由原文截取
+        select = "message_fts.message, bm25(message_bigram_fts)"
+        order = "bm25(message_bigram_fts)"
+    else:
+        select = "message_fts.message, 0.0"
+        order = "m.timestamp DESC"
+
+    index = connect(index_path)
+    try:
+        rows = index.execute(
+            f"""
+            SELECT m.message_id, m.conversation_id, m.sender, m.timestamp, {select}
+            FROM {source} JOIN indexed_messages m ON m.rowid = message_fts.rowid
+            WHERE {' AND '.join(where)}
+            ORDER BY {order}
+            LIMIT ?
+            """,
+            params + [limit],
+        ).fetchall()
+    finally:
+        index.close()
+
+    results = []
+    for message_id, conversation_id, sender, timestamp, snippet, score in rows:
+        if not long_terms:
+            snippet = make_snippet(snippet, bigram_terms + short_terms)
+        results.append({
+            "message_id": message_id,
+            "conversation_id": conversation_id,
+            "sender": sender,
+            "timestamp": timestamp,
+            "snippet": snippet,
+            # bm25 越小越相關，轉成越大越相關
+            "score": round(-score, 4),
+        })
+    return results
+
+
+def group_by_conversation(results: List[Dict[str, Any]], limit: int, per_conversation: int) -> List[Dict[str, Any]]:
+    """依會話分組，會話以最相關訊息的順序排列"""
+    groups: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        group = groups.get(result["conversation_id"])
+        if group is None:
+            if len(groups) >= limit:
+                continue
+            group = groups[result["conversation_id"]] = {
+                "conversation_id": result["conversation_id"],
+                "score": result["score"],
+                "match_count": 0,
+                "matches": [],
+            }
+        group["match_count"] += 1
+        if len(group["matches"]) < per_conversation:
+            group["matches"].append({key: value for key, value in result.items() if key != "conversation_id"})
+    return list(groups.values())
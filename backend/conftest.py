@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+from starlette.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "database"))
+
+import init_db
+import main
+import spatial
+from cache import SharedInvalidation
+from counters import CounterService
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """以 database/init_db.py 的正式結構建立暫存資料庫"""
+    path = tmp_path / "uicorework.db"
+    monkeypatch.setattr(init_db, "DATABASE_PATH", path)
+    monkeypatch.setattr(main, "DATABASE_PATH", path)
+    init_db.create_database()
+    init_db.insert_sample_data()
+    main.example_cache.clear()
+    monkeypatch.setattr(main, "example_invalidations", SharedInvalidation(main.example_cache))
+    spatial.clear_cache()
+    monkeypatch.setattr(main, "counter_service", CounterService(tmp_path / "counter_log"))
+    thumbnail_dir = tmp_path / "thumbnails"
+    thumbnail_dir.mkdir()
+    monkeypatch.setattr(main, "THUMBNAIL_DIR", thumbnail_dir)
+    yield path
+    main.shard_pool.close_all()
+
+
+@pytest.fixture
+def client(db_path):
+    return TestClient(main.app)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 範例計數服務
+按讚、下載、瀏覽次數先累積在記憶體分片中，並寫入預寫增量日誌（delta log），
+再定期以單一交易批次寫回 SQLite，避免每次點擊都搶 SQLite 的寫入鎖。
+
+崩潰安全流程：
+1. 每次遞增先附加到分片的 .log 檔，再更新記憶體
+2. 寫回時將各分片 .log 改名為 <batch_id>.<shard>.flushing
+3. 在同一個交易中套用增量並記錄 batch_id 到 counter_flushes
+4. 提交後刪除 .flushing 檔；重啟時依 counter_flushes 判斷是否需要重播
+
+多個 worker 行程各自以檔案鎖取得一個日誌槽（<log_dir>/slot-N），互不改名對方的日誌；
+worker 結束後留下的槽由下一個取得該槽的行程載入，或由 adopt_orphans 直接寫回。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import IO, Dict, Iterable, List, Optional, Tuple
+
+import locks
+
+logger = logging.getLogger(__name__)
+
+# 計數欄位（examples 表中的欄位名稱）
+COUNTER_FIELDS = ("likes", "downloads", "views")
+
+# counter_flushes 紀錄保留時間（秒）
+FLUSH_RECORD_TTL = 24 * 60 * 60
+
+# 單一日誌目錄下最多的 worker 槽數
+MAX_LOG_SLOTS = 256
+
+
+class _Shard:
+    """單一分片：獨立的鎖、待寫入增量與日誌檔"""
+
+    def __init__(self, log_path: Path):
+        self.lock = threading.Lock()
+        self.pending: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.log_path = log_path
+        self.log_file = open(log_path, "a", encoding="utf-8")
+
+    def reopen(self):
+        self.log_file = open(self.log_path, "a", encoding="utf-8")
+
+
+class CounterService:
+    """分片計數累加器，定期批次寫回 SQLite"""
+
+    def __init__(self, log_dir: Path, shards: int = 16, slot_lock: Optional[IO] = None):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self._slot_lock = slot_lock
+        self._flush_lock = threading.Lock()
+        self._shards: List[_Shard] = []
+        for index in range(shards):
+            self._shards.append(_Shard(self.log_dir / f"shard-{index}.log"))
+        self._load_active_logs()
+
+    @classmethod
+    def claim(cls, base_dir: Path, shards: int = 16) -> "CounterService":
+        """取得 base_dir 下第一個沒有其他行程持有的日誌槽並建立服務"""
+        base_dir = Path(base_dir)
+        for slot in range(MAX_LOG_SLOTS):
+            handle = locks.try_lock(base_dir / f"slot-{slot}.lock")
+            if handle is not None:
+                return cls(base_dir / f"slot-{slot}", shards=shards, slot_lock=handle)
+        raise RuntimeError(f"No free counter log slot under {base_dir}")
+
+    # ---------- 遞增與讀取 ----------
+
+    def increment(self, example_id: str, field: str, amount: int = 1):
+        """遞增計數；寫入日誌後才更新記憶體"""
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Unknown counter: {field}")
+
+        shard = self._shard_for(example_id)
+        with shard.lock:
+            shard.log_file.write(f"{example_id}\t{field}\t{amount}\n")
+            shard.log_file.flush()
+            shard.pending[(example_id, field)] += amount
+
+    def pending(self, example_id: str) -> Dict[str, int]:
+        """取得尚未寫回資料庫的增量"""
+        shard = self._shard_for(example_id)
+        with shard.lock:
+            return {field: shard.pending.get((example_id, field), 0) for field in COUNTER_FIELDS}
+
+    def merge(self, example_id: str, stored: Dict[str, int]) -> Dict[str, int]:
+        """將資料庫中的數值與待寫入增量合併"""
+        deltas = self.pending(example_id)
+        return {field: (stored.get(field) or 0) + deltas[field] for field in COUNTER_FIELDS}
+
+    # ---------- 寫回與復原 ----------
+
+    def flush(self, conn: sqlite3.Connection) -> List[str]:
+        """將所有分片的增量以單一交易寫回，回傳有變動的範例 ID"""
+        with self._flush_lock:
+            batch_id = uuid.uuid4().hex
+            deltas: Dict[Tuple[str, str], int] = defaultdict(int)
+            flushing_files = []
+
+            for index, shard in enumerate(self._shards):
+                with shard.lock:
+                    if not shard.pending:
+                        continue
+                    shard.log_file.close()
+                    flushing_path = self.log_dir / f"{batch_id}.{index}.flushing"
+                    shard.log_path.rename(flushing_path)
+                    shard.reopen()
+                    for key, amount in shard.pending.items():
+                        deltas[key] += amount
+                    shard.pending.clear()
+                    flushing_files.append(flushing_path)
+
+            if not deltas:
+                return []
+
+            try:
+                self._apply(conn, batch_id, deltas)
+            except Exception:
+                # 寫回失敗（交易已回滾）：增量重新記入日誌與記憶體，下次再寫回
+                logger.exception("Counter flush failed, keeping deltas in memory")
+                for (example_id, field), amount in deltas.items():
+                    shard = self._shard_for(example_id)
+                    with shard.lock:
+                        shard.pending[(example_id, field)] += amount
+                        shard.log_file.write(f"{example_id}\t{field}\t{amount}\n")
+                        shard.log_file.flush()
+                for path in flushing_files:
+                    path.unlink(missing_ok=True)
+                raise
+
+            for path in flushing_files:
+                path.unlink(missing_ok=True)
+
+            # 復原時需要的批次紀錄只會對應到尚未刪除的 .flushing 檔，舊紀錄可清除
+            with conn:
+                conn.execute(
+                    "DELETE FROM counter_flushes WHERE flushed_at < ?", (int(time.time()) - FLUSH_RECORD_TTL,)
+                )
+
+            return sorted({example_id for example_id, _ in deltas})
+
+    def recover(self, conn: sqlite3.Connection) -> int:
+        """重播上次中斷寫回時留下的 .flushing 檔，回傳重播的批次數"""
+        with self._flush_lock:
+            replayed = self._replay(conn, self.log_dir)
+            if replayed:
+                logger.info(f"Replayed {replayed} interrupted counter flush batches")
+            return replayed
+
+    def adopt_orphans(self, conn: sqlite3.Connection) -> int:
+        """寫回已結束的 worker 留在其他槽的日誌，回傳處理的槽數（由持有維護鎖的 worker 呼叫）"""
+        if self._slot_lock is None:
+            return 0
+
+        base_dir = self.log_dir.parent
+        adopted = 0
+        # 根目錄是改用日誌槽之前單一行程的日誌位置，不需要鎖
+        for slot_dir in [base_dir, *sorted(base_dir.glob("slot-*"))]:
+            if not slot_dir.is_dir() or slot_dir == self.log_dir:
+                continue
+            handle = None
+            if slot_dir != base_dir:
+                handle = locks.try_lock(slot_dir.with_suffix(".lock"))
+                if handle is None:
+                    continue
+            try:
+                # 與 flush 相同：先改名為 .flushing 再以單一交易寫回
+                batch_id = uuid.uuid4().hex
+                for index, path in enumerate(sorted(slot_dir.glob("shard-*.log"))):
+                    path.rename(slot_dir / f"{batch_id}.{index}.flushing")
+                with self._flush_lock:
+                    if self._replay(conn, slot_dir):
+                        adopted += 1
+            finally:
+                locks.release(handle)
+
+        if adopted:
+            logger.info(f"Flushed counter logs left by {adopted} stopped workers")
+        return adopted
+
+    def close(self):
+        """關閉所有分片日誌檔並釋放日誌槽"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.log_file.close()
+        locks.release(self._slot_lock)
+
+    # ---------- 內部工具 ----------
+
+    def _shard_for(self, example_id: str) -> _Shard:
+        return self._shards[zlib.crc32(example_id.encode("utf-8")) % len(self._shards)]
+
+    def _load_active_logs(self):
+        """啟動時將尚未寫回的日誌內容載入記憶體"""
+        for shard in self._shards:
+            for (example_id, field), amount in _read_log(shard.log_path):
+                shard.pending[(example_id, field)] += amount
+
+    def _replay(self, conn: sqlite3.Connection, log_dir: Path) -> int:
+        """套用目錄中尚未寫回的 .flushing 檔並刪除，回傳套用的批次數"""
+        ensure_schema(conn)
+        batches: Dict[str, List[Path]] = defaultdict(list)
+        for path in log_dir.glob("*.flushing"):
+            batches[path.name.split(".")[0]].append(path)
+
+        replayed = 0
+        for batch_id, paths in batches.items():
+            already_applied = conn.execute(
+                "SELECT 1 FROM counter_flushes WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+            if not already_applied:
+                deltas: Dict[Tuple[str, str], int] = defaultdict(int)
+                for path in paths:
+                    for key, amount in _read_log(path):
+                        deltas[key] += amount
+                if deltas:
+                    self._apply(conn, batch_id, deltas)
+                    replayed += 1
+            for path in paths:
+                path.unlink(missing_ok=True)
+        return replayed
+
+    def _apply(self, conn: sqlite3.Connection, batch_id: str, deltas: Dict[Tuple[str, str], int]):
+        """在單一交易中套用增量並記錄批次"""
+        per_example: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+        for (example_id, field), amount in deltas.items():
+            per_example[example_id][field] += amount
+
+        now = int(time.time())
+        ensure_schema(conn)
+        with conn:
+            conn.executemany(
+                """
+                UPDATE examples
+                SET likes = likes + ?, downloads = downloads + ?, views = views + ?
+                WHERE id = ?
+                """,
+                [
+                    (counts["likes"], counts["downloads"], counts["views"], example_id)
+                    for example_id, counts in per_example.items()
+                ],
+            )
+            conn.execute(
+                "INSERT INTO counter_flushes (batch_id, flushed_at) VALUES (?, ?)", (batch_id, now)
+            )
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """建立記錄已寫回批次的資料表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS counter_flushes (
+            batch_id TEXT PRIMARY KEY,
+            flushed_at INTEGER NOT NULL
+        )
+    """)
+
+
+def _read_log(path: Path) -> Iterable[Tuple[Tuple[str, str], int]]:
+    """讀取日誌檔；略過崩潰時寫到一半的最後一行"""
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            if not line.endswith("\n"):
+                break
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 3 or parts[1] not in COUNTER_FIELDS:
+                continue
+            try:
+                entries.append(((parts[0], parts[1]), int(parts[2])))
+            except ValueError:
+                continue
+    return entries
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 繪圖增量儲存
+自動儲存只上傳自上次版本以來新增的筆劃與復原標記，存成只增不改的增量紀錄
+（drawing_deltas），定期再壓縮進 drawings.drawing_data 快照。
+
+讀取時：drawing_data 快照（snapshot_revision）+ 之後的所有增量 = 目前內容
+"""
+
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+# 累積多少筆增量後壓縮成新快照
+COMPACT_EVERY = 50
+
+
+class RevisionConflict(Exception):
+    """客戶端的 base_revision 與伺服器目前版本不一致"""
+
+    def __init__(self, current_revision: int):
+        super().__init__(f"Drawing is at revision {current_revision}")
+        self.current_revision = current_revision
+
+
+def ensure_schema(cursor):
+    """建立增量紀錄表"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drawing_deltas (
+            drawing_id TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            ops TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (drawing_id, revision)
+        )
+    """)
+
+
+def apply_delta(drawing_data: Dict[str, Any], ops: Dict[str, Any]) -> Dict[str, Any]:
+    """將一筆增量套用到繪圖內容（先處理復原標記，再附加新筆劃）
+
+    有保留原始筆劃（raw_strokes）時，復原標記同樣套用到原始筆劃。
+    """
+    undo_ids = set(ops.get("undo") or [])
+    result = dict(drawing_data)
+
+    for key in ("strokes", "raw_strokes"):
+        if key == "raw_strokes" and key not in drawing_data and not ops.get(key):
+            continue
+        strokes = list(drawing_data.get(key) or [])
+        if undo_ids:
+            strokes = [stroke for stroke in strokes if stroke.get("id") not in undo_ids]
+        strokes.extend(ops.get(key) or [])
+        result[key] = strokes
+
+    if ops.get("canvas") is not None:
+        result["canvas"] = ops["canvas"]
+    return result
+
+
+def load_deltas(conn: sqlite3.Connection, drawing_id: str, since_revision: int) -> List[Dict[str, Any]]:
+    """取得指定版本之後的增量"""
+    rows = conn.execute(
+        "SELECT revision, ops FROM drawing_deltas WHERE drawing_id = ? AND revision > ? ORDER BY revision",
+        (drawing_id, since_revision),
+    ).fetchall()
+    return [{"revision": row[0], **json.loads(row[1])} for row in rows]
+
+
+def materialize(conn: sqlite3.Connection, drawing_id: str, snapshot: Dict[str, Any], snapshot_revision: int) -> Dict[str, Any]:
+    """快照加上後續增量，得到目前的繪圖內容"""
+    drawing_data = snapshot
+    for delta in load_deltas(conn, drawing_id, snapshot_revision):
+        drawing_data = apply_delta(drawing_data, delta)
+    return drawing_data
+
+
+def append_delta(
+    conn: sqlite3.Connection,
+    drawing_id: str,
+    base_revision: int,
+    strokes: Optional[List[Dict[str, Any]]] = None,
+    undo: Optional[List[str]] = None,
+    canvas: Optional[Dict[str, Any]] = None,
+    raw_strokes: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[int]:
+    """附加一筆增量並回傳新版本號；繪圖不存在時回傳 None"""
+    timestamp = int(time.time())
+    ops = {"strokes": strokes or [], "undo": undo or []}
+    if canvas is not None:
+        ops["canvas"] = canvas
+    if raw_strokes:
+        ops["raw_strokes"] = raw_strokes
+
+    new_revision = base_revision + 1
+    with conn:
+        # 比較並設定：版本仍為 base_revision 時才遞增。UPDATE 開始 IMMEDIATE 交易，
+        # 同時的 PUT（replace_snapshot）無法插入檢查與寫入增量之間
+        # stroke_count 為近似值（復原標記可能指向不存在的筆劃），壓縮時會校正
+        row = conn.execute(
+            """
+            UPDATE drawings
+            SET revision = ?, updated_at = ?, stroke_count = MAX(stroke_count + ? - ?, 0)
+            WHERE id = ? AND COALESCE(revision, 0) = ?
+            RETURNING snapshot_revision
+            """,
+            (new_revision, timestamp, len(ops["strokes"]), len(ops["undo"]), drawing_id, base_revision),
+        ).fetchone()
+        if row is None:
+            current = conn.execute("SELECT revision FROM drawings WHERE id = ?", (drawing_id,)).fetchone()
+            if current is None:
+                return None
+            raise RevisionConflict(current[0] or 0)
+
+        snapshot_revision = row[0] or 0
+        conn.execute(
+            "INSERT INTO drawing_deltas (drawing_id, revision, ops, created_at) VALUES (?, ?, ?, ?)",
+            (drawing_id, new_revision, json.dumps(ops), timestamp),
+        )
+
+    if new_revision - snapshot_revision >= COMPACT_EVERY:
+        compact(conn, drawing_id)
+
+    return new_revision
+
+
+def compact(conn: sqlite3.Connection, drawing_id: str) -> int:
+    """將增量壓縮進快照，回傳快照版本"""
+    with conn:
+        row = conn.execute(
+            "SELECT drawing_data, revision, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,)
+        ).fetchone()
+        if row is None:
+            return 0
+
+        snapshot = json.loads(row[0] or "{}")
+        revision, snapshot_revision = row[1] or 0, row[2] or 0
+        if revision == snapshot_revision:
+            return revision
+
+        drawing_data = materialize(conn, drawing_id, snapshot, snapshot_revision)
+        conn.execute(
+            "UPDATE drawings SET drawing_data = ?, snapshot_revision = ?, stroke_count = ? WHERE id = ?",
+            (json.dumps(drawing_data), revision, len(drawing_data.get("strokes") or []), drawing_id),
+        )
+        conn.execute(
+            "DELETE FROM drawing_deltas WHERE drawing_id = ? AND revision <= ?", (drawing_id, revision)
+        )
+    return revision
+
+
+def replace_snapshot(conn: sqlite3.Connection, drawing_id: str, drawing_data: Dict[str, Any], **columns) -> Optional[int]:
+    """以完整內容覆寫繪圖（PUT），版本遞增並清除舊增量；繪圖不存在時回傳 None"""
+    timestamp = int(time.time())
+    with conn:
+        # 在同一個 UPDATE 中遞增版本，與同時的增量寫入互斥
+        assignments = "".join(f", {name} = ?" for name in columns)
+        row = conn.execute(
+            f"""
+            UPDATE drawings
+            SET drawing_data = ?, revision = COALESCE(revision, 0) + 1, snapshot_revision = COALESCE(revision, 0) + 1,
+                updated_at = ?, stroke_count = ?{assignments}
+            WHERE id = ?
+            RETURNING revision
+            """,
+            (
+                json.dumps(drawing_data), timestamp,
+                len(drawing_data.get("strokes") or []), *columns.values(), drawing_id,
+            ),
+        ).fetchone()
+        if row is None:
+            return None
+
+        new_revision = row[0]
+        conn.execute("DELETE FROM drawing_deltas WHERE drawing_id = ?", (drawing_id,))
+    return new_revision
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - LaTeX 公式後處理
+從模型回應中取出 LaTeX、檢查語法、正規化成標準寫法並計算信心度。
+
+- 所有擷取用的正規表示式在模組載入時預先編譯
+- 輕量的 tokenizer / parser 檢查大括號、\\begin/\\end 環境與 \\left/\\right 是否成對，
+  以及指令是否為 KaTeX 支援的指令
+- 正規化後等價的公式會得到相同字串，可直接作為快取鍵
+- 信心度來自解析結果，模型有提供 log-prob 時再乘上平均 token 機率
+- 同一段模型原文的處理結果會被記憶（lru_cache）
+"""
+
+import math
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+# ============ 擷取 ============
+
+DISPLAY_BLOCK = re.compile(r"\\\[(.*?)\\\]", re.DOTALL)
+
+# (優先順序, 樣式)：數字越小越優先；同優先順序時取通過驗證且較長的候選
+CANDIDATE_PATTERNS = [
+    (0, DISPLAY_BLOCK),                                                        # \[...\]
+    (0, re.compile(r"\$\$(.+?)\$\$", re.DOTALL)),                              # $$...$$
+    (1, re.compile(r"```(?:latex|tex|math|katex)?[ \t]*\n?(.*?)```", re.DOTALL | re.IGNORECASE)),
+    (1, re.compile(r"(\\begin\{([A-Za-z]+\*?)\}.*?\\end\{\2\})", re.DOTALL)),  # 沒有分隔符號的環境
+    (2, re.compile(r"\\\((.*?)\\\)", re.DOTALL)),                              # \(...\)
+    (2, re.compile(r"(?<![\$\\])\$([^$\n]+?)\$(?!\$)")),                       # $...$
+    (3, re.compile(r"LaTeX\s*[:：]\s*([^\n]+)", re.IGNORECASE)),               # LaTeX: ...
+]
+
+CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+OUTER_DELIMITERS = re.compile(r"^\s*(?:\\\[|\\\(|\$\$|\$)(.*?)(?:\\\]|\\\)|\$\$|\$)\s*$", re.DOTALL)
+TRAILING_NOISE = re.compile(r"(?:\\\\|\\,|\\;|\\quad|[\s,，。;；]|(?<!\\right)\.)+$")
+
+# 判斷是否使用獨立公式（display）格式的符號
+DISPLAY_SYMBOLS = ("=", "+", "-", "*", "/", "^", "_", "\\frac", "\\sum", "\\int", "\\begin")
+
+# ============ Tokenizer ============
+
+TOKEN = re.compile(
+    r"(?P<command>\\(?:[A-Za-z]+|.))"
+    r"|(?P<open>\{)"
+    r"|(?P<close>\})"
+    r"|(?P<space>\s+)"
+    r"|(?P<char>.)",
+    re.DOTALL,
+)
+
+
+class Token(NamedTuple):
+    kind: str  # command / open / close / space / char
+    value: str
+
+
+def tokenize(body: str) -> List[Token]:
+    return [Token(match.lastgroup, match.group()) for match in TOKEN.finditer(body)]
+
+
+# ============ KaTeX 支援的指令與環境 ============
+
+KATEX_ENVIRONMENTS = frozenset("""
+    matrix pmatrix bmatrix Bmatrix vmatrix Vmatrix smallmatrix array subarray
+    matrix* pmatrix* bmatrix* Bmatrix* vmatrix* Vmatrix*
+    cases dcases rcases drcases aligned alignedat gathered split
+    align align* gather gather* equation equation* alignat alignat* CD darray
+""".split())
+
+KATEX_COMMANDS = frozenset("""
+    alpha beta gamma delta epsilon varepsilon zeta eta theta vartheta iota kappa varkappa lambda mu nu xi
+    omicron pi varpi rho varrho sigma varsigma tau upsilon phi varphi chi psi omega
+    Gamma Delta Theta Lambda Xi Pi Sigma Upsilon Phi Psi Omega varGamma varDelta varTheta varLambda varXi
+    varPi varSigma varUpsilon varPhi varPsi varOmega digamma aleph beth gimel hbar ell wp Re Im partial
+    infty nabla emptyset varnothing forall exists nexists neg lnot top bot angle triangle square
+    frac dfrac tfrac cfrac binom dbinom tbinom sqrt root over choose
+    sum prod coprod int iint iiint oint oiint bigcup bigcap bigvee bigwedge bigoplus bigotimes bigodot
+    biguplus bigsqcup lim limsup liminf sup inf max min arg det dim exp gcd hom ker lg ln log deg Pr
+    sin cos tan cot sec csc arcsin arccos arctan sinh cosh tanh coth operatorname mod bmod pmod pod
+    left right middle big Big bigg Bigg bigl bigr Bigl Bigr biggl biggr Biggl Biggr
+    langle rangle lfloor rfloor lceil rceil lvert rvert lVert rVert vert Vert lbrace rbrace backslash
+    leq le geq ge neq ne lt gt approx equiv sim simeq cong propto ll gg subset supset subseteq supseteq
+    in notin ni mid parallel perp prec succ preceq succeq models vdash dashv asymp doteq not
+    leqslant geqslant nleq ngeq lneq gneq
+    pm mp times div cdot ast star circ bullet oplus ominus otimes oslash odot cap cup setminus
+    wedge land vee lor uplus sqcap sqcup dagger ddagger amalg
+    to gets rightarrow leftarrow Rightarrow Leftarrow leftrightarrow Leftrightarrow implies impliedby iff
+    mapsto longrightarrow longleftarrow Longrightarrow Longleftarrow longmapsto uparrow downarrow
+    Uparrow Downarrow nearrow searrow swarrow nwarrow hookrightarrow hookleftarrow rightleftharpoons
+    xrightarrow xleftarrow overset underset stackrel overbrace underbrace overline underline
+    hat widehat tilde widetilde bar vec dot ddot acute grave breve check mathring overrightarrow
+    overleftarrow
+    mathrm mathbf mathit mathsf mathtt mathcal mathbb mathfrak mathscr boldsymbol bm text textbf
+    textit textrm textsf texttt textnormal operatorname displaystyle textstyle scriptstyle
+    scriptscriptstyle color textcolor boxed cancel bcancel xcancel sout phantom hphantom vphantom
+    quad qquad enspace thinspace medspace thickspace negthinspace space hspace kern mkern
+    ldots cdots vdots ddots dots dotsb dotsc dotsi dotsm dotso therefore because degree prime
+    begin end newline tag notag nonumber label limits nolimits substack
+""".split())
+
+# 單字元指令（\\、\{、\,、\! 等）皆為合法
+SYMBOL_COMMAND = re.compile(r"^\\[^A-Za-z]$")
+
+# 內容需保留原樣（含空白）的指令
+TEXT_COMMANDS = frozenset({"\\text", "\\textbf", "\\textit", "\\textrm", "\\textsf", "\\texttt", "\\textnormal"})
+
+# 同義指令統一成一種寫法
+COMMAND_ALIASES = {
+    "\\le": "\\leq", "\\ge": "\\geq", "\\ne": "\\neq", "\\lt": "<", "\\gt": ">",
+    "\\rightarrow": "\\to", "\\gets": "\\leftarrow", "\\land": "\\wedge", "\\lor": "\\vee",
+    "\\lnot": "\\neg", "\\bm": "\\boldsymbol", "\\lbrace": "\\{", "\\rbrace": "\\}",
+}
+
+
+class ParseResult(NamedTuple):
+    errors: List[str]
+    unknown_commands: List[str]
+
+
+def validate(tokens: Sequence[Token]) -> ParseResult:
+    """檢查大括號、環境與 \\left/\\right 是否成對，以及指令是否受 KaTeX 支援"""
+    errors: List[str] = []
+    unknown: List[str] = []
+    depth = 0
+    environments: List[str] = []
+    delimiters = 0
+
+    position = 0
+    while position < len(tokens):
+        kind, value = tokens[position]
+        if kind == "open":
+            depth += 1
+        elif kind == "close":
+            depth -= 1
+            if depth < 0:
+                errors.append("Unbalanced '}'")
+                depth = 0
+        elif kind == "command":
+            name = value[1:]
+            if value in ("\\begin", "\\end"):
+                environment, position = _read_group(tokens, position + 1)
+                if environment is None:
+                    errors.append(f"{value} without environment name")
+                elif value == "\\begin":
+                    if environment not in KATEX_ENVIRONMENTS:
+                        errors.append(f"Unsupported environment {environment}")
+                    environments.append(environment)
+                elif not environments or environments.pop() != environment:
+                    errors.append(f"Unmatched \\end{{{environment}}}")
+                continue
+            if value == "\\left":
+                delimiters += 1
+            elif value == "\\right":
+                delimiters -= 1
+                if delimiters < 0:
+                    errors.append("\\right without \\left")
+                    delimiters = 0
+            elif not SYMBOL_COMMAND.match(value) and name not in KATEX_COMMANDS:
+                unknown.append(value)
+        elif kind == "char" and value in "^_":
+            following = _next_significant(tokens, position + 1)
+            if following is None or following.kind == "close" or following.value in "^_&":
+                errors.append(f"Missing argument for '{value}'")
+        position += 1
+
+    if depth:
+        errors.append("Unbalanced '{'")
+    if environments:
+        errors.append(f"Unclosed environment {environments[-1]}")
+    if delimiters:
+        errors.append("\\left without \\right")
+    return ParseResult(errors, unknown)
+
+
+def _read_group(tokens: Sequence[Token], position: int) -> Tuple[Optional[str], int]:
+    """讀取 {name}，回傳 (name, 下一個位置)"""
+    while position < len(tokens) and tokens[position].kind == "space":
+        position += 1
+    if position >= len(tokens) or tokens[position].kind != "open":
+        return None, position
+    name = []
+    position += 1
+    while position < len(tokens) and tokens[position].kind != "close":
+        name.append(tokens[position].value)
+        position += 1
+    return "".join(name).strip() or None, position + 1
+
+
+def _next_significant(tokens: Sequence[Token], position: int) -> Optional[Token]:
+    while position < len(tokens):
+        if tokens[position].kind != "space":
+            return tokens[position]
+        position += 1
+    return None
+
+
+# ============ 正規化 ============
+
+def canonicalize(tokens: Sequence[Token]) -> str:
+    """輸出標準寫法：移除數學模式中無意義的空白、統一同義指令、
+    單一字元的上下標去掉大括號（x^{2} → x^2）"""
+    output: List[str] = []
+    text_depth = 0  # 在 \\text{...} 等指令的參數內時保留空白
+    depth = 0
+    pending_text = False
+
+    count = len(tokens)
+    position = 0
+    while position < count:
+        kind, value = tokens[position]
+
+        if kind == "space":
+            if text_depth:
+                output.append(" ")
+            elif output and re.match(r"\\[A-Za-z]+$", output[-1]):
+                # 指令名稱後接字母時需要保留一個空白分隔
+                following = _next_significant(tokens, position + 1)
+                if following is not None and following.kind == "char" and following.value.isalpha():
+                    output.append(" ")
+            position += 1
+            continue
+
+        if kind == "command":
+            value = COMMAND_ALIASES.get(value, value)
+            pending_text = value in TEXT_COMMANDS
+            output.append(value)
+            position += 1
+            continue
+
+        if kind == "open":
+            depth += 1
+            if pending_text or text_depth:
+                text_depth += 1
+            pending_text = False
+            output.append(value)
+            position += 1
+            continue
+
+        if kind == "close":
+            depth -= 1
+            if text_depth:
+                text_depth -= 1
+            output.append(value)
+            position += 1
+            continue
+
+        # ^{x} / _{x}：大括號內只有一個字元時去掉大括號
+        if value in "^_" and not text_depth:
+            group = [token for token in tokens[position + 1:position + 5] if token.kind != "space"]
+            if (
+                len(group) >= 3 and group[0].kind == "open" and group[2].kind == "close"
+                and group[1].kind == "char" and group[1].value.isalnum()
+            ):
+                output.append(value + group[1].value)
+                skipped = 0
+                while skipped < 3:
+                    position += 1
+                    if tokens[position].kind != "space":
+                        skipped += 1
+                position += 1
+                continue
+
+        pending_text = False
+        output.append(value)
+        position += 1
+
+    return "".join(output).strip()
+
+
+# ============ 對外介面 ============
+
+class ProcessedFormula(NamedTuple):
+    latex: Optional[str]  # 含分隔符號：\\[...\\] 或 \\(...\\)
+    body: Optional[str]  # 正規化後的公式本體（快取鍵）
+    valid: bool
+    errors: List[str]
+    confidence: float
+
+
+def extract_candidates(text: str) -> List[Tuple[int, str]]:
+    """找出所有可能的公式，回傳 [(優先順序, 內容)]"""
+    candidates = []
+    for priority, pattern in CANDIDATE_PATTERNS:
+        for match in pattern.finditer(text):
+            content = match.group(1).strip()
+            if content:
+                candidates.append((priority, content))
+
+    # 多個獨立公式區塊（模型沒用 aligned 而是分成多行輸出）合併成 gathered
+    blocks = [block.strip() for block in DISPLAY_BLOCK.findall(text) if block.strip()]
+    if len(blocks) > 1:
+        candidates.append((0, "\\begin{gathered}" + " \\\\ ".join(blocks) + "\\end{gathered}"))
+
+    # 沒有分隔符號，但整段看起來就是 LaTeX
+    stripped = text.strip()
+    if not candidates and stripped and "\\" in stripped and not CJK.search(stripped):
+        candidates.append((3, stripped))
+    return candidates
+
+
+def parse_score(result: ParseResult) -> float:
+    """解析結果的信心度：完全通過為 0.95，每個錯誤或未支援的指令扣分"""
+    score = 0.95 - 0.25 * len(result.errors) - 0.1 * len(result.unknown_commands)
+    return max(score, 0.05)
+
+
+@lru_cache(maxsize=2048)
+def _process_text(text: str) -> ProcessedFormula:
+    best = None
+    for priority, content in extract_candidates(text):
+        outer = OUTER_DELIMITERS.match(content)
+        if outer:
+            content = outer.group(1)
+        content = TRAILING_NOISE.sub("", content.strip())
+        if not content:
+            continue
+
+        tokens = tokenize(content)
+        result = validate(tokens)
+        valid = not result.errors and not result.unknown_commands
+        # 通過驗證優先，其次是來源的優先順序，最後取較長（較完整）的候選
+        rank = (valid, -len(result.errors), -priority, len(content))
+        if best is None or rank > best[0]:
+            best = (rank, tokens, result, valid)
+
+    if best is None:
+        return ProcessedFormula(None, None, False, ["No LaTeX found"], 0.0)
+
+    _, tokens, result, valid = best
+    body = canonicalize(tokens) if not result.errors else "".join(token.value for token in tokens).strip()
+    display = any(symbol in body for symbol in DISPLAY_SYMBOLS)
+    latex = f"\\[{body}\\]" if display else f"\\({body}\\)"
+    errors = result.errors + [f"Unsupported command {command}" for command in result.unknown_commands]
+    return ProcessedFormula(latex, body, valid, errors, round(parse_score(result), 3))
+
+
+def process(text: Optional[str], mean_logprob: Optional[float] = None) -> ProcessedFormula:
+    """處理模型回應文字；mean_logprob 為模型輸出 token 的平均 log-prob（若有）"""
+    if not text:
+        return ProcessedFormula(None, None, False, ["Empty response"], 0.0)
+
+    processed = _process_text(text)
+    if mean_logprob is None or processed.latex is None:
+        return processed
+    model_confidence = math.exp(min(mean_logprob, 0.0))
+    return processed._replace(confidence=round(processed.confidence * model_confidence, 3))
+
+
+def mean_logprob(logprobs: Optional[Sequence[float]]) -> Optional[float]:
+    values = [value for value in (logprobs or []) if value is not None]
+    return sum(values) / len(values) if values else None
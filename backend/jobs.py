@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 背景工作佇列
+請求結束後才需要完成的工作（縮圖與空間索引、排行重算等）寫入 SQLite 的 jobs 表，
+由 worker 執行緒（web 行程內的 WorkerPool 或 worker.py 獨立行程）取出執行。
+
+- 優先順序：priority 大的先執行，同優先順序依可執行時間與建立順序
+- 去重：同一個 dedupe_key 已有排隊中的工作時不重複加入（執行中的不算，執行後的變更仍會再排一次）
+- 重試：失敗時依指數退避（加隨機抖動）重新排隊，超過 max_attempts 後標記為 failed
+- 租約：取出時設定 lease_until，worker 崩潰留下的 running 工作在租約到期後重新排隊
+  （已用完重試次數或已有相同 dedupe_key 的新工作排隊時標記為 failed）
+- 取出以單一 UPDATE ... RETURNING 在 BEGIN IMMEDIATE 交易中完成，多個行程同時取也不會重複
+"""
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE = 600.0
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+class Job:
+    """取出的工作"""
+
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.payload = json.loads(row["payload"] or "{}")
+        self.priority = row["priority"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.kind}, attempt {self.attempts}/{self.max_attempts})"
+
+
+def backoff_delay(attempts: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """第 attempts 次失敗後的等待秒數"""
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+class JobQueue:
+    """jobs.db 上的工作佇列；每次操作開啟自己的連線，可在任意執行緒使用"""
+
+    def __init__(self, path: Path, busy_timeout: float = 5.0, lease: float = DEFAULT_LEASE):
+        self.path = Path(path)
+        self.busy_timeout = busy_timeout
+        self.lease = lease
+        with _schema_lock:
+            if str(self.path) not in _schema_ready:
+                conn = self.connect()
+                try:
+                    self.ensure_schema(conn)
+                finally:
+                    conn.close()
+                _schema_ready.add(str(self.path))
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level="IMMEDIATE")
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def ensure_schema(conn: sqlite3.Connection):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                dedupe_key TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                run_after REAL NOT NULL,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                last_error TEXT,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, priority DESC, run_after, id);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)
+                WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(status, finished_at);
+        """)
+
+    def enqueue(self, kind: str, payload: Optional[Dict[str, Any]] = None, priority: int = 0,
+                dedupe_key: Optional[str] = None, delay: float = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+        """加入工作並回傳 ID；有相同 dedupe_key 的排隊中工作時回傳該工作的 ID"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO jobs
+                        (kind, payload, priority, dedupe_key, max_attempts, run_after, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (kind, json.dumps(payload or {}), priority, dedupe_key, max_attempts, now + delay, now),
+                )
+                if cursor.rowcount:
+                    return cursor.lastrowid
+                return conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND status = 'queued'", (dedupe_key,)
+                ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def claim(self, kinds: Optional[Iterable[str]] = None) -> Optional[Job]:
+        """取出一個可執行的工作（標記為 running 並設定租約）；沒有工作時回傳 None"""
+        now = time.time()
+        kind_filter, params = "", []
+        if kinds:
+            kinds = list(kinds)
+            kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params = kinds
+        conn = self.connect()
+        try:
+            with conn:
+                self._recover_expired(conn, now)
+                row = conn.execute(
+                    f"""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_until = ?
+                    WHERE id = (
+                        SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ?{kind_filter}
+                        ORDER BY priority DESC, run_after, id LIMIT 1
+                    )
+                    RETURNING *
+                    """,
+                    [now, now + self.lease, now] + params,
+                ).fetchone()
+            return Job(row) if row else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _recover_expired(conn: sqlite3.Connection, now: float):
+        """租約到期的 running 工作（worker 已結束）重新排隊
+
+        已用完重試次數的標記為 failed；期間已有相同 dedupe_key 的新工作排隊時也標記為 failed，由新工作接手。
+        """
+        expired = conn.execute(
+            "SELECT id, attempts, max_attempts FROM jobs WHERE status = 'running' AND lease_until < ? ORDER BY id DESC",
+            (now,),
+        ).fetchall()
+        for row in expired:
+            if row["attempts"] < row["max_attempts"]:
+                try:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', run_after = ?, lease_until = NULL WHERE id = ?",
+                        (now, row["id"]),
+                    )
+                    continue
+                except sqlite3.IntegrityError:
+                    error = "Lease expired; superseded by a newer queued job"
+            else:
+                error = "Lease expired after the last attempt"
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, last_error = ?
+                WHERE id = ?
+                """,
+                (now, error, row["id"]),
+            )
+
+    def complete(self, job: Job, result: Any = None):
+        self._finish(job, DONE, result=json.dumps(result) if result is not None else None)
+
+    def fail(self, job: Job, error: str) -> bool:
+        """記錄失敗；還有重試次數時依退避時間重新排隊並回傳 True"""
+        if job.attempts < job.max_attempts:
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.execute(
+                        """
+                        UPDATE jobs SET status = 'queued', run_after = ?, lease_until = NULL, last_error = ?
+                        WHERE id = ? AND status = 'running'
+                        """,
+                        (time.time() + backoff_delay(job.attempts), error, job.id),
+                    )
+                return True
+            except sqlite3.IntegrityError:
+                # 執行期間已有相同 dedupe_key 的新工作排隊，由新工作接手
+                pass
+            finally:
+                conn.close()
+        self._finish(job, FAILED, error=error)
+        return False
+
+    def _finish(self, job: Job, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL,
+                        result = COALESCE(?, result), last_error = COALESCE(?, last_error)
+                    WHERE id = ?
+                    """,
+                    (status, time.time(), result, error, job.id),
+                )
+        finally:
+            conn.close()
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def purge(self, finished_before: float) -> int:
+        """刪除完成時間早於 finished_before 的已結束工作"""
+        conn = self.connect()
+        try:
+            with conn:
+                return conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (finished_before,)
+                ).rowcount
+        finally:
+            conn.close()
+
+    def metrics(self, window: float = 3600) -> Dict[str, Any]:
+        """佇列狀態：各狀態與種類的工作數、最久的等待時間、近期的平均執行時間與重試次數"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            by_kind: Dict[str, Dict[str, int]] = {}
+            totals = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for row in conn.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status"):
+                by_kind.setdefault(row[0], {})[row[1]] = row[2]
+                totals[row[1]] = totals.get(row[1], 0) + row[2]
+            oldest = conn.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'queued' AND run_after <= ?",
+                                  (now,)).fetchone()[0]
+            recent = conn.execute(
+                """
+                SELECT COUNT(*), AVG(finished_at - started_at), SUM(attempts - 1) FROM jobs
+                WHERE status IN ('done', 'failed') AND finished_at >= ?
+                """,
+                (now - window,),
+            ).fetchone()
+        finally:
+            conn.close()
+        return {
+            **totals,
+            "by_kind": by_kind,
+            "oldest_queued_seconds": round(now - oldest, 3) if oldest else 0,
+            "recent_finished": recent[0],
+            "recent_avg_seconds": round(recent[1], 4) if recent[1] is not None else None,
+            "recent_retries": recent[2] or 0,
+        }
+
+
+class WorkerPool:
+    """以執行緒執行佇列中的工作
+
+    handlers 為 kind -> handler(payload) 的對應，回傳值存入工作的 result。
+    沒有工作時每 poll_interval 秒檢查一次；同一行程內加入工作後呼叫 wake() 可立即處理。
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 workers: int = 2, poll_interval: float = 1.0, name: str = "job"):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.name = name
+        self._stop = threading.Event()
+        self._wake = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        with self._wake:
+            self._wake.notify_all()
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止取新工作並等待執行中的工作完成"""
+        self._stop.set()
+        self.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self) -> bool:
+        """取出並執行一個工作，沒有工作時回傳 False"""
+        job = self.queue.claim(self.handlers)
+        if job is None:
+            return False
+        started = time.monotonic()
+        try:
+            result = self.handlers[job.kind](job.payload)
+        except Exception as e:
+            retry = self.queue.fail(job, f"{type(e).__name__}: {e}")
+            logger.warning(f"{job} failed: {e}" + (" (will retry)" if retry else ""))
+        else:
+            self.queue.complete(job, result)
+            logger.debug(f"{job} done in {time.monotonic() - started:.3f}s")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except sqlite3.Error as e:
+                logger.error(f"Job queue error: {e}")
+            with self._wake:
+                if not self._stop.is_set():
+                    self._wake.wait(self.poll_interval)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 延遲匯入
+AI SDK（google.generativeai、openai）與 PIL 匯入成本高，且大多數請求用不到。
+LazyModule 在第一次存取屬性時才匯入實際模組，worker 啟動與重生時不需等待。
+
+python main.py --profile-startup 會以 -X importtime 在子行程中匯入 main，
+列出最耗時的模組，並另外量測各延遲模組在第一次使用時的匯入時間。
+"""
+
+import importlib
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class LazyModule:
+    """第一次存取屬性時才匯入的模組代理"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    self._module = importlib.import_module(self._name)
+                    load_times[self._name] = time.perf_counter() - started
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+# 延遲模組實際匯入所花的時間（秒）
+load_times: Dict[str, float] = {}
+
+registry: Dict[str, LazyModule] = {}
+
+
+def lazy_import(name: str) -> LazyModule:
+    """取得模組的延遲代理（同名共用同一個代理）"""
+    if name not in registry:
+        registry[name] = LazyModule(name)
+    return registry[name]
+
+
+PROFILE_MARKER = "--- lazy imports ---"
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """解析 -X importtime 輸出：[(模組, 自身微秒, 累計微秒, 巢狀深度)]"""
+    entries = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def profile_startup(module: str = "main", top: int = 25) -> str:
+    """在乾淨的子行程中量測匯入時間，回傳文字報告"""
+    backend_dir = Path(__file__).parent
+    code = (
+        f"import json, sys, time; started = time.perf_counter(); import {module}; "
+        f"print('TOTAL', time.perf_counter() - started); sys.stderr.write('{PROFILE_MARKER}\\n'); "
+        f"import lazy; [lazy.registry[name]._load() for name in list(lazy.registry)]; "
+        f"print('LAZY', json.dumps(lazy.load_times))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=backend_dir, capture_output=True, text=True,
+    )
+
+    total = None
+    lazy_times: Dict[str, float] = {}
+    for line in result.stdout.splitlines():
+        if line.startswith("TOTAL "):
+            total = float(line.split()[1])
+        elif line.startswith("LAZY "):
+            lazy_times = json.loads(line[5:])
+
+    # 標記之後是延遲模組的匯入，只統計 import main 期間的部分
+    entries = parse_importtime(result.stderr.split(PROFILE_MARKER)[0])
+    # main 本身與它直接匯入的模組
+    top_level = sorted(
+        (entry for entry in entries if entry[3] <= 1 and entry[0] != module), key=lambda entry: -entry[2]
+    )
+
+    lines = ["啟動匯入時間報告", "=" * 48]
+    if total is not None:
+        lines.append(f"import {module}: {total * 1000:.1f} ms")
+    else:
+        lines.append(f"import {module} 失敗：\n{result.stderr[-2000:]}")
+        return "\n".join(lines)
+
+    lines += ["", f"最耗時的直接匯入（累計，前 {top} 名）："]
+    for name, self_us, cumulative_us, _ in top_level[:top]:
+        lines.append(f"  {cumulative_us / 1000:9.1f} ms  {name}")
+
+    if lazy_times:
+        lines += ["", "延遲模組（第一次使用時才匯入）："]
+        for name, seconds in sorted(lazy_times.items(), key=lambda item: -item[1]):
+            lines.append(f"  {seconds * 1000:9.1f} ms  {name}")
+    return "\n".join(lines)
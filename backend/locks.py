@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 跨行程檔案鎖
+多個 uvicorn worker 共用同一個資料庫目錄時，用非阻塞的檔案鎖決定：
+- 每個 worker 使用哪一個計數日誌槽（counters.claim_log_slot）
+- 哪一個 worker 負責全表重算等背景寫入工作（維護鎖）
+
+鎖隨行程結束由作業系統自動釋放，worker 崩潰後其他行程即可接手。
+"""
+
+import os
+from pathlib import Path
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(path: Path) -> Optional[IO]:
+    """嘗試取得檔案的獨佔鎖；已被其他行程持有時回傳 None，成功時回傳需保持開啟的檔案"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return None
+
+    # 記錄持有者方便除錯（鎖本身不依賴內容）
+    handle.seek(0)
+    handle.truncate()
+    handle.write(f"{os.getpid()}\n")
+    handle.flush()
+    return handle
+
+
+def release(handle: Optional[IO]):
+    """釋放 try_lock 取得的鎖"""
+    if handle is None or handle.closed:
+        return
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        handle.close()
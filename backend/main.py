@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 """
 UI CoreWork - FastAPI 後端服務器
-提供聊天、範例、繪圖功能的 REST API
+提供聊天、範例、繪圖功能的 REST API 與 WebSocket 即時通道
 """
 
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional, Dict, Any
 import sqlite3
 import json
@@ -20,36 +21,101 @@ import base64
 import logging
 from pathlib import Path
 import io
-from PIL import Image
-import google.generativeai as genai
-import openai
+import asyncio
+import threading
+
+from lazy import lazy_import
+
+# AI SDK 與 PIL 延遲到第一次使用時才匯入
+Image = lazy_import("PIL.Image")
+genai = lazy_import("google.generativeai")
+openai = lazy_import("openai")
+
+import analysis_jobs
+import archive
+import chat_search
+import drawing_store
+import formula
+import jobs
+import locks
+import math_batch
+import realtime
+import spatial
+import storage
+import tenancy
+from cache import ResponseCache, SharedInvalidation, ensure_invalidation_log
+from counters import CounterService
+from regions import Region, RegionError, crop_image, decode_data_url, render_region, select_strokes, verify_image
+from ranking import SORT_ORDERS, popularity_score, recompute_all, trending_score, update_scores
+from render import THUMBNAIL_SIZES, render_png
+from simplify import simplify_strokes
+from storage import conversation_title, fetch_messages
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Gemini AI 設定
+# Gemini AI 設定（模型於 lifespan 或第一次使用時建立）
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 GEMINI_MODEL = None
+_gemini_model_lock = threading.Lock()
+_gemini_configured = False
 
-if GEMINI_API_KEY:
+# AI_INIT=eager 時在啟動時就匯入 SDK 並建立模型；預設 lazy 讓 worker 盡快就緒
+AI_INIT = os.getenv('AI_INIT', 'lazy').lower()
+
+def default_gemini_model():
+    """取得以環境變數 GEMINI_API_KEY 建立的 Gemini 模型；未設定或建立失敗時回傳 None"""
+    global GEMINI_MODEL, _gemini_configured
+    if _gemini_configured or not GEMINI_API_KEY:
+        return GEMINI_MODEL
+    
+    with _gemini_model_lock:
+        if not _gemini_configured:
+            try:
+                genai.configure(api_key=GEMINI_API_KEY)
+                # 使用最新的 Gemini 2.5 Flash 模型
+                GEMINI_MODEL = genai.GenerativeModel('gemini-2.5-flash')
+                logger.info("Gemini AI configured successfully with gemini-2.5-flash model")
+            except Exception as e:
+                logger.error(f"Failed to configure Gemini AI: {e}")
+                GEMINI_MODEL = None
+                logger.warning("Falling back to test mode")
+            _gemini_configured = True
+    return GEMINI_MODEL
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """啟動：讀取 AI 設定並啟動背景工作；關閉：等待進行中的 AI 呼叫、停止背景工作並寫回緩衝資料"""
+    global counter_service
+    app.state.ready = False
+    app.state.draining = False
+    app.state.ai_inflight = 0
+    if counter_service is None:
+        counter_service = CounterService.claim(DATABASE_PATH.parent / "counter_log")
+    
+    if not GEMINI_API_KEY:
+        logger.warning("GEMINI_API_KEY not found, AI analysis will use fallback mode")
+    elif AI_INIT == 'eager':
+        await asyncio.to_thread(default_gemini_model)
+    
+    await start_background_tasks()
+    install_drain_signal_handlers()
+    app.state.ready = True
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        # 使用最新的 Gemini 2.5 Flash 模型
-        GEMINI_MODEL = genai.GenerativeModel('gemini-2.5-flash')
-        logger.info("Gemini AI configured successfully with gemini-2.5-flash model")
-    except Exception as e:
-        logger.error(f"Failed to configure Gemini AI: {e}")
-        GEMINI_MODEL = None
-        logger.warning("Falling back to test mode")
-else:
-    logger.warning("GEMINI_API_KEY not found, AI analysis will use fallback mode")
+        yield
+    finally:
+        app.state.ready = False
+        app.state.draining = True
+        await drain_ai_calls(AI_DRAIN_TIMEOUT)
+        await stop_background_tasks()
 
 # 創建 FastAPI 應用
 app = FastAPI(
     title="UI CoreWork API",
     description="智慧設計協作平台的 REST API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 設定 CORS
@@ -70,6 +136,71 @@ UPLOAD_DIR = BASE_DIR / "uploads"
 DATABASE_PATH.parent.mkdir(exist_ok=True)
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# 範例目錄快取（預先序列化的列表頁與詳情）；失效經由目錄資料庫傳給其他 worker，紀錄保留秒數
+EXAMPLE_CACHE_MAX_BYTES = int(os.getenv('EXAMPLE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CACHE_INVALIDATION_RETENTION = float(os.getenv('CACHE_INVALIDATION_RETENTION', 3600))
+example_cache = ResponseCache(max_bytes=EXAMPLE_CACHE_MAX_BYTES)
+example_invalidations = SharedInvalidation(example_cache)
+
+# 範例計數服務（按讚、下載、瀏覽），增量定期批次寫回；每個 worker 在 lifespan 中取得自己的日誌槽
+COUNTER_FLUSH_INTERVAL = float(os.getenv('COUNTER_FLUSH_INTERVAL', 2))
+counter_service: Optional[CounterService] = None
+
+# 等待其他行程釋放 SQLite 寫入鎖的秒數
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5))
+
+# 會話閒置超過 ARCHIVE_IDLE_DAYS 天後封存到 archive.db（0 表示停用）；每批封存的會話數與每輪最多批數
+ARCHIVE_IDLE_DAYS = float(os.getenv('ARCHIVE_IDLE_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 50))
+ARCHIVE_MAX_BATCHES = int(os.getenv('ARCHIVE_MAX_BATCHES', 20))
+
+# 聊天全文搜尋索引的更新間隔（秒）
+SEARCH_INDEX_INTERVAL = float(os.getenv('SEARCH_INDEX_INTERVAL', 2))
+
+# 多租戶：以 X-Tenant-ID 標頭選擇租戶的資料庫分片（未指定時使用目錄資料庫）；
+# 連線池最多保留閒置連線的分片數與每個分片的閒置連線數
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_POOL_SHARDS = int(os.getenv('TENANT_POOL_SHARDS', 64))
+TENANT_POOL_IDLE = int(os.getenv('TENANT_POOL_IDLE', 4))
+
+# 關閉時等待進行中 AI 呼叫完成的最長秒數
+AI_DRAIN_TIMEOUT = float(os.getenv('AI_DRAIN_TIMEOUT', 30))
+
+# 伺服器端繪製的縮圖（依繪圖版本快取在磁碟）
+THUMBNAIL_DIR = UPLOAD_DIR / "thumbnails"
+THUMBNAIL_DIR.mkdir(exist_ok=True)
+
+# 背景工作佇列（database/jobs.db）：web 行程內的 worker 執行緒數（0 表示只由 worker.py 執行）、
+# 閒置時的輪詢間隔與已結束工作的保留時數
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_RETENTION_HOURS = float(os.getenv('JOB_RETENTION_HOURS', 24))
+job_workers: Optional[jobs.WorkerPool] = None
+
+# 非同步分析工作（?mode=async）：同時執行的模型呼叫數、結果保留秒數與 SSE 檢查狀態的間隔
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', 4))
+ANALYSIS_JOB_TTL = float(os.getenv('ANALYSIS_JOB_TTL', 86400))
+JOB_EVENT_INTERVAL = float(os.getenv('JOB_EVENT_INTERVAL', 0.5))
+
+# WebSocket 即時通道（/ws）：心跳間隔（秒）、每條連線的送出佇列長度與同時處理的請求數
+WS_HEARTBEAT_INTERVAL = float(os.getenv('WS_HEARTBEAT_INTERVAL', 20))
+WS_SEND_QUEUE = int(os.getenv('WS_SEND_QUEUE', 64))
+WS_MAX_INFLIGHT = int(os.getenv('WS_MAX_INFLIGHT', 8))
+# 檢查訂閱中的繪圖是否有其他 worker 寫入的新版本的間隔（秒）
+WS_DELTA_POLL_INTERVAL = float(os.getenv('WS_DELTA_POLL_INTERVAL', 1.0))
+
+# 筆劃簡化容許誤差（畫布像素，0 表示停用）、重新取樣間距與是否保留原始筆劃
+STROKE_SIMPLIFY_TOLERANCE = float(os.getenv('STROKE_SIMPLIFY_TOLERANCE', 0.75))
+STROKE_RESAMPLE_SPACING = float(os.getenv('STROKE_RESAMPLE_SPACING', 0)) or None
+STROKE_KEEP_RAW = os.getenv('STROKE_KEEP_RAW', 'false').lower() in ('1', 'true', 'yes')
+
+# 批次數學公式辨識：單次模型呼叫的圖片數上限與同時呼叫數
+MATH_BATCH_SIZE = int(os.getenv('MATH_BATCH_SIZE', math_batch.DEFAULT_BATCH_SIZE))
+MATH_BATCH_CONCURRENCY = int(os.getenv('MATH_BATCH_CONCURRENCY', math_batch.DEFAULT_CONCURRENCY))
+
+# 排行分數完整重算的間隔（秒）；平時由計數寫回增量更新
+RANKING_REFRESH_INTERVAL = float(os.getenv('RANKING_REFRESH_INTERVAL', 600))
+
 # ============ AI 客戶端管理 ============
 
 def get_gemini_client(api_key: str, model: str = 'gemini-2.0-flash-exp'):
@@ -161,13 +292,26 @@ class ChatResponse(BaseModel):
 class DrawingData(BaseModel):
     id: str
     title: Optional[str] = None
-    image_data: str  # base64 encoded image
+    image_data: Optional[str] = None  # base64 encoded image（可省略，縮圖由伺服器依筆劃繪製）
     description: Optional[str] = None
     tags: Optional[List[str]] = None
     created_at: Optional[float] = None
     strokes: Optional[List[Dict[str, Any]]] = None  # 添加 strokes 屬性
     canvas: Optional[Dict[str, Any]] = None  # 添加 canvas 屬性
     metadata: Optional[Dict[str, Any]] = None  # 添加 metadata 屬性
+    keep_raw: Optional[bool] = None  # 是否另存未簡化的原始筆劃（預設依 STROKE_KEEP_RAW）
+
+class DrawingPatch(BaseModel):
+    base_revision: int  # 客戶端目前所在的版本
+    strokes: Optional[List[Dict[str, Any]]] = None  # 新增的筆劃
+    undo: Optional[List[str]] = None  # 要移除的筆劃 ID（復原標記）
+    canvas: Optional[Dict[str, Any]] = None
+    keep_raw: Optional[bool] = None
+
+class StrokeRegionQuery(BaseModel):
+    bbox: Optional[Dict[str, float]] = None  # {x, y, width, height}（畫布座標）
+    lasso: Optional[List[Dict[str, float]]] = None  # 套索多邊形頂點 [{x, y}, ...]
+    mode: str = "intersects"  # intersects：相交即選取；contains：需完全落在區域內
 
 class ImageAnalysisRequest(BaseModel):
     image_data: str  # base64 encoded image (data:image/png;base64,...)
@@ -180,7 +324,10 @@ class ImageAnalysisResponse(BaseModel):
     error: Optional[str] = None
 
 class MathFormulaRequest(BaseModel):
-    image_data: str  # base64 encoded image (data:image/png;base64,...)
+    image_data: Optional[str] = None  # base64 encoded image (data:image/png;base64,...)
+    drawing_id: Optional[str] = None  # 或：已儲存繪圖的 ID 加上區域
+    bbox: Optional[Dict[str, float]] = None  # {x, y, width, height}（畫布座標）
+    lasso: Optional[List[Dict[str, float]]] = None  # 套索多邊形頂點 [{x, y}, ...]
 
 class MathFormulaResponse(BaseModel):
     success: bool
@@ -189,6 +336,23 @@ class MathFormulaResponse(BaseModel):
     confidence: Optional[float] = None
     error: Optional[str] = None
 
+class MathBatchItemResult(BaseModel):
+    index: int
+    success: bool
+    latex: Optional[str] = None
+    analysis: Optional[str] = None
+    confidence: Optional[float] = None
+    error: Optional[str] = None
+
+class MathBatchResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+    
+    success: bool  # 所有項目皆成功
+    partial: bool = False  # 部分項目失敗
+    results: List[MathBatchItemResult] = []
+    model_calls: int = 0
+    error: Optional[str] = None
+
 class Example(BaseModel):
     title: str
     description: str
@@ -200,18 +364,91 @@ class Example(BaseModel):
 
 # ============ 資料庫操作 ============
 
-def get_db():
-    """取得資料庫連線"""
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+def database_path() -> Path:
+    """目前請求租戶的資料庫檔（未指定租戶時為目錄資料庫）"""
+    return tenancy.shard_path(DATABASE_PATH, tenancy.current_tenant.get())
+
+def connect_db(check_same_thread: bool = True, path: Optional[Path] = None) -> sqlite3.Connection:
+    """開啟資料庫連線（預設為目前租戶的分片）
+    
+    多個 worker 共用同一個 WAL 資料庫：讀取不受寫入阻擋，寫入一次只有一個。
+    寫入交易以 BEGIN IMMEDIATE 開始，鎖被占用時等待 SQLITE_BUSY_TIMEOUT 秒而非中途升級失敗。
+    """
+    conn = sqlite3.connect(
+        path or database_path(), timeout=SQLITE_BUSY_TIMEOUT,
+        isolation_level="IMMEDIATE", check_same_thread=check_same_thread
+    )
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def connect_pooled(path: Path) -> sqlite3.Connection:
+    conn = connect_db(check_same_thread=False, path=path)
     conn.row_factory = sqlite3.Row
+    return conn
+
+def init_shard(path: Path):
+    """第一次開啟租戶分片時建立資料表（目錄資料庫在啟動時初始化）"""
+    if Path(path) != DATABASE_PATH:
+        init_database(path)
+
+# 各分片的連線池：請求結束後連線留待同一分片重複使用，閒置分片依 LRU 關閉
+shard_pool = tenancy.ShardPool(
+    connect_pooled, init_shard, max_shards=TENANT_POOL_SHARDS, max_idle=TENANT_POOL_IDLE
+)
+
+def pooled_connection(path: Path):
+    conn = shard_pool.acquire(path)
+    broken = False
     try:
         yield conn
+    except sqlite3.Error:
+        # 資料庫錯誤後的連線不再重複使用
+        broken = True
+        raise
     finally:
-        conn.close()
+        shard_pool.release(path, conn, broken)
 
-def init_database():
-    """初始化資料庫結構"""
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+def get_db():
+    """取得目前租戶分片的資料庫連線"""
+    yield from pooled_connection(database_path())
+
+def get_catalog_db():
+    """取得共用目錄資料庫（範例）的連線"""
+    yield from pooled_connection(DATABASE_PATH)
+
+@contextmanager
+def tenant_connection():
+    """在 Depends 之外（WebSocket）取得目前租戶分片的連線"""
+    yield from pooled_connection(database_path())
+
+def get_storage(db: sqlite3.Connection = Depends(get_db)) -> storage.Storage:
+    """目前租戶分片的資料存取層（與同一請求的 get_db 共用連線）"""
+    return storage.SQLiteStorage(db)
+
+def get_catalog_storage(db: sqlite3.Connection = Depends(get_catalog_db)) -> storage.Storage:
+    return storage.SQLiteStorage(db)
+
+def for_each_shard(func) -> int:
+    """對目錄資料庫與每個租戶分片各執行一次 func，回傳結果總和"""
+    total = 0
+    for tenant in [None] + tenancy.list_tenants(DATABASE_PATH):
+        token = tenancy.current_tenant.set(tenant)
+        try:
+            total += func() or 0
+        except Exception as e:
+            logger.error(f"{func.__name__} failed for tenant {tenant or '(catalog)'}: {e}")
+        finally:
+            tenancy.current_tenant.reset(token)
+    return total
+
+def init_database(path: Optional[Path] = None):
+    """初始化資料庫結構（預設為目錄資料庫，並插入範例資料）"""
+    path = Path(path or DATABASE_PATH)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # 只對尚未建立任何表格的新資料庫生效（與 init_db.py 相同），讓刪除的頁面可以線上回收
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL 模式會寫入資料庫檔，之後所有連線（含其他 worker）都沿用
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     
     # 聊天記錄表
@@ -234,10 +471,14 @@ def init_database():
             title TEXT,
             created_at INTEGER,
             updated_at INTEGER,
-            metadata TEXT
+            metadata TEXT,
+            is_archived BOOLEAN DEFAULT 0
         )
     """)
     
+    # 全文搜尋的待索引佇列（索引本身在 search.db）
+    chat_search.ensure_queue(cursor)
+    
     # 繪圖資料表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS drawings (
@@ -247,10 +488,20 @@ def init_database():
             thumbnail TEXT,
             created_at INTEGER,
             updated_at INTEGER,
-            metadata TEXT
+            metadata TEXT,
+            stroke_count INTEGER DEFAULT 0,
+            revision INTEGER DEFAULT 0,
+            snapshot_revision INTEGER DEFAULT 0
         )
     """)
     
+    # 繪圖增量紀錄表與筆劃空間索引表
+    drawing_store.ensure_schema(cursor)
+    spatial.ensure_schema(cursor)
+    
+    # 範例快取的跨 worker 失效紀錄
+    ensure_invalidation_log(cursor)
+    
     # 範例表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS examples (
@@ -263,6 +514,10 @@ def init_database():
             files TEXT,
             likes INTEGER DEFAULT 0,
             downloads INTEGER DEFAULT 0,
+            views INTEGER DEFAULT 0,
+            file_count INTEGER DEFAULT 0,
+            popularity_score REAL DEFAULT 0,
+            trending_score REAL DEFAULT 0,
             created_at INTEGER,
             author TEXT,
             metadata TEXT
@@ -279,14 +534,95 @@ def init_database():
         )
     """)
     
+    upgrade_schema(cursor)
+    create_indexes(cursor)
+    
     conn.commit()
     conn.close()
     
+    if path != DATABASE_PATH:
+        logger.info(f"Tenant shard initialized: {path}")
+        return
+    
     # 插入範例資料
     insert_sample_data()
     
     logger.info("Database initialized successfully")
 
+def upgrade_schema(cursor):
+    """為舊版資料庫補上後續新增的欄位（與 database/init_db.py 的 upgrade_schema 保持一致）"""
+    added_columns = {
+        "examples": {
+            "views": "INTEGER DEFAULT 0",
+            "file_count": "INTEGER DEFAULT 0",
+            "popularity_score": "REAL DEFAULT 0",
+            "trending_score": "REAL DEFAULT 0",
+        },
+        "conversations": {
+            "is_archived": "BOOLEAN DEFAULT 0",
+        },
+        "drawings": {
+            "stroke_count": "INTEGER DEFAULT 0",
+            "revision": "INTEGER DEFAULT 0",
+            "snapshot_revision": "INTEGER DEFAULT 0",
+        },
+    }
+    backfills = {
+        "file_count": "UPDATE examples SET file_count = COALESCE(json_array_length(files), 0) WHERE json_valid(files)",
+        "stroke_count": "UPDATE drawings SET stroke_count = COALESCE(json_array_length(drawing_data, '$.strokes'), 0) WHERE json_valid(drawing_data)",
+    }
+    
+    for table, columns in added_columns.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, definition in columns.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                if column in backfills:
+                    cursor.execute(backfills[column])
+                logger.info(f"Added column {table}.{column}")
+
+# 已被複合索引取代或沒有任何查詢使用的舊索引（與 database/init_db.py 的 OBSOLETE_INDEXES 相同）
+OBSOLETE_INDEXES = (
+    "idx_chat_messages_conversation_id",
+    "idx_chat_messages_timestamp",
+    "idx_conversations_updated_at",
+    "idx_drawings_created_at",
+    "idx_drawings_public",
+    "idx_drawings_list",
+    "idx_examples_category",
+    "idx_examples_created_at",
+    "idx_examples_featured",
+    "idx_examples_active",
+    # 排序加上 id 作為次序後，以結尾為 id 的索引取代
+    "idx_examples_category_created",
+    "idx_examples_created",
+    "idx_examples_popular",
+    "idx_examples_category_popular",
+    "idx_examples_trending",
+    "idx_examples_category_trending",
+)
+
+def create_indexes(cursor):
+    """創建 API 查詢所需的索引（與 database/init_db.py 的 create_indexes 保持一致）"""
+    for index_name in OBSOLETE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_ts ON chat_messages(conversation_id, timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_list ON conversations(updated_at DESC, id, title, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_idle ON conversations(is_archived, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_drawings_summary ON drawings(updated_at DESC, id, title, created_at, stroke_count)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_created_id ON examples(category, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_created_id ON examples(created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_popular_id ON examples(popularity_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_popular_id ON examples(category, popularity_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_trending_id ON examples(trending_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_trending_id ON examples(category, trending_score DESC, id DESC)",
+    ]
+    for index_sql in indexes:
+        cursor.execute(index_sql)
+
 # ============ AI 圖像分析功能 ============
 
 async def analyze_with_gemini(client, image_data: str, prompt: str) -> Dict[str, Any]:
@@ -389,10 +725,11 @@ async def analyze_image_with_ai(image_data: str, prompt: str) -> Dict[str, Any]:
         """
         
         # 使用 Gemini 2.5 Flash 進行真正的 AI 分析
-        if GEMINI_MODEL:
+        gemini_model = default_gemini_model()
+        if gemini_model:
             try:
                 # Use the Gemini model for real analysis
-                response = GEMINI_MODEL.generate_content([
+                response = gemini_model.generate_content([
                     analysis_prompt,
                     image
                 ])
@@ -488,17 +825,8 @@ async def analyze_math_with_gemini(client, image_data: str) -> Dict[str, Any]:
         """
         
         response = client.generate_content([math_prompt, image])
-        analysis_text = response.text
-        
-        latex_formula = extract_latex_from_analysis(analysis_text)
-        confidence = calculate_math_confidence(analysis_text)
         
-        return {
-            "success": True,
-            "analysis": analysis_text,
-            "latex": latex_formula,
-            "confidence": confidence
-        }
+        return {"success": True, **interpret_math_output(response.text, gemini_mean_logprob(response))}
     except Exception as e:
         logger.error(f"Gemini math analysis error: {e}")
         return {"success": False, "error": str(e)}
@@ -530,18 +858,13 @@ async def analyze_math_with_openai(client, image_data: str, model: str = "gpt-4o
                     ]
                 }
             ],
-            max_tokens=500
+            max_tokens=500,
+            logprobs=True
         )
         
-        analysis_text = response.choices[0].message.content
-        latex_formula = extract_latex_from_analysis(analysis_text)
-        confidence = calculate_math_confidence(analysis_text)
-        
         return {
             "success": True,
-            "analysis": analysis_text,
-            "latex": latex_formula,
-            "confidence": confidence
+            **interpret_math_output(response.choices[0].message.content, openai_mean_logprob(response))
         }
     except Exception as e:
         logger.error(f"OpenAI math analysis error: {e}")
@@ -596,25 +919,17 @@ async def analyze_math_formula(image_data: str) -> Dict[str, Any]:
         """
         
         # 使用 Gemini 2.5 Flash 進行數學公式分析
-        if GEMINI_MODEL:
+        gemini_model = default_gemini_model()
+        if gemini_model:
             try:
-                response = GEMINI_MODEL.generate_content([
+                response = gemini_model.generate_content([
                     math_prompt,
                     image
                 ])
-                analysis_text = response.text
                 logger.info("Successfully analyzed math formula with Gemini 2.5 Flash")
                 
-                # 從回應中提取 LaTeX 公式
-                latex_formula = extract_latex_from_analysis(analysis_text)
-                confidence = calculate_math_confidence(analysis_text)
-                
-                return {
-                    "success": True,
-                    "analysis": analysis_text,
-                    "latex": latex_formula,
-                    "confidence": confidence
-                }
+                # 從回應中提取並正規化 LaTeX 公式
+                return {"success": True, **interpret_math_output(response.text, gemini_mean_logprob(response))}
                 
             except Exception as e:
                 logger.error(f"Gemini math analysis error: {str(e)}")
@@ -638,53 +953,34 @@ async def analyze_math_formula(image_data: str) -> Dict[str, Any]:
 
 def extract_latex_from_analysis(analysis_text: str) -> Optional[str]:
     """
-    從 Gemini 分析結果中提取 LaTeX 公式
+    從分析結果中提取正規化後的 LaTeX 公式（\\[...\\] 或 \\(...\\)）
     """
-    import re
-    
-    # 尋找 LaTeX 格式的數學公式
-    patterns = [
-        r'\\\[(.*?)\\\]',       # \[...\] 格式（非貪婪，支持\\等特殊字符）
-        r'\\\((.*?)\\\)',       # \(...\) 格式（非貪婪）
-        r'LaTeX:\s*([^\n]+)',   # LaTeX: ... 格式
-        r'\$\$([^$]+)\$\$',     # $$...$$ 格式
-        r'\$([^$]+)\$'          # $...$ 格式
-    ]
-    
-    for pattern in patterns:
-        matches = re.search(pattern, analysis_text)
-        if matches:
-            latex_content = matches.group(1).strip()
-            # 確保格式正確
-            if not latex_content.startswith('\\[') and not latex_content.startswith('\\('):
-                # 如果是複雜公式，使用獨立公式格式
-                if any(symbol in latex_content for symbol in ['=', '+', '-', '*', '/', '^', '_']):
-                    return f"\\[{latex_content}\\]"
-                else:
-                    return f"\\({latex_content}\\)"
-            return latex_content
-    
-    return None
-
-def calculate_math_confidence(analysis_text: str) -> float:
+    return formula.process(analysis_text).latex
+
+def calculate_math_confidence(analysis_text: str, mean_logprob: Optional[float] = None) -> float:
     """
-    根據分析結果計算數學公式識別的信心度
+    根據 LaTeX 解析結果（與模型的平均 log-prob，若有）計算數學公式識別的信心度
     """
-    confidence = 0.0
-    
-    # 檢查是否包含數學關鍵詞
-    math_keywords = ['LaTeX', '公式', '方程', '數學', '運算', '符號', '變數']
-    for keyword in math_keywords:
-        if keyword in analysis_text:
-            confidence += 0.15
-    
-    # 檢查是否包含 LaTeX 語法
-    latex_symbols = ['\\[', '\\]', '\\(', '\\)', '^', '_', '=', '+', '-']
-    for symbol in latex_symbols:
-        if symbol in analysis_text:
-            confidence += 0.1
-    
-    return min(confidence, 1.0)
+    return formula.process(analysis_text, mean_logprob).confidence
+
+def gemini_mean_logprob(response) -> Optional[float]:
+    """Gemini 回應的平均 log-prob（SDK 或模型不支援時回傳 None）"""
+    try:
+        return response.candidates[0].avg_logprobs
+    except (AttributeError, IndexError, TypeError):
+        return None
+
+def openai_mean_logprob(response) -> Optional[float]:
+    """OpenAI 回應各 token 的平均 log-prob（未要求 logprobs 時回傳 None）"""
+    try:
+        return formula.mean_logprob([item.logprob for item in response.choices[0].logprobs.content])
+    except (AttributeError, IndexError, TypeError):
+        return None
+
+def interpret_math_output(analysis_text: str, mean_logprob: Optional[float] = None) -> Dict[str, Any]:
+    """單一公式的模型輸出轉成正規化的 LaTeX 與信心度"""
+    processed = formula.process(analysis_text, mean_logprob)
+    return {"analysis": analysis_text, "latex": processed.latex, "confidence": processed.confidence}
 
 def fallback_image_analysis(image_data: str) -> Dict[str, Any]:
     """後備的基本圖像分析"""
@@ -729,7 +1025,7 @@ def fallback_image_analysis(image_data: str) -> Dict[str, Any]:
 
 def insert_sample_data():
     """插入範例資料"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = connect_db(path=DATABASE_PATH)
     cursor = conn.cursor()
     
     # 檢查是否已有範例資料
@@ -798,12 +1094,12 @@ def insert_sample_data():
     for example in sample_examples:
         cursor.execute("""
             INSERT INTO examples 
-            (id, title, description, category, tags, thumbnail, files, likes, downloads, created_at, author, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            (id, title, description, category, tags, thumbnail, files, file_count, likes, downloads, created_at, author, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             example['id'], example['title'], example['description'], example['category'],
-            example['tags'], example['thumbnail'], example['files'], example['likes'],
-            example['downloads'], example['created_at'], example['author'], example['metadata']
+            example['tags'], example['thumbnail'], example['files'], len(json.loads(example['files'])),
+            example['likes'], example['downloads'], example['created_at'], example['author'], example['metadata']
         ))
     
     conn.commit()
@@ -820,6 +1116,416 @@ def get_timestamp() -> int:
     """取得當前時間戳"""
     return int(time.time())
 
+# ============ 資料投影 ============
+
+# 列表只回傳卡片欄位與計數；files、metadata、drawing_data 由詳情端點延遲載入
+EXAMPLE_SUMMARY_FIELDS = (
+    "id", "title", "description", "category", "tags", "thumbnail",
+    "likes", "downloads", "views", "file_count", "created_at", "author"
+)
+EXAMPLE_DETAIL_FIELDS = EXAMPLE_SUMMARY_FIELDS + ("files", "metadata")
+
+DRAWING_SUMMARY_FIELDS = ("id", "title", "stroke_count", "created_at", "updated_at")
+DRAWING_DETAIL_FIELDS = DRAWING_SUMMARY_FIELDS + ("revision", "drawing_data", "metadata")
+
+# 以 JSON 字串儲存的欄位及其預設值
+JSON_COLUMNS = {"tags": "[]", "files": "[]", "metadata": "{}", "drawing_data": "{}"}
+
+def select_fields(fields: Optional[str], allowed: tuple) -> List[str]:
+    """解析 fields= 參數，回傳要查詢的欄位（id 一律包含）"""
+    if not fields:
+        return list(allowed)
+    
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+def project_row(row: sqlite3.Row, fields: List[str]) -> Dict[str, Any]:
+    """將查詢結果轉為回應字典，只解析被選取的 JSON 欄位"""
+    item = {}
+    for field in fields:
+        value = row[field]
+        if field in JSON_COLUMNS:
+            value = json.loads(value or JSON_COLUMNS[field])
+        item[field] = value
+    return item
+
+# ============ 範例快取 ============
+
+def serialize_json(content: Any) -> bytes:
+    """以與 JSONResponse 相同的格式序列化回應內容"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def cached_json_response(body: bytes, cache_status: str) -> Response:
+    """直接回傳已序列化的 JSON，命中時完全略過編碼"""
+    return Response(content=body, media_type="application/json", headers={"X-Cache": cache_status})
+
+def example_list_tag(category: Optional[str]) -> str:
+    """範例列表頁的快取標籤（依類別）"""
+    return f"examples:list:{category or 'all'}"
+
+def invalidate_examples(conn: sqlite3.Connection, *tags: str):
+    """讓所有 worker 的範例快取中帶有這些標籤的項目失效（conn 為目錄資料庫的連線）"""
+    with conn:
+        example_invalidations.publish(conn, *tags)
+
+def purge_cache_invalidations() -> int:
+    conn = connect_db(path=DATABASE_PATH)
+    try:
+        return SharedInvalidation.purge(conn, time.time() - CACHE_INVALIDATION_RETENTION)
+    finally:
+        conn.close()
+
+# ============ 範例計數 ============
+
+# API 動作對應到 examples 表的計數欄位
+COUNTER_ACTIONS = {"like": "likes", "download": "downloads", "view": "views"}
+
+def flush_counters() -> List[str]:
+    """將累積的計數增量寫回資料庫，並讓對應的快取失效"""
+    conn = connect_db(path=DATABASE_PATH)
+    try:
+        updated_ids = counter_service.flush(conn)
+        update_scores(conn, updated_ids)
+        # 範例詳情與包含它的列表頁（列表項目帶有 example:{id} 標籤）
+        if updated_ids:
+            invalidate_examples(conn, *(f"example:{example_id}" for example_id in updated_ids), "examples:ranked")
+    finally:
+        conn.close()
+    return updated_ids
+
+async def counter_flush_loop():
+    """背景定期寫回計數"""
+    while True:
+        await asyncio.sleep(COUNTER_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_counters)
+        except Exception as e:
+            logger.error(f"Counter flush error: {e}")
+
+def refresh_rankings() -> int:
+    """完整重算所有範例的排行分數"""
+    conn = connect_db(path=DATABASE_PATH)
+    try:
+        updated = recompute_all(conn)
+        invalidate_examples(conn, "examples:ranked")
+    finally:
+        conn.close()
+    return updated
+
+def adopt_orphan_counters() -> int:
+    """寫回已結束的 worker 留下的計數日誌"""
+    conn = connect_db(path=DATABASE_PATH)
+    try:
+        return counter_service.adopt_orphans(conn)
+    finally:
+        conn.close()
+
+def archive_path() -> Path:
+    return database_path().parent / "archive.db"
+
+def archive_idle_conversations() -> int:
+    """分批封存閒置的會話，完成後回收熱資料庫的空頁，回傳封存的會話數"""
+    if ARCHIVE_IDLE_DAYS <= 0:
+        return 0
+    
+    idle_before = get_timestamp() - int(ARCHIVE_IDLE_DAYS * 86400)
+    total = 0
+    conn = connect_db()
+    try:
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            archived = archive.archive_conversations(conn, archive_path(), idle_before, ARCHIVE_BATCH_SIZE)
+            total += len(archived)
+            if len(archived) < ARCHIVE_BATCH_SIZE:
+                break
+            # 批次之間讓出寫入鎖給請求處理
+            time.sleep(0.05)
+        
+        # 新資料庫為 auto_vacuum=INCREMENTAL，刪除的訊息頁可直接歸還檔案系統
+        if total and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.executescript("PRAGMA incremental_vacuum;")
+    finally:
+        conn.close()
+    
+    if total:
+        logger.info(f"Archived {total} idle conversations")
+    return total
+
+def ensure_conversation_hot(conn: sqlite3.Connection, conversation_id: str):
+    """會話已封存時先還原到熱資料庫"""
+    if archive.is_archived(conn, conversation_id):
+        archive.rehydrate(conn, archive_path(), conversation_id)
+
+def search_index_path() -> Path:
+    return database_path().parent / "search.db"
+
+def index_chat_messages(max_batches: Optional[int] = None) -> int:
+    """將佇列中的新訊息寫入全文索引"""
+    conn = connect_db()
+    try:
+        return chat_search.index_pending(conn, search_index_path(), max_batches=max_batches)
+    finally:
+        conn.close()
+
+async def search_index_loop():
+    """背景分批更新全文索引（只由持有維護鎖的 worker 執行）"""
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_INTERVAL)
+        if app.state.maintenance_lock is None:
+            continue
+        try:
+            await asyncio.to_thread(for_each_shard, index_chat_messages)
+        except Exception as e:
+            logger.error(f"Search index error: {e}")
+
+async def maintenance_loop():
+    """背景維護工作：只由持有維護鎖的 worker 執行，避免多個 worker 同時做全表寫入
+    
+    定期完整重算排行分數（修正資料庫外部寫入造成的偏差）、寫回已結束 worker 的計數日誌，
+    封存目錄資料庫與各租戶分片中的閒置會話，並刪除過了保留期限的已結束背景工作。
+    持有鎖的 worker 結束後，其他 worker 會在下一輪取得鎖接手。
+    """
+    while True:
+        if app.state.maintenance_lock is None:
+            app.state.maintenance_lock = locks.try_lock(DATABASE_PATH.parent / "maintenance.lock")
+        if app.state.maintenance_lock is not None:
+            try:
+                await asyncio.to_thread(adopt_orphan_counters)
+                await asyncio.to_thread(refresh_rankings)
+                await asyncio.to_thread(for_each_shard, archive_idle_conversations)
+                await asyncio.to_thread(purge_jobs)
+                await asyncio.to_thread(purge_cache_invalidations)
+            except Exception as e:
+                logger.error(f"Maintenance error: {e}")
+        await asyncio.sleep(RANKING_REFRESH_INTERVAL)
+
+# ============ 縮圖產生 ============
+
+def thumbnail_dir() -> Path:
+    """目前租戶的縮圖目錄"""
+    tenant = tenancy.current_tenant.get()
+    return THUMBNAIL_DIR / tenant if tenant else THUMBNAIL_DIR
+
+def thumbnail_path(drawing_id: str, revision: int, size: str) -> Path:
+    """縮圖快取檔路徑（依版本區分）"""
+    return thumbnail_dir() / f"{drawing_id}-r{revision}-{size}.png"
+
+def load_current_drawing(conn: sqlite3.Connection, drawing_id: str) -> Optional[tuple]:
+    """取得繪圖目前的版本與內容（快照加上增量）"""
+    row = conn.execute(
+        "SELECT drawing_data, revision, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    
+    snapshot = json.loads(row[0] or "{}")
+    return row[1] or 0, drawing_store.materialize(conn, drawing_id, snapshot, row[2] or 0)
+
+def render_thumbnails(drawing_id: str, sizes=tuple(THUMBNAIL_SIZES)) -> Optional[int]:
+    """繪製目前版本的縮圖並移除舊版本，回傳繪製的版本"""
+    conn = connect_db()
+    try:
+        loaded = load_current_drawing(conn, drawing_id)
+    finally:
+        conn.close()
+    
+    if loaded is None:
+        return None
+    
+    revision, drawing_data = loaded
+    thumbnail_dir().mkdir(parents=True, exist_ok=True)
+    for size in sizes:
+        path = thumbnail_path(drawing_id, revision, size)
+        if not path.exists():
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_bytes(render_png(drawing_data, size))
+            temp_path.replace(path)
+    
+    current_prefix = f"{drawing_id}-r{revision}-"
+    for old_path in thumbnail_dir().glob(f"{drawing_id}-r*.png"):
+        if not old_path.name.startswith(current_prefix):
+            old_path.unlink(missing_ok=True)
+    
+    return revision
+
+def select_region_strokes(
+    drawing_id: str, revision: int, drawing_data: Dict[str, Any], region: Region, mode: str = "intersects"
+) -> List[int]:
+    """以空間索引找出區域內的筆劃位置（索引與內容版本不一致時逐一比對）"""
+    conn = connect_db()
+    try:
+        index = spatial.current_index(conn, drawing_id)
+    finally:
+        conn.close()
+    
+    strokes = drawing_data.get("strokes") or []
+    candidates = None
+    if index is not None and index.revision == revision and len(index) == len(strokes):
+        candidates = index.query(region.bbox, "intersects" if region.polygon is not None else mode)
+    return select_strokes(strokes, region, candidates, mode)
+
+def load_drawing_region(drawing_id: str, bbox: Optional[Dict[str, Any]], lasso: Optional[List[Any]]) -> Optional[str]:
+    """從已儲存的繪圖擷取區域影像（base64 PNG）；繪圖不存在時回傳 None
+    
+    有筆劃時只繪製與區域相交的筆劃，否則裁切儲存的圖片。
+    """
+    region = Region.parse(bbox, lasso)
+    
+    conn = connect_db()
+    try:
+        loaded = load_current_drawing(conn, drawing_id)
+        row = conn.execute("SELECT thumbnail FROM drawings WHERE id = ?", (drawing_id,)).fetchone()
+    finally:
+        conn.close()
+    
+    if loaded is None:
+        return None
+    
+    revision, drawing_data = loaded
+    if drawing_data.get("strokes"):
+        png = render_region(drawing_data, region, select_region_strokes(drawing_id, revision, drawing_data, region))
+    elif row and row[0]:
+        png = crop_image(decode_data_url(row[0]), drawing_data.get("canvas"), region)
+    else:
+        raise RegionError("Drawing has no strokes or stored image")
+    
+    return base64.b64encode(png).decode("ascii")
+
+def schedule_thumbnails(drawing_id: str):
+    """儲存後排入背景工作繪製縮圖並更新空間索引；同一繪圖已在排隊時不重複排入"""
+    enqueue_job(
+        "drawing.assets", {"drawing_id": drawing_id}, priority=10,
+        dedupe_key=f"drawing.assets:{tenancy.current_tenant.get() or ''}:{drawing_id}"
+    )
+
+def refresh_drawing_assets(drawing_id: str) -> Optional[int]:
+    """背景工作：繪製縮圖並將空間索引更新到目前版本，回傳處理的版本"""
+    revision = render_thumbnails(drawing_id)
+    
+    conn = connect_db()
+    try:
+        spatial.current_index(conn, drawing_id)
+    finally:
+        conn.close()
+    return revision
+
+# ============ 背景工作 ============
+
+def job_queue() -> jobs.JobQueue:
+    return jobs.JobQueue(DATABASE_PATH.parent / "jobs.db", busy_timeout=SQLITE_BUSY_TIMEOUT)
+
+def enqueue_job(kind: str, payload: Optional[Dict[str, Any]] = None, **options) -> int:
+    """加入背景工作（記錄目前的租戶）；本行程有 worker 時立即喚醒"""
+    job_id = job_queue().enqueue(kind, {**(payload or {}), "tenant": tenancy.current_tenant.get()}, **options)
+    if job_workers is not None:
+        job_workers.wake()
+    return job_id
+
+def run_drawing_assets_job(payload: Dict[str, Any]):
+    return {"revision": refresh_drawing_assets(payload["drawing_id"])}
+
+def run_rankings_job(payload: Dict[str, Any]):
+    return {"updated": refresh_rankings()}
+
+def in_tenant(handler):
+    """在工作記錄的租戶分片中執行 handler"""
+    def run(payload: Dict[str, Any]):
+        token = tenancy.current_tenant.set(payload.get("tenant"))
+        try:
+            return handler(payload)
+        finally:
+            tenancy.current_tenant.reset(token)
+    return run
+
+def job_handlers() -> Dict[str, Any]:
+    """工作種類與處理函式（web 行程與 worker.py 共用）"""
+    return {
+        "drawing.assets": in_tenant(run_drawing_assets_job),
+        # 不再由 API 加入；保留處理函式讓佇列中既有的工作與手動加入的重算仍可執行
+        "examples.rankings": in_tenant(run_rankings_job),
+    }
+
+def purge_jobs() -> int:
+    """刪除過了保留期限的已結束佇列工作與過期的分析結果"""
+    return job_queue().purge(time.time() - JOB_RETENTION_HOURS * 3600) + analysis_store().purge()
+
+def analysis_store() -> analysis_jobs.AnalysisJobStore:
+    return analysis_jobs.AnalysisJobStore(
+        DATABASE_PATH.parent / "jobs.db", ttl=ANALYSIS_JOB_TTL, busy_timeout=SQLITE_BUSY_TIMEOUT
+    )
+
+# 每個事件迴圈一個 semaphore（測試中每個 TestClient 有自己的迴圈）
+_analysis_slots: Dict[int, asyncio.Semaphore] = {}
+# 執行中的分析工作（避免 task 被回收）
+_analysis_tasks = set()
+
+def analysis_slots() -> asyncio.Semaphore:
+    loop_id = id(asyncio.get_running_loop())
+    if loop_id not in _analysis_slots:
+        _analysis_slots.clear()
+        _analysis_slots[loop_id] = asyncio.Semaphore(ANALYSIS_WORKERS)
+    return _analysis_slots[loop_id]
+
+def wants_async(request: Request, mode: str) -> bool:
+    return mode == "async" or "respond-async" in request.headers.get("Prefer", "")
+
+async def submit_analysis_job(request: Request, kind: str, body: Dict[str, Any], run, response_model) -> JSONResponse:
+    """建立分析工作並在背景執行，立即回傳 202 與工作狀態"""
+    job = await start_analysis_job(kind, body, run, response_model, request.headers.get("Idempotency-Key"))
+    return JSONResponse(status_code=202, content={
+        **job, "status_url": f"/api/jobs/{job['id']}", "events_url": f"/api/jobs/{job['id']}/events"
+    })
+
+async def start_analysis_job(kind: str, body: Dict[str, Any], run, response_model,
+                             idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """建立分析工作並在背景執行，回傳工作狀態
+    
+    帶 Idempotency-Key 時工作 ID 由 key 決定，重送同一請求會取得同一個工作而不重複呼叫模型。
+    """
+    if idempotency_key:
+        job_id = analysis_jobs.job_id_for(f"{tenancy.current_tenant.get() or ''}:{kind}", idempotency_key)
+    else:
+        job_id = generate_id()
+    job, created = await asyncio.to_thread(
+        analysis_store().create, job_id, kind, analysis_jobs.request_hash(kind, body)
+    )
+    if created:
+        task = asyncio.create_task(run_analysis_job(job_id, run, response_model))
+        _analysis_tasks.add(task)
+        task.add_done_callback(_analysis_tasks.discard)
+    return job
+
+async def run_analysis_job(job_id: str, run, response_model):
+    """在工作池中執行分析並寫入結果；關閉時與進行中的 AI 請求一起等待"""
+    store = analysis_store()
+    app.state.ai_inflight = getattr(app.state, "ai_inflight", 0) + 1
+    try:
+        async with analysis_slots():
+            await asyncio.to_thread(store.mark_running, job_id)
+            try:
+                result = response_model(**await run()).dict()
+            except Exception as e:
+                logger.error(f"Analysis job {job_id} failed: {e}")
+                await asyncio.to_thread(store.fail, job_id, str(e))
+            else:
+                await asyncio.to_thread(store.succeed, job_id, result)
+    finally:
+        app.state.ai_inflight -= 1
+
+def prepare_strokes(strokes: Optional[List[Dict[str, Any]]], keep_raw: Optional[bool]) -> Dict[str, Any]:
+    """儲存前的筆劃前處理：簡化後存入 strokes，需要時另存原始筆劃於 raw_strokes
+    
+    NumPy 計算量與筆劃點數成正比，端點以 asyncio.to_thread 呼叫，不阻塞事件迴圈。
+    """
+    simplified, _ = simplify_strokes(strokes, STROKE_SIMPLIFY_TOLERANCE, STROKE_RESAMPLE_SPACING)
+    prepared = {"strokes": simplified}
+    if strokes and (STROKE_KEEP_RAW if keep_raw is None else keep_raw):
+        prepared["raw_strokes"] = strokes
+    return prepared
+
 async def simulate_ai_response(message: str, context: Optional[Dict] = None) -> str:
     """模擬 AI 回應（實際應該調用真實的 AI API）"""
     
@@ -852,6 +1558,31 @@ async def health_check():
     """健康檢查"""
     return {"status": "ok", "timestamp": get_timestamp()}
 
+@app.get("/livez", include_in_schema=False)
+async def liveness():
+    """存活檢查：事件迴圈仍能回應即可，不檢查外部依賴"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/readyz", include_in_schema=False)
+async def readiness():
+    """就緒檢查：啟動完成、未在關閉中且資料庫可讀時才接受流量"""
+    if not getattr(app.state, "ready", False) or getattr(app.state, "draining", False):
+        status = "draining" if getattr(app.state, "draining", False) else "starting"
+        return JSONResponse(status_code=503, content={"status": status, "pid": os.getpid()})
+    
+    try:
+        await asyncio.to_thread(check_database)
+    except sqlite3.Error as e:
+        return JSONResponse(status_code=503, content={"status": "database_unavailable", "detail": str(e)})
+    return {"status": "ready", "pid": os.getpid(), "ai_inflight": app.state.ai_inflight}
+
+def check_database():
+    conn = connect_db()
+    try:
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+    finally:
+        conn.close()
+
 # ============ AI Key 驗證 API ============
 
 @app.post("/api/validate-key")
@@ -881,39 +1612,23 @@ async def validate_api_key(request: Request):
 # ============ AI 圖像分析 API ============
 
 @app.post("/api/analyze-image")
-async def analyze_image(request: Request) -> ImageAnalysisResponse:
-    """分析上傳的圖像並提供設計建議"""
+async def analyze_image(request: Request, mode: str = "sync") -> ImageAnalysisResponse:
+    """分析上傳的圖像並提供設計建議（mode=async 時立即回傳工作 ID）"""
     try:
         logger.info("Received image analysis request")
         
         # 讀取 request body
         body = await request.json()
-        image_data = body.get('image_data', '')
-        prompt = body.get('prompt', '請分析這個UI設計草圖')
+        settings = ai_settings(request)
+        if wants_async(request, mode):
+            return await submit_analysis_job(
+                request, "analyze-image", body, lambda: run_image_analysis(body, *settings), ImageAnalysisResponse
+            )
         
-        # 讀取自訂 AI 設定
-        provider = request.headers.get('X-AI-Provider', '').lower()
-        api_key = request.headers.get('X-API-Key', '')
-        model = request.headers.get('X-AI-Model', '')
-        
-        # 如果有提供自訂 API Key，使用自訂 AI
-        if provider and api_key:
-            if provider == 'gemini':
-                client = get_gemini_client(api_key, model or 'gemini-2.0-flash-exp')
-                result = await analyze_with_gemini(client, image_data, prompt)
-            elif provider == 'openai':
-                client = get_openai_client(api_key)
-                result = await analyze_with_openai(client, image_data, prompt, model or 'gpt-4o')
-            else:
-                result = {"success": False, "error": f"不支援的 Provider: {provider}"}
-        # 否則使用預設的環境變數 API Key
-        elif GEMINI_API_KEY:
-            result = await analyze_image_with_ai(image_data, prompt)
-        else:
-            result = fallback_image_analysis(image_data)
-        
-        return ImageAnalysisResponse(**result)
+        return ImageAnalysisResponse(**await run_image_analysis(body, *settings))
         
+    except analysis_jobs.IdempotencyConflict as e:
+        return JSONResponse(status_code=409, content={"detail": str(e)})
     except Exception as e:
         logger.error(f"Image analysis API error: {str(e)}")
         return ImageAnalysisResponse(
@@ -921,37 +1636,50 @@ async def analyze_image(request: Request) -> ImageAnalysisResponse:
             error=f"圖像分析失敗: {str(e)}"
         )
 
+def ai_settings(request: Request) -> tuple:
+    """讀取自訂 AI 設定（provider, api_key, model）"""
+    return (
+        request.headers.get('X-AI-Provider', '').lower(),
+        request.headers.get('X-API-Key', ''),
+        request.headers.get('X-AI-Model', ''),
+    )
+
+async def run_image_analysis(body: Dict[str, Any], provider: str, api_key: str, model: str) -> Dict[str, Any]:
+    image_data = body.get('image_data', '')
+    prompt = body.get('prompt', '請分析這個UI設計草圖')
+    
+    # 如果有提供自訂 API Key，使用自訂 AI
+    if provider and api_key:
+        if provider == 'gemini':
+            client = get_gemini_client(api_key, model or 'gemini-2.0-flash-exp')
+            return await analyze_with_gemini(client, image_data, prompt)
+        elif provider == 'openai':
+            client = get_openai_client(api_key)
+            return await analyze_with_openai(client, image_data, prompt, model or 'gpt-4o')
+        return {"success": False, "error": f"不支援的 Provider: {provider}"}
+    # 否則使用預設的環境變數 API Key
+    elif GEMINI_API_KEY:
+        return await analyze_image_with_ai(image_data, prompt)
+    return fallback_image_analysis(image_data)
+
 @app.post("/api/analyze-math", response_model=MathFormulaResponse)
-async def analyze_math_formula_api(request: Request) -> MathFormulaResponse:
-    """專門的數學公式分析API端點"""
+async def analyze_math_formula_api(request: Request, mode: str = "sync") -> MathFormulaResponse:
+    """專門的數學公式分析API端點（mode=async 時立即回傳工作 ID）"""
     logger.info("Received math formula analysis request")
     
     try:
         # 讀取 request body
         body = await request.json()
-        image_data = body.get('image_data', '')
-        
-        # 讀取自訂 AI 設定
-        provider = request.headers.get('X-AI-Provider', '').lower()
-        api_key = request.headers.get('X-API-Key', '')
-        model = request.headers.get('X-AI-Model', '')
-        
-        # 如果有提供自訂 API Key，使用自訂 AI
-        if provider and api_key:
-            if provider == 'gemini':
-                client = get_gemini_client(api_key, model or 'gemini-2.0-flash-exp')
-                result = await analyze_math_with_gemini(client, image_data)
-            elif provider == 'openai':
-                client = get_openai_client(api_key)
-                result = await analyze_math_with_openai(client, image_data, model or 'gpt-4o')
-            else:
-                result = {"success": False, "error": f"不支援的 Provider: {provider}"}
-        # 否則使用預設的環境變數 API Key
-        else:
-            result = await analyze_math_formula(image_data)
+        settings = ai_settings(request)
+        if wants_async(request, mode):
+            return await submit_analysis_job(
+                request, "analyze-math", body, lambda: run_math_analysis(body, *settings), MathFormulaResponse
+            )
         
-        return MathFormulaResponse(**result)
+        return MathFormulaResponse(**await run_math_analysis(body, *settings))
         
+    except analysis_jobs.IdempotencyConflict as e:
+        return JSONResponse(status_code=409, content={"detail": str(e)})
     except Exception as e:
         logger.error(f"Math formula analysis API error: {str(e)}")
         return MathFormulaResponse(
@@ -959,10 +1687,156 @@ async def analyze_math_formula_api(request: Request) -> MathFormulaResponse:
             error=f"數學公式分析失敗: {str(e)}"
         )
 
+async def run_math_analysis(body: Dict[str, Any], provider: str, api_key: str, model: str) -> Dict[str, Any]:
+    image_data = body.get('image_data', '')
+    
+    # 以已儲存的繪圖區域取代上傳圖片
+    drawing_id = body.get('drawing_id')
+    if drawing_id and not image_data:
+        try:
+            image_data = await asyncio.to_thread(
+                load_drawing_region, drawing_id, body.get('bbox'), body.get('lasso')
+            )
+        except RegionError as e:
+            return {"success": False, "error": str(e)}
+        if image_data is None:
+            return {"success": False, "error": "Drawing not found"}
+    
+    # 如果有提供自訂 API Key，使用自訂 AI
+    if provider and api_key:
+        if provider == 'gemini':
+            client = get_gemini_client(api_key, model or 'gemini-2.0-flash-exp')
+            return await analyze_math_with_gemini(client, image_data)
+        elif provider == 'openai':
+            client = get_openai_client(api_key)
+            return await analyze_math_with_openai(client, image_data, model or 'gpt-4o')
+        return {"success": False, "error": f"不支援的 Provider: {provider}"}
+    # 否則使用預設的環境變數 API Key
+    return await analyze_math_formula(image_data)
+
+def get_math_model_call(provider: str, api_key: str, model: str) -> Optional[math_batch.ModelCall]:
+    """建立批次辨識用的模型呼叫（多張依序編號的圖片）；未設定 AI 時回傳 None"""
+    if provider and api_key:
+        if provider == 'gemini':
+            client = get_gemini_client(api_key, model or 'gemini-2.0-flash-exp')
+        elif provider == 'openai':
+            client = get_openai_client(api_key)
+        else:
+            raise ValueError(f"不支援的 Provider: {provider}")
+    elif default_gemini_model():
+        provider, client = 'gemini', default_gemini_model()
+    else:
+        return None
+    
+    def call_gemini(images: List[str], prompt: str) -> str:
+        content = [prompt]
+        for number, image_data in enumerate(images, start=1):
+            content += [f"[[{number}]]", Image.open(io.BytesIO(decode_data_url(image_data)))]
+        return client.generate_content(content).text
+    
+    def call_openai(images: List[str], prompt: str) -> str:
+        content = [{"type": "text", "text": prompt}]
+        for number, image_data in enumerate(images, start=1):
+            if not image_data.startswith('data:image'):
+                image_data = f"data:image/png;base64,{image_data}"
+            content += [
+                {"type": "text", "text": f"[[{number}]]"},
+                {"type": "image_url", "image_url": {"url": image_data}}
+            ]
+        response = client.chat.completions.create(
+            model=model or "gpt-4o",
+            messages=[{"role": "user", "content": content}],
+            max_tokens=500 * len(images)
+        )
+        return response.choices[0].message.content
+    
+    call = call_gemini if provider == 'gemini' else call_openai
+    
+    async def call_model(images: List[str], prompt: str) -> str:
+        # SDK 為同步呼叫，放到執行緒中才能同時送出多個批次
+        return await asyncio.to_thread(call, images, prompt)
+    
+    return call_model
+
+@app.post("/api/analyze-math/batch", response_model=MathBatchResponse)
+async def analyze_math_batch_api(request: Request) -> MathBatchResponse:
+    """批次數學公式辨識：items 為圖片（image_data）或繪圖區域（drawing_id + bbox / lasso）
+    
+    多個項目打包成少數幾次模型呼叫並同時送出；個別項目失敗不影響其他項目。
+    """
+    body = await request.json()
+    items = body.get('items') or []
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(items) > math_batch.MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {math_batch.MAX_ITEMS} items per request")
+    
+    try:
+        call_model = get_math_model_call(
+            request.headers.get('X-AI-Provider', '').lower(),
+            request.headers.get('X-API-Key', ''),
+            request.headers.get('X-AI-Model', '')
+        )
+    except ValueError as e:
+        return MathBatchResponse(success=False, error=str(e))
+    if call_model is None:
+        return MathBatchResponse(success=False, error="GEMINI_API_KEY 未設置，無法進行數學公式分析")
+    
+    # 準備每個項目的圖片；項目層級的錯誤直接記錄，不中止整批
+    errors: Dict[int, str] = {}
+    
+    async def load_item(index: int, item: Any) -> Optional[str]:
+        if not isinstance(item, dict):
+            errors[index] = "Invalid item"
+            return None
+        if item.get('image_data'):
+            # 先解碼驗證，損壞的圖片只讓這個項目失敗，不拖累同一批次的其他項目
+            try:
+                await asyncio.to_thread(verify_image, item['image_data'])
+            except Exception as e:
+                errors[index] = f"Invalid image data: {e}"
+                return None
+            return item['image_data']
+        drawing_id = item.get('drawing_id') or body.get('drawing_id')
+        if not drawing_id:
+            errors[index] = "image_data or drawing_id is required"
+            return None
+        try:
+            image_data = await asyncio.to_thread(load_drawing_region, drawing_id, item.get('bbox'), item.get('lasso'))
+        except RegionError as e:
+            errors[index] = str(e)
+            return None
+        if image_data is None:
+            errors[index] = "Drawing not found"
+        return image_data
+    
+    images = await asyncio.gather(*(load_item(index, item) for index, item in enumerate(items)))
+    batch = await math_batch.recognize_batch(
+        list(images), call_model, interpret_math_output,
+        batch_size=MATH_BATCH_SIZE, concurrency=MATH_BATCH_CONCURRENCY
+    )
+    
+    results = [
+        MathBatchItemResult(index=index, **batch["results"].get(index, {"success": False, "error": errors.get(index)}))
+        for index in range(len(items))
+    ]
+    succeeded = sum(result.success for result in results)
+    
+    return MathBatchResponse(
+        success=succeeded == len(results),
+        partial=0 < succeeded < len(results),
+        results=results,
+        model_calls=batch["model_calls"]
+    )
+
 # ============ 聊天 API ============
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def send_chat_message(message: ChatMessage, db: sqlite3.Connection = Depends(get_db)):
+async def send_chat_message(
+    message: ChatMessage,
+    db: sqlite3.Connection = Depends(get_db),
+    store: storage.Storage = Depends(get_storage)
+):
     """發送聊天訊息"""
     logger.info("Received chat message: %s", message.dict())
     try:
@@ -970,46 +1844,33 @@ async def send_chat_message(message: ChatMessage, db: sqlite3.Connection = Depen
         conversation_id = message.conversation_id or generate_id()
         logger.info("Using conversation ID: %s", conversation_id)
         
-        # 儲存使用者訊息
+        # 已封存的會話先還原，新訊息才會與舊訊息放在一起
+        if message.conversation_id:
+            await asyncio.to_thread(ensure_conversation_hot, db, conversation_id)
+        
         user_msg_id = generate_id()
         timestamp = get_timestamp()
         
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO chat_messages (id, conversation_id, sender, message, message_type, timestamp, context)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user_msg_id, conversation_id, "user", message.message, 
-            message.type, timestamp, json.dumps(message.context or {})
-        ))
-        logger.info("User message saved with ID: %s", user_msg_id)
-        
-        # 生成 AI 回應
+        # 先生成 AI 回應再寫入：等待模型時不占用資料庫寫入鎖
         ai_response = await simulate_ai_response(message.message, message.context)
         logger.info("Generated AI response: %s", ai_response)
         
-        # 儲存 AI 回應
         ai_msg_id = generate_id()
-        cursor.execute("""
-            INSERT INTO chat_messages (id, conversation_id, sender, message, message_type, timestamp, context)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            ai_msg_id, conversation_id, "assistant", ai_response, 
-            "text", timestamp + 1, json.dumps({})
-        ))
-        logger.info("AI response saved with ID: %s", ai_msg_id)
-        
-        # 更新或創建會話
-        cursor.execute("""
-            INSERT OR REPLACE INTO conversations (id, title, created_at, updated_at, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            conversation_id, message.message[:50] + "..." if len(message.message) > 50 else message.message,
-            timestamp, timestamp, json.dumps({})
-        ))
-        logger.info("Conversation updated with ID: %s", conversation_id)
-        
-        db.commit()
+        await store.chat.append_messages(
+            conversation_id, conversation_title(message.message),
+            [
+                {
+                    "id": user_msg_id, "sender": "user", "message": message.message,
+                    "message_type": message.type, "timestamp": timestamp, "context": message.context,
+                },
+                {
+                    "id": ai_msg_id, "sender": "assistant", "message": ai_response,
+                    "message_type": "text", "timestamp": timestamp + 1,
+                },
+            ],
+            timestamp,
+        )
+        logger.info("Messages %s and %s saved to conversation %s", user_msg_id, ai_msg_id, conversation_id)
         
         return ChatResponse(
             id=ai_msg_id,
@@ -1022,49 +1883,130 @@ async def send_chat_message(message: ChatMessage, db: sqlite3.Connection = Depen
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/chat/conversations")
-async def get_conversations(db: sqlite3.Connection = Depends(get_db)):
+async def get_conversations(store: storage.Storage = Depends(get_storage)):
     """取得會話列表"""
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT id, title, created_at, updated_at 
-        FROM conversations 
-        ORDER BY updated_at DESC 
-        LIMIT 50
-    """)
+    return {"conversations": await store.chat.list_conversations(50)}
+
+# 會話訊息視窗大小（預設與上限）與匯出時每批讀取的訊息數
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX = 200
+MESSAGE_EXPORT_BATCH = 500
+
+def message_cursor(message: Dict[str, Any]) -> str:
+    """訊息游標：<timestamp>:<id>（同一輪的訊息時間戳可能相同，以 id 決定穩定順序）"""
+    return f"{message['timestamp']}:{message['id']}"
+
+def parse_message_cursor(value: str) -> tuple:
+    timestamp, _, message_id = value.partition(":")
+    try:
+        return int(timestamp), message_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {value}")
+
+# 搜尋結果的會話數上限與每個會話顯示的訊息數上限
+SEARCH_MAX_CONVERSATIONS = 50
+SEARCH_MAX_MATCHES = 10
+
+@app.get("/api/chat/search")
+async def search_chat_messages(
+    q: str,
+    limit: int = 10,
+    per_conversation: int = 3,
+    db: sqlite3.Connection = Depends(get_db)
+):
+    """搜尋聊天記錄（含已封存的會話），依會話分組、依相關度排序並附上標示命中處的片段"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    if not 1 <= limit <= SEARCH_MAX_CONVERSATIONS or not 1 <= per_conversation <= SEARCH_MAX_MATCHES:
+        raise HTTPException(status_code=400, detail="limit or per_conversation out of range")
     
-    conversations = []
-    for row in cursor.fetchall():
-        conversations.append({
-            "id": row[0],
-            "title": row[1],
-            "created_at": row[2],
-            "updated_at": row[3]
-        })
+    # 先補上剛寫入但尚未索引的訊息（最多幾批，其餘交給背景工作）
+    await asyncio.to_thread(index_chat_messages, 2)
     
-    return {"conversations": conversations}
+    results = await asyncio.to_thread(
+        chat_search.search, search_index_path(), q, min(limit * per_conversation * 4, 1000)
+    )
+    groups = chat_search.group_by_conversation(results, limit, per_conversation)
+    
+    if groups:
+        ids = [group["conversation_id"] for group in groups]
+        rows = db.execute(
+            f"SELECT id, title, updated_at, is_archived FROM conversations WHERE id IN ({', '.join('?' for _ in ids)})",
+            ids
+        ).fetchall()
+        details = {row[0]: row for row in rows}
+        for group in groups:
+            row = details.get(group["conversation_id"])
+            group["title"] = row[1] if row else None
+            group["updated_at"] = row[2] if row else None
+            group["archived"] = bool(row[3]) if row else False
+    
+    return {"query": q, "conversations": groups}
 
 @app.get("/api/chat/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, db: sqlite3.Connection = Depends(get_db)):
-    """取得會話訊息"""
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT id, sender, message, message_type, timestamp 
-        FROM chat_messages 
-        WHERE conversation_id = ? 
-        ORDER BY timestamp ASC
-    """, (conversation_id,))
-    
-    messages = []
-    for row in cursor.fetchall():
-        messages.append({
-            "id": row[0],
-            "sender": row[1],
-            "content": row[2],
-            "type": row[3],
-            "timestamp": row[4]
-        })
-    
-    return {"messages": messages}
+async def get_conversation_messages(
+    conversation_id: str,
+    limit: int = MESSAGE_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: sqlite3.Connection = Depends(get_db),
+    store: storage.Storage = Depends(get_storage)
+):
+    """取得會話訊息（視窗載入，依時間順序回傳）
+    
+    預設回傳最新的 limit 則；before=<cursor> 往前載入較舊的訊息，after=<cursor> 載入之後的新訊息。
+    has_more 表示同方向還有訊息，可用 next_before / next_after 繼續載入。
+    """
+    if not 1 <= limit <= MESSAGE_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MESSAGE_PAGE_MAX}")
+    before_key = parse_message_cursor(before) if before else None
+    after_key = parse_message_cursor(after) if after else None
+    
+    await asyncio.to_thread(ensure_conversation_hot, db, conversation_id)
+    
+    # 多取一則判斷是否還有更多
+    messages = await store.chat.get_messages(conversation_id, limit + 1, before_key, after_key)
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[:limit] if after_key else messages[1:]
+    
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "next_before": message_cursor(messages[0]) if messages else before,
+        "next_after": message_cursor(messages[-1]) if messages else after,
+    }
+
+@app.get("/api/chat/conversations/{conversation_id}/export")
+async def export_conversation(conversation_id: str, db: sqlite3.Connection = Depends(get_db)):
+    """以 NDJSON 串流匯出會話的所有訊息（每行一則，依時間順序）
+    
+    分批以鍵集查詢讀取，記憶體用量與會話長度無關，也不會長時間占用讀取交易。
+    """
+    exists = db.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    await asyncio.to_thread(ensure_conversation_hot, db, conversation_id)
+    path = database_path()
+    
+    def stream():
+        conn = connect_db(path=path)
+        try:
+            cursor = None
+            while True:
+                batch = fetch_messages(conn, conversation_id, MESSAGE_EXPORT_BATCH, after=cursor, oldest_first=True)
+                if not batch:
+                    break
+                yield "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in batch)
+                cursor = (batch[-1]["timestamp"], batch[-1]["id"])
+        finally:
+            conn.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversation-{conversation_id}.ndjson"'}
+    )
 
 # ============ 範例 API ============
 
@@ -1074,63 +2016,50 @@ async def get_examples(
     search: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
-    db: sqlite3.Connection = Depends(get_db)
+    sort: str = "newest",
+    fields: Optional[str] = None,
+    db: sqlite3.Connection = Depends(get_catalog_db)
 ):
-    """取得範例列表"""
+    """取得範例列表（摘要投影，不含 files / metadata；sort=newest|popular|trending）"""
     offset = (page - 1) * limit
-    
-    # 建構查詢
-    query = "SELECT * FROM examples WHERE 1=1"
+    columns = select_fields(fields, EXAMPLE_SUMMARY_FIELDS)
+    if category == 'all':
+        category = None
+    if sort not in SORT_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort: {sort}")
+    
+    cache_key = ("examples", category, search, sort, page, limit, tuple(columns))
+    example_invalidations.sync(db)
+    cached = example_cache.get(cache_key)
+    if cached is not None:
+        return cached_json_response(cached, "HIT")
+    generation = example_cache.generation
+    
+    # 建構查詢條件
+    where = " WHERE 1=1"
     params = []
     
-    if category and category != 'all':
-        query += " AND category = ?"
+    if category:
+        where += " AND category = ?"
         params.append(category)
     
     if search:
-        query += " AND (title LIKE ? OR description LIKE ? OR tags LIKE ?)"
+        where += " AND (title LIKE ? OR description LIKE ? OR tags LIKE ?)"
         search_term = f"%{search}%"
         params.extend([search_term, search_term, search_term])
     
-    query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
-    
     cursor = db.cursor()
-    cursor.execute(query, params)
-    
-    examples = []
-    for row in cursor.fetchall():
-        examples.append({
-            "id": row[0],
-            "title": row[1],
-            "description": row[2],
-            "category": row[3],
-            "tags": json.loads(row[4] or "[]"),
-            "thumbnail": row[5],
-            "files": json.loads(row[6] or "[]"),
-            "likes": row[7],
-            "downloads": row[8],
-            "created_at": row[9],
-            "author": row[10]
-        })
+    cursor.execute(
+        f"SELECT {', '.join(columns)} FROM examples{where} ORDER BY {SORT_ORDERS[sort]} LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    )
+    examples = [project_row(row, columns) for row in cursor.fetchall()]
     
     # 取得總數
-    count_query = "SELECT COUNT(*) FROM examples WHERE 1=1"
-    count_params = []
-    
-    if category and category != 'all':
-        count_query += " AND category = ?"
-        count_params.append(category)
-    
-    if search:
-        count_query += " AND (title LIKE ? OR description LIKE ? OR tags LIKE ?)"
-        search_term = f"%{search}%"
-        count_params.extend([search_term, search_term, search_term])
-    
-    cursor.execute(count_query, count_params)
+    cursor.execute(f"SELECT COUNT(*) FROM examples{where}", params)
     total = cursor.fetchone()[0]
     
-    return {
+    body = serialize_json({
         "examples": examples,
         "pagination": {
             "page": page,
@@ -1138,125 +2067,283 @@ async def get_examples(
             "total": total,
             "pages": (total + limit - 1) // limit
         }
-    }
+    })
+    
+    # 搜尋結果可能因任何新範例而改變；一般列表只受同類別影響
+    tags = ["examples:search"] if search else [example_list_tag(category)]
+    if sort != "newest":
+        tags.append("examples:ranked")
+    tags.extend(f"example:{item['id']}" for item in examples)
+    example_cache.set(cache_key, body, tags, generation)
+    
+    return cached_json_response(body, "MISS")
 
 @app.get("/api/examples/{example_id}")
-async def get_example(example_id: str, db: sqlite3.Connection = Depends(get_db)):
+async def get_example(
+    example_id: str, fields: Optional[str] = None,
+    db: sqlite3.Connection = Depends(get_catalog_db), store: storage.Storage = Depends(get_catalog_storage)
+):
     """取得單一範例詳情"""
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM examples WHERE id = ?", (example_id,))
-    row = cursor.fetchone()
+    columns = select_fields(fields, EXAMPLE_DETAIL_FIELDS)
     
+    cache_key = ("example", example_id, tuple(columns))
+    example_invalidations.sync(db)
+    cached = example_cache.get(cache_key)
+    if cached is not None:
+        return cached_json_response(cached, "HIT")
+    generation = example_cache.generation
+    
+    row = await store.examples.get(example_id, columns)
     if not row:
         raise HTTPException(status_code=404, detail="Example not found")
     
-    return {
-        "id": row[0],
-        "title": row[1],
-        "description": row[2],
-        "category": row[3],
-        "tags": json.loads(row[4] or "[]"),
-        "thumbnail": row[5],
-        "files": json.loads(row[6] or "[]"),
-        "likes": row[7],
-        "downloads": row[8],
-        "created_at": row[9],
-        "author": row[10],
-        "metadata": json.loads(row[11] or "{}")
-    }
+    body = serialize_json(project_row(row, columns))
+    example_cache.set(cache_key, body, [f"example:{example_id}"], generation)
+    
+    return cached_json_response(body, "MISS")
 
 @app.post("/api/examples")
-async def create_example(example: Example, db: sqlite3.Connection = Depends(get_db)):
+async def create_example(
+    example: Example,
+    db: sqlite3.Connection = Depends(get_catalog_db), store: storage.Storage = Depends(get_catalog_storage)
+):
     """創建新範例"""
     example_id = generate_id()
     timestamp = get_timestamp()
     
+    await store.examples.create({
+        "id": example_id,
+        "title": example.title,
+        "description": example.description,
+        "category": example.category,
+        "tags": json.dumps(example.tags),
+        "thumbnail": example.thumbnail,
+        "files": json.dumps(example.files or []),
+        "file_count": len(example.files or []),
+        "likes": 0,
+        "downloads": 0,
+        "popularity_score": popularity_score(0, 0, 0),
+        "trending_score": trending_score(0, 0, 0, timestamp),
+        "created_at": timestamp,
+        "author": "User",
+        "metadata": json.dumps(example.metadata or {}),
+    })
+    invalidate_examples(
+        db, example_list_tag(example.category), example_list_tag(None), "examples:search", "examples:ranked"
+    )
+    # 新範例寫入時已帶有分數；全表重算只由 maintenance_loop 定期執行
+    
+    return {"id": example_id, "message": "Example created successfully"}
+
+@app.post("/api/examples/{example_id}/{action}")
+async def bump_example_counter(example_id: str, action: str, db: sqlite3.Connection = Depends(get_catalog_db)):
+    """遞增範例計數（like / download / view），回傳含待寫入增量的最新數值"""
+    field = COUNTER_ACTIONS.get(action)
+    if not field:
+        raise HTTPException(status_code=404, detail=f"Unknown counter action: {action}")
+    
     cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO examples 
-        (id, title, description, category, tags, thumbnail, files, likes, downloads, created_at, author, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        example_id, example.title, example.description, example.category,
-        json.dumps(example.tags), example.thumbnail, json.dumps(example.files or []),
-        0, 0, timestamp, "User", json.dumps(example.metadata or {})
-    ))
+    cursor.execute("SELECT likes, downloads, views FROM examples WHERE id = ?", (example_id,))
+    row = cursor.fetchone()
     
-    db.commit()
+    if not row:
+        raise HTTPException(status_code=404, detail="Example not found")
     
-    return {"id": example_id, "message": "Example created successfully"}
+    counter_service.increment(example_id, field)
+    
+    return {"id": example_id, **counter_service.merge(example_id, dict(row))}
+
+@app.get("/api/examples/{example_id}/counters")
+async def get_example_counters(example_id: str, db: sqlite3.Connection = Depends(get_catalog_db)):
+    """取得範例計數（合併尚未寫回的增量）"""
+    cursor = db.cursor()
+    cursor.execute("SELECT likes, downloads, views FROM examples WHERE id = ?", (example_id,))
+    row = cursor.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Example not found")
+    
+    return {"id": example_id, **counter_service.merge(example_id, dict(row))}
 
 # ============ 繪圖 API ============
 
 @app.post("/api/drawings")
-async def save_drawing(drawing: DrawingData, db: sqlite3.Connection = Depends(get_db)):
+async def save_drawing(drawing: DrawingData, store: storage.Storage = Depends(get_storage)):
     """儲存繪圖"""
     drawing_id = generate_id()
     timestamp = get_timestamp()
+    prepared = await asyncio.to_thread(prepare_strokes, drawing.strokes, drawing.keep_raw)
+    
+    await store.drawings.create({
+        "id": drawing_id,
+        "title": f"Drawing {datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}",
+        "drawing_data": json.dumps({**prepared, "canvas": drawing.canvas}),
+        "thumbnail": drawing.image_data,  # 保存 base64 圖像數據到 thumbnail 字段
+        "created_at": timestamp,
+        "updated_at": timestamp,
+        "metadata": json.dumps(drawing.metadata or {}),
+        "stroke_count": len(drawing.strokes or []),
+    })
+    schedule_thumbnails(drawing_id)
+    
+    return {"id": drawing_id, "revision": 0, "message": "Drawing saved successfully"}
+
+@app.put("/api/drawings/{drawing_id}")
+async def update_drawing(drawing_id: str, drawing: DrawingData, db: sqlite3.Connection = Depends(get_db)):
+    """以完整內容覆寫繪圖（新快照）"""
+    prepared = await asyncio.to_thread(prepare_strokes, drawing.strokes, drawing.keep_raw)
+    revision = drawing_store.replace_snapshot(
+        db, drawing_id,
+        {**prepared, "canvas": drawing.canvas},
+        thumbnail=drawing.image_data,
+        metadata=json.dumps(drawing.metadata or {})
+    )
     
-    cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO drawings (id, title, drawing_data, thumbnail, created_at, updated_at, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        drawing_id, 
-        f"Drawing {datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}",
-        json.dumps({
-            "strokes": drawing.strokes,
-            "canvas": drawing.canvas
-        }),
-        drawing.image_data,  # 保存 base64 圖像數據到 thumbnail 字段
-        timestamp, timestamp,
-        json.dumps(drawing.metadata or {})
-    ))
-    
-    db.commit()
-    
-    return {"id": drawing_id, "message": "Drawing saved successfully"}
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    
+    schedule_thumbnails(drawing_id)
+    sync_drawing_topic(db, drawing_id)
+    
+    return {"id": drawing_id, "revision": revision, "message": "Drawing updated successfully"}
 
-@app.get("/api/drawings/{drawing_id}")
-async def load_drawing(drawing_id: str, db: sqlite3.Connection = Depends(get_db)):
-    """載入繪圖"""
+@app.patch("/api/drawings/{drawing_id}")
+async def patch_drawing(drawing_id: str, patch: DrawingPatch, db: sqlite3.Connection = Depends(get_db)):
+    """自動儲存：只附加自 base_revision 以來新增的筆劃與復原標記"""
+    prepared = await asyncio.to_thread(prepare_strokes, patch.strokes, patch.keep_raw)
+    try:
+        revision = drawing_store.append_delta(
+            db, drawing_id, patch.base_revision,
+            strokes=prepared["strokes"], undo=patch.undo, canvas=patch.canvas,
+            raw_strokes=prepared.get("raw_strokes")
+        )
+    except drawing_store.RevisionConflict as e:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Revision conflict", "revision": e.current_revision}
+        )
+    
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    
+    schedule_thumbnails(drawing_id)
+    sync_drawing_topic(db, drawing_id)
+    
+    return {"id": drawing_id, "revision": revision}
+
+@app.get("/api/drawings/{drawing_id}/deltas")
+async def get_drawing_deltas(drawing_id: str, since: int = 0, db: sqlite3.Connection = Depends(get_db)):
+    """取得指定版本之後的增量（已壓縮進快照的版本需改用完整載入）"""
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM drawings WHERE id = ?", (drawing_id,))
+    cursor.execute("SELECT revision, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,))
     row = cursor.fetchone()
     
     if not row:
         raise HTTPException(status_code=404, detail="Drawing not found")
     
-    drawing_data = json.loads(row[2])
+    if since < (row["snapshot_revision"] or 0):
+        return JSONResponse(
+            status_code=410,
+            content={"detail": "Revisions already compacted", "revision": row["revision"]}
+        )
     
     return {
-        "id": row[0],
-        "title": row[1],
-        "drawing_data": drawing_data,
-        "created_at": row[4],
-        "updated_at": row[5],
-        "metadata": json.loads(row[6] or "{}")
+        "id": drawing_id,
+        "revision": row["revision"],
+        "deltas": drawing_store.load_deltas(db, drawing_id, since)
     }
 
-@app.get("/api/drawings")
-async def get_drawings(page: int = 1, limit: int = 10, db: sqlite3.Connection = Depends(get_db)):
-    """取得繪圖列表"""
-    offset = (page - 1) * limit
+@app.post("/api/drawings/{drawing_id}/strokes/query")
+async def query_drawing_strokes(drawing_id: str, query: StrokeRegionQuery, db: sqlite3.Connection = Depends(get_db)):
+    """區域查詢：回傳與矩形或套索區域相交（或完全落在其中）的筆劃 ID 與位置"""
+    if query.mode not in spatial.QUERY_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {query.mode}")
+    try:
+        region = Region.parse(query.bbox, query.lasso)
+    except RegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    index = await asyncio.to_thread(spatial.current_index, db, drawing_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    
+    if region.polygon is None:
+        revision = index.revision
+        positions = index.query(region.bbox, query.mode).tolist()
+        stroke_ids = [index.stroke_ids[position] for position in positions]
+    else:
+        # 套索需要筆劃座標，只對外框命中的筆劃逐點判斷
+        revision, drawing_data = await asyncio.to_thread(load_current_drawing, db, drawing_id)
+        positions = await asyncio.to_thread(
+            select_region_strokes, drawing_id, revision, drawing_data, region, query.mode
+        )
+        stroke_ids = [drawing_data["strokes"][position].get("id") for position in positions]
+    
+    return {"id": drawing_id, "revision": revision, "positions": positions, "stroke_ids": stroke_ids}
+
+@app.get("/api/drawings/{drawing_id}/thumbnail")
+async def get_drawing_thumbnail(drawing_id: str, size: str = "medium", db: sqlite3.Connection = Depends(get_db)):
+    """取得伺服器繪製的縮圖（small / medium / large）"""
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown size: {size}")
     
     cursor = db.cursor()
-    cursor.execute("""
-        SELECT id, title, thumbnail, created_at, updated_at
-        FROM drawings 
-        ORDER BY updated_at DESC 
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
+    cursor.execute("SELECT revision FROM drawings WHERE id = ?", (drawing_id,))
+    row = cursor.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    
+    revision = row["revision"] or 0
+    path = thumbnail_path(drawing_id, revision, size)
+    if not path.exists():
+        revision = await asyncio.to_thread(render_thumbnails, drawing_id, (size,))
+        if revision is None:
+            raise HTTPException(status_code=404, detail="Drawing not found")
+        path = thumbnail_path(drawing_id, revision, size)
+    
+    return FileResponse(path, media_type="image/png", headers={"ETag": f'"{drawing_id}-r{revision}-{size}"'})
+
+@app.get("/api/drawings/{drawing_id}")
+async def load_drawing(drawing_id: str, fields: Optional[str] = None, db: sqlite3.Connection = Depends(get_db)):
+    """載入繪圖（快照加上尚未壓縮的增量）"""
+    columns = select_fields(fields, DRAWING_DETAIL_FIELDS)
+    
+    cursor = db.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)}, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,))
+    row = cursor.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    
+    drawing = project_row(row, columns)
+    if "drawing_data" in drawing:
+        drawing["drawing_data"] = drawing_store.materialize(
+            db, drawing_id, drawing["drawing_data"], row["snapshot_revision"] or 0
+        )
+    
+    return drawing
+
+@app.get("/api/drawings")
+async def get_drawings(
+    page: int = 1,
+    limit: int = 10,
+    fields: Optional[str] = None,
+    store: storage.Storage = Depends(get_storage)
+):
+    """取得繪圖列表（摘要投影，不含 drawing_data 與 base64 縮圖，改附縮圖網址）"""
+    offset = (page - 1) * limit
+    columns = select_fields(fields, DRAWING_SUMMARY_FIELDS + ("thumbnail_url",))
+    with_thumbnail_url = "thumbnail_url" in columns
+    if with_thumbnail_url:
+        columns.remove("thumbnail_url")
     
     drawings = []
-    for row in cursor.fetchall():
-        drawings.append({
-            "id": row[0],
-            "title": row[1],
-            "thumbnail": row[2],
-            "created_at": row[3],
-            "updated_at": row[4]
-        })
+    for row in await store.drawings.list(columns, limit, offset):
+        drawing = project_row(row, columns)
+        if with_thumbnail_url:
+            drawing["thumbnail_url"] = f"/api/drawings/{drawing['id']}/thumbnail?size=small"
+        drawings.append(drawing)
     
     return {"drawings": drawings}
 
@@ -1291,18 +2378,303 @@ async def simulate_analyze_image(data: Dict[str, Any]):
     
     return analysis_result
 
+# ============ 背景工作 API ============
+
+@app.get("/api/jobs/metrics")
+async def get_job_metrics():
+    """背景工作佇列的狀態（各狀態與種類的工作數、等待時間、近一小時的執行時間與重試次數）"""
+    return await asyncio.to_thread(lambda: job_queue().metrics())
+
+@app.get("/api/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """查詢非同步分析工作（完成後含 result，保留 ANALYSIS_JOB_TTL 秒）"""
+    job = await asyncio.to_thread(analysis_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str, request: Request):
+    """以 Server-Sent Events 推送工作狀態：狀態改變時送出 status，完成時送出 done 後結束"""
+    store = analysis_store()
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    async def events():
+        last_sent = time.monotonic()
+        async for event, current in watch_analysis_job(job_id, job):
+            if event:
+                yield f"event: {event}\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > 15:
+                # 保持連線（代理伺服器的閒置逾時）
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            if await request.is_disconnected():
+                return
+    
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def watch_analysis_job(job_id: str, job: Optional[Dict[str, Any]] = None, status: Optional[str] = None):
+    """每 JOB_EVENT_INTERVAL 秒讀取一次工作，產生 (event, job)
+    
+    狀態改變時 event 為 status，完成時為 done（之後結束），工作已過期時為 expired；
+    狀態沒有改變時 event 為 None（讓呼叫端有機會送出保持連線的訊息）。
+    status 為呼叫端已知的狀態，相同時不再產生事件。
+    """
+    store = analysis_store()
+    current = job if job is not None else await asyncio.to_thread(store.get, job_id)
+    while True:
+        if current is None:
+            yield "expired", {}
+            return
+        finished = current["status"] in analysis_jobs.FINISHED
+        if current["status"] != status:
+            status = current["status"]
+            yield ("done" if finished else "status"), current
+        else:
+            yield None, current
+        if finished:
+            return
+        await asyncio.sleep(JOB_EVENT_INTERVAL)
+        current = await asyncio.to_thread(store.get, job_id)
+
+# ============ WebSocket 即時通道 ============
+
+# 本行程的即時連線與繪圖訂閱；變更一律從資料庫讀出後推送，其他 worker 的寫入由 realtime_poll_loop 補上
+realtime_hub = realtime.Hub()
+
+def parse_frame(model, payload: Dict[str, Any]):
+    try:
+        return model(**payload)
+    except ValidationError as e:
+        raise realtime.RequestError(422, json.loads(e.json()))
+
+async def call_endpoint(endpoint, *args) -> Any:
+    """呼叫 REST 端點的處理函式，將 HTTPException 與錯誤回應轉為 error 訊框"""
+    try:
+        result = await endpoint(*args)
+    except HTTPException as e:
+        raise realtime.RequestError(e.status_code, e.detail)
+    if isinstance(result, Response):
+        content = json.loads(result.body)
+        if result.status_code >= 400:
+            raise realtime.RequestError(result.status_code, content.pop("detail", None), **content)
+        return content
+    if isinstance(result, BaseModel):
+        return result.dict()
+    return result
+
+def drawing_topic(drawing_id: str) -> str:
+    return f"drawing:{tenancy.current_tenant.get() or ''}:{drawing_id}"
+
+def read_drawing_changes(db: sqlite3.Connection, drawing_id: str, seen: Optional[int]):
+    """讀取繪圖目前的版本與 seen 之後的增量：(revision, deltas)；繪圖不存在時回傳 None
+    
+    只讀取資料庫、不碰 realtime_hub，可在執行緒中呼叫。增量已被快照取代時 deltas 為空串列。
+    """
+    row = db.execute("SELECT revision, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,)).fetchone()
+    if row is None:
+        return None
+    revision = row["revision"] or 0
+    if seen is None or revision <= seen or seen < (row["snapshot_revision"] or 0):
+        return revision, []
+    return revision, drawing_store.load_deltas(db, drawing_id, seen)
+
+def publish_drawing_changes(topic: str, changes) -> Optional[int]:
+    """將主題的訂閱者推進到 read_drawing_changes 讀到的版本，回傳該版本（繪圖不存在時為 None）
+    
+    必須在事件迴圈中呼叫（Connection 的送出佇列不是執行緒安全的）。增量依版本順序推送，
+    讀取之後本行程已推送的版本會略過；送出 stroke 的連線不會收到自己的增量；
+    缺少的增量已被快照取代（PUT 或壓縮）時改送 resync。
+    """
+    if changes is None:
+        return None
+    revision, deltas = changes
+    seen = realtime_hub.revisions.get(topic)
+    if seen is None or revision <= seen:
+        return revision
+    
+    author = realtime.current_connection.get()
+    deltas = [delta for delta in deltas if delta["revision"] > seen]
+    if deltas and [d["revision"] for d in deltas] == list(range(seen + 1, seen + 1 + len(deltas))):
+        for delta in deltas:
+            realtime_hub.publish(topic, "delta", {
+                "drawing_id": topic.split(":", 2)[2], "base_revision": delta["revision"] - 1,
+                "revision": delta["revision"], "strokes": delta["strokes"], "undo": delta["undo"],
+                "canvas": delta.get("canvas"),
+            }, exclude=author)
+        revision = max(revision, deltas[-1]["revision"])
+    else:
+        realtime_hub.publish(topic, "resync", {"topics": [topic]}, exclude=author)
+    realtime_hub.revisions[topic] = revision
+    return revision
+
+def sync_drawing_topic(db: sqlite3.Connection, drawing_id: str) -> Optional[int]:
+    """PATCH／PUT（REST 或 stroke 訊框）寫入後推送給本行程的訂閱者，回傳目前版本"""
+    topic = drawing_topic(drawing_id)
+    return publish_drawing_changes(topic, read_drawing_changes(db, drawing_id, realtime_hub.revisions.get(topic)))
+
+def read_tenant_drawing_changes(tenant: str, seen: Dict[str, Optional[int]]) -> Dict[str, Any]:
+    """在執行緒中讀取同一個租戶多個繪圖的變更：{drawing_id: read_drawing_changes 的結果}"""
+    token = tenancy.current_tenant.set(tenant or None)
+    try:
+        with tenant_connection() as db:
+            return {drawing_id: read_drawing_changes(db, drawing_id, last) for drawing_id, last in seen.items()}
+    finally:
+        tenancy.current_tenant.reset(token)
+
+async def poll_drawing_topics():
+    """推送本行程訂閱中的繪圖在其他 worker 上的寫入（資料庫讀取在執行緒中進行，推送回到事件迴圈）"""
+    by_tenant: Dict[str, Dict[str, Optional[int]]] = {}
+    for topic in list(realtime_hub.topics):
+        if topic.startswith("drawing:"):
+            _, tenant, drawing_id = topic.split(":", 2)
+            by_tenant.setdefault(tenant, {})[drawing_id] = realtime_hub.revisions.get(topic)
+    
+    for tenant, seen in by_tenant.items():
+        try:
+            changes = await asyncio.to_thread(read_tenant_drawing_changes, tenant, seen)
+        except Exception as e:
+            logger.error(f"Realtime poll failed for tenant {tenant or '(catalog)'}: {e}")
+            continue
+        for drawing_id, change in changes.items():
+            publish_drawing_changes(f"drawing:{tenant}:{drawing_id}", change)
+
+async def realtime_poll_loop():
+    """背景檢查訂閱中的繪圖（每個 worker 各自執行，只讀取本行程有人訂閱的繪圖）"""
+    while True:
+        await asyncio.sleep(WS_DELTA_POLL_INTERVAL)
+        if realtime_hub.topics:
+            await poll_drawing_topics()
+
+def required_field(payload: Dict[str, Any], name: str) -> str:
+    value = payload.get(name)
+    if not isinstance(value, str) or not value:
+        raise realtime.RequestError(422, f"Missing {name}")
+    return value
+
+async def ws_chat(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    """["chat", ref, ChatMessage] -> ChatResponse"""
+    message = parse_frame(ChatMessage, payload)
+    app.state.ai_inflight = getattr(app.state, "ai_inflight", 0) + 1
+    try:
+        with tenant_connection() as db:
+            return await call_endpoint(send_chat_message, message, db, storage.SQLiteStorage(db))
+    finally:
+        app.state.ai_inflight -= 1
+
+async def ws_stroke(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    """["stroke", ref, {drawing_id, ...DrawingPatch}] -> {id, revision}；其他訂閱者收到 delta"""
+    drawing_id = required_field(payload, "drawing_id")
+    patch = parse_frame(DrawingPatch, payload)
+    with tenant_connection() as db:
+        return await call_endpoint(patch_drawing, drawing_id, patch, db)
+
+async def ws_subscribe(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    """["sub", ref, {drawing_id}] -> {drawing_id, revision}；之後推送其他人的 delta"""
+    drawing_id = required_field(payload, "drawing_id")
+    topic = drawing_topic(drawing_id)
+    with tenant_connection() as db:
+        # 先將既有訂閱者推進到目前版本，新訂閱者從回覆的版本開始接收
+        revision = sync_drawing_topic(db, drawing_id)
+    if revision is None:
+        raise realtime.RequestError(404, "Drawing not found")
+    realtime_hub.subscribe(connection, topic)
+    realtime_hub.revisions.setdefault(topic, revision)
+    return {"drawing_id": drawing_id, "revision": revision}
+
+async def ws_unsubscribe(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    drawing_id = required_field(payload, "drawing_id")
+    realtime_hub.unsubscribe(connection, drawing_topic(drawing_id))
+    return {"drawing_id": drawing_id}
+
+ANALYSIS_KINDS = {
+    "analyze-image": (run_image_analysis, ImageAnalysisResponse),
+    "analyze-math": (run_math_analysis, MathFormulaResponse),
+}
+
+async def ws_analyze(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    """["analyze", ref, {kind, body, idempotency_key?, ai?}] -> 工作狀態；之後以相同 ref 推送 job 事件
+    
+    ai 為 {provider, api_key, model}，對應 REST 的 X-AI-Provider 等標頭。
+    """
+    kind = payload.get("kind")
+    if kind not in ANALYSIS_KINDS:
+        raise realtime.RequestError(422, f"Unknown analysis kind: {kind}")
+    body = payload.get("body") or {}
+    ai = payload.get("ai") or {}
+    settings = (str(ai.get("provider") or "").lower(), ai.get("api_key") or "", ai.get("model") or "")
+    run, response_model = ANALYSIS_KINDS[kind]
+    try:
+        job = await start_analysis_job(
+            kind, body, lambda: run(body, *settings), response_model, payload.get("idempotency_key")
+        )
+    except analysis_jobs.IdempotencyConflict as e:
+        raise realtime.RequestError(409, str(e))
+    if job["status"] not in analysis_jobs.FINISHED:
+        connection.spawn(push_job_events(connection, ref, job))
+    return job
+
+async def ws_job(connection: realtime.Connection, ref: int, payload: Dict[str, Any]):
+    """["job", ref, {job_id}] -> 工作狀態；之後以相同 ref 推送 job 事件（可用於以 REST 送出的工作）"""
+    job = await asyncio.to_thread(analysis_store().get, required_field(payload, "job_id"))
+    if job is None:
+        raise realtime.RequestError(404, "Job not found or expired")
+    if job["status"] not in analysis_jobs.FINISHED:
+        connection.spawn(push_job_events(connection, ref, job))
+    return job
+
+async def push_job_events(connection: realtime.Connection, ref: int, job: Dict[str, Any]):
+    """推送 ["job", ref, {event, job}]，直到工作完成或過期（回覆已含目前狀態，只推送之後的變化）"""
+    async for event, current in watch_analysis_job(job["id"], job, job["status"]):
+        if event:
+            await connection.send("job", ref, {"event": event, "job": current})
+
+REALTIME_HANDLERS = {
+    "chat": ws_chat,
+    "stroke": ws_stroke,
+    "sub": ws_subscribe,
+    "unsub": ws_unsubscribe,
+    "analyze": ws_analyze,
+    "job": ws_job,
+}
+
+@app.websocket("/ws")
+async def realtime_channel(websocket: WebSocket):
+    """聊天、繪圖增量與分析進度共用的 WebSocket 連線（訊框格式見 realtime.py）
+    
+    瀏覽器無法為 WebSocket 設定標頭，租戶也可以 ?tenant= 指定。
+    """
+    try:
+        tenant = tenancy.validate_tenant(
+            websocket.headers.get(TENANT_HEADER) or websocket.query_params.get("tenant")
+        )
+    except tenancy.TenantError:
+        await websocket.close(code=realtime.CLOSE_POLICY)
+        return
+    
+    await websocket.accept()
+    connection = realtime.Connection(websocket, WS_SEND_QUEUE, WS_MAX_INFLIGHT, WS_HEARTBEAT_INTERVAL)
+    realtime_hub.register(connection)
+    token = tenancy.current_tenant.set(tenant)
+    try:
+        await connection.serve(REALTIME_HANDLERS)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        tenancy.current_tenant.reset(token)
+        realtime_hub.unregister(connection)
+
 # ============ 統計 API ============
 
 @app.post("/api/statistics/{event_type}")
-async def record_statistic(event_type: str, data: Dict[str, Any], db: sqlite3.Connection = Depends(get_db)):
+async def record_statistic(event_type: str, data: Dict[str, Any], store: storage.Storage = Depends(get_storage)):
     """記錄統計資料"""
-    cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO statistics (id, event_type, event_data, timestamp)
-        VALUES (?, ?, ?, ?)
-    """, (generate_id(), event_type, json.dumps(data), get_timestamp()))
-    
-    db.commit()
+    await store.statistics.record(generate_id(), event_type, data, get_timestamp())
     
     return {"message": "Statistics recorded"}
 
@@ -1370,6 +2742,107 @@ async def serve_ultra_simple():
 async def favicon():
     return FileResponse(BASE_DIR / "assets" / "images" / "favicon.ico")
 
+# ============ 生命週期 ============
+
+async def start_background_tasks():
+    """重播中斷的計數寫回並啟動背景寫回工作與工作佇列的 worker"""
+    global job_workers
+    conn = connect_db(path=DATABASE_PATH)
+    try:
+        counter_service.recover(conn)
+    finally:
+        conn.close()
+    app.state.maintenance_lock = None
+    app.state.counter_flush_task = asyncio.create_task(counter_flush_loop())
+    app.state.maintenance_task = asyncio.create_task(maintenance_loop())
+    app.state.search_index_task = asyncio.create_task(search_index_loop())
+    app.state.realtime_poll_task = asyncio.create_task(realtime_poll_loop())
+    if JOB_WORKERS > 0:
+        job_workers = jobs.WorkerPool(job_queue(), job_handlers(), JOB_WORKERS, JOB_POLL_INTERVAL)
+        job_workers.start()
+
+async def stop_background_tasks():
+    """停止背景工作，等待執行中的佇列工作完成並寫回剩餘的計數（尚未執行的工作留在佇列）"""
+    global job_workers
+    for name in ("counter_flush_task", "maintenance_task", "search_index_task", "realtime_poll_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    if job_workers is not None:
+        await asyncio.to_thread(job_workers.stop)
+        job_workers = None
+    try:
+        flush_counters()
+    except Exception as e:
+        logger.error(f"Final counter flush error: {e}")
+    locks.release(getattr(app.state, "maintenance_lock", None))
+    app.state.maintenance_lock = None
+    await realtime_hub.close_all()
+    shard_pool.close_all()
+
+# 會呼叫 AI 模型的端點：關閉時等待這些請求完成後才結束
+AI_ENDPOINTS = frozenset({
+    "/api/validate-key", "/api/analyze-image", "/api/analyze-math",
+    "/api/analyze-math/batch", "/api/chat", "/api/ai/analyze-image",
+})
+
+@app.middleware("http")
+async def resolve_tenant(request: Request, call_next):
+    """由 X-Tenant-ID 標頭決定本次請求使用的資料庫分片"""
+    try:
+        tenant = tenancy.validate_tenant(request.headers.get(TENANT_HEADER))
+    except tenancy.TenantError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    
+    token = tenancy.current_tenant.set(tenant)
+    try:
+        return await call_next(request)
+    finally:
+        tenancy.current_tenant.reset(token)
+
+@app.middleware("http")
+async def track_ai_calls(request: Request, call_next):
+    """記錄進行中的 AI 請求數"""
+    if request.method != "POST" or request.url.path not in AI_ENDPOINTS:
+        return await call_next(request)
+    
+    app.state.ai_inflight = getattr(app.state, "ai_inflight", 0) + 1
+    try:
+        return await call_next(request)
+    finally:
+        app.state.ai_inflight -= 1
+
+async def drain_ai_calls(timeout: float) -> bool:
+    """等待進行中的 AI 請求完成；逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    while getattr(app.state, "ai_inflight", 0) > 0:
+        if time.monotonic() >= deadline:
+            logger.warning(f"Shutting down with {app.state.ai_inflight} AI calls still running")
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+def install_drain_signal_handlers():
+    """收到 SIGTERM/SIGINT 時立即讓 /readyz 回報 503，再交給 uvicorn 原本的處理常式
+    
+    uvicorn 在 lifespan 啟動前已安裝訊號處理常式；只能在主執行緒中包裝（TestClient 不在主執行緒）。
+    """
+    import signal
+    
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+        
+        def handler(signum, frame, previous=previous):
+            app.state.draining = True
+            app.state.ready = False
+            previous(signum, frame)
+        
+        signal.signal(sig, handler)
+
 # ============ 錯誤處理 ============
 
 @app.exception_handler(Exception)
@@ -1383,6 +2856,14 @@ async def general_exception_handler(request, exc):
 # ============ 啟動設定 ============
 
 if __name__ == "__main__":
+    import sys
+    
+    # python main.py --profile-startup：列出匯入時間後結束
+    if "--profile-startup" in sys.argv:
+        from lazy import profile_startup
+        print(profile_startup())
+        sys.exit(0)
+    
     import uvicorn
     
     # 初始化資料庫
@@ -1392,7 +2873,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Database initialization error: {e}")
     
-    # 啟動服務器
+    # 啟動開發服務器（正式環境請使用 python serve.py）
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
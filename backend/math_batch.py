@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 批次數學公式辨識
+一頁上的多個公式選取打包成少數幾次模型呼叫：每次呼叫送出多張依序編號的圖片，
+模型依編號輸出各自的 LaTeX，再拆回每個項目。
+
+各批次在並行上限內同時送出；模型漏掉的項目與呼叫失敗的批次中的項目會各自單獨重試一次，
+單一項目失敗不影響其他項目的結果。
+"""
+
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 單次模型呼叫最多包含的圖片數
+DEFAULT_BATCH_SIZE = 8
+
+# 同時進行的模型呼叫數
+DEFAULT_CONCURRENCY = 4
+
+# 單次請求最多的項目數
+MAX_ITEMS = 32
+
+# 模型輸出中的編號標記：[[1]]、[[2]] ...
+SECTION_MARKER = re.compile(r"^\s*\[\[(\d+)\]\]\s*$", re.MULTILINE)
+
+# 模型呼叫：(base64 圖片列表, 提示詞) -> 回應文字
+ModelCall = Callable[[List[str], str], Awaitable[str]]
+
+
+def build_prompt(count: int) -> str:
+    """多圖片的數學公式辨識提示詞，要求依編號分段輸出"""
+    return f"""
+    你是一個專業的數學公式識別專家。你會收到 {count} 張圖片，每張前面標有編號 [[1]] 到 [[{count}]]，
+    每張圖片各自包含一段手寫或印刷的數學內容。
+
+    請依編號逐一輸出每張圖片的 LaTeX，格式如下（每張都要輸出，不可省略或合併編號）：
+    [[1]]
+    \\[ 第 1 張的 LaTeX \\]
+    [[2]]
+    \\[ 第 2 張的 LaTeX \\]
+
+    規則：
+    - 編號標記單獨一行
+    - 只輸出純 LaTeX，不要其他說明文字
+    - 多行公式請使用 \\begin{{aligned}} ... \\end{{aligned}} 格式
+    - 保持原始排版結構，確保 LaTeX 語法正確，可被 KaTeX 渲染
+    - 圖片中沒有數學內容時，該編號下輸出 \\[\\]
+    """
+
+
+def parse_sections(text: str, count: int) -> Dict[int, str]:
+    """依編號標記拆分模型輸出，回傳 {編號: 內容}；單張圖片且沒有標記時整段視為第 1 張"""
+    markers = list(SECTION_MARKER.finditer(text or ""))
+    if not markers:
+        return {1: text.strip()} if count == 1 and text and text.strip() else {}
+
+    sections: Dict[int, str] = {}
+    for position, marker in enumerate(markers):
+        number = int(marker.group(1))
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        content = text[marker.end():end].strip()
+        if 1 <= number <= count and number not in sections and content:
+            sections[number] = content
+    return sections
+
+
+async def recognize_batch(
+    images: List[Optional[str]],
+    call_model: ModelCall,
+    interpret: Callable[[str], Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> Dict[str, Any]:
+    """辨識多張圖片；images 中為 None 的項目視為已失敗（由呼叫端填入錯誤）
+
+    interpret 將單一項目的模型輸出轉成 {"latex", "analysis", "confidence"}。
+    回傳 {"results": {索引: 結果}, "model_calls": 呼叫次數}。
+    """
+    results: Dict[int, Dict[str, Any]] = {}
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    calls = 0
+
+    async def run(indices: List[int]):
+        nonlocal calls
+        async with semaphore:
+            calls += 1
+            error, text = None, ""
+            try:
+                text = await call_model([images[index] for index in indices], build_prompt(len(indices)))
+            except Exception as e:
+                error = e
+
+        if error is not None:
+            # 整批失敗可能只是其中一個項目造成，逐一單獨重試
+            if len(indices) > 1:
+                await asyncio.gather(*(run([index]) for index in indices))
+            else:
+                results[indices[0]] = {"success": False, "error": f"數學公式分析失敗: {error}"}
+            return
+
+        sections = parse_sections(text, len(indices))
+        missing = []
+        for number, index in enumerate(indices, start=1):
+            if number in sections:
+                results[index] = {"success": True, **interpret(sections[number])}
+            else:
+                missing.append(index)
+
+        # 模型漏掉的項目單獨重試一次
+        if len(indices) > 1:
+            await asyncio.gather(*(run([index]) for index in missing))
+        for index in missing:
+            results.setdefault(index, {"success": False, "error": "模型輸出中缺少此項目"})
+
+    # 平均分配到最少的批次數，讓各批次耗時接近
+    ready = [index for index, image in enumerate(images) if image]
+    if not ready:
+        return {"results": results, "model_calls": 0}
+    group_count = -(-len(ready) // max(batch_size, 1))
+    bounds = [round(group * len(ready) / group_count) for group in range(group_count + 1)]
+    await asyncio.gather(*(run(ready[bounds[group]:bounds[group + 1]]) for group in range(group_count)))
+    return {"results": results, "model_calls": calls}
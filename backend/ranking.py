@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 範例排行分數
+popularity_score 與 trending_score 預先計算並存在 examples 的索引欄位中，
+排行列表只需沿索引走訪，不必在每次請求時計算整張表。
+
+trending_score 採用對數加上建立時間偏移的「熱度」公式：
+每多 TRENDING_DECAY_SECONDS 的新舊差距，需要十倍的互動量才能抵銷，
+因此分數只在計數改變時需要更新，不會隨時間流逝而失效。
+"""
+
+import math
+import sqlite3
+from typing import Iterable, List
+
+# 互動權重
+LIKE_WEIGHT = 3.0
+DOWNLOAD_WEIGHT = 2.0
+VIEW_WEIGHT = 0.1
+
+# 熱度衰減時間尺度（秒）
+TRENDING_DECAY_SECONDS = 3 * 24 * 60 * 60
+
+# 排序模式對應的 ORDER BY（需與 create_indexes 中的索引一致）
+# 以 id 作為同分時的次序：新範例的分數都是 0，沒有唯一次序時 OFFSET 分頁會重複或漏掉資料列
+SORT_ORDERS = {
+    "newest": "created_at DESC, id DESC",
+    "popular": "popularity_score DESC, id DESC",
+    "trending": "trending_score DESC, id DESC",
+}
+
+
+def popularity_score(likes: int, downloads: int, views: int) -> float:
+    """累積熱門度：互動量加權總和"""
+    return (likes or 0) * LIKE_WEIGHT + (downloads or 0) * DOWNLOAD_WEIGHT + (views or 0) * VIEW_WEIGHT
+
+
+def trending_score(likes: int, downloads: int, views: int, created_at: int) -> float:
+    """時間衰減熱度：log10(互動量) + 建立時間 / 衰減尺度"""
+    weighted = popularity_score(likes, downloads, views)
+    return math.log10(max(weighted, 1.0)) + (created_at or 0) / TRENDING_DECAY_SECONDS
+
+
+def update_scores(conn: sqlite3.Connection, example_ids: Iterable[str]) -> int:
+    """重新計算指定範例的分數（計數寫回後呼叫）"""
+    example_ids = list(example_ids)
+    if not example_ids:
+        return 0
+
+    updated = 0
+    for start in range(0, len(example_ids), 500):
+        chunk = example_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = conn.execute(
+            f"SELECT id, likes, downloads, views, created_at FROM examples WHERE id IN ({placeholders})",
+            chunk,
+        ).fetchall()
+        updated += _write_scores(conn, rows)
+    return updated
+
+
+def recompute_all(conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+    """分批重新計算所有範例的分數（背景工作使用）"""
+    updated = 0
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT rowid, id, likes, downloads, views, created_at FROM examples
+            WHERE rowid > ? ORDER BY rowid LIMIT ?
+            """,
+            (last_rowid, batch_size),
+        ).fetchall()
+        if not rows:
+            return updated
+        last_rowid = rows[-1][0]
+        updated += _write_scores(conn, [row[1:] for row in rows])
+
+
+def _write_scores(conn: sqlite3.Connection, rows: List[tuple]) -> int:
+    with conn:
+        conn.executemany(
+            "UPDATE examples SET popularity_score = ?, trending_score = ? WHERE id = ?",
+            [
+                (
+                    popularity_score(likes, downloads, views),
+                    trending_score(likes, downloads, views, created_at),
+                    example_id,
+                )
+                for example_id, likes, downloads, views, created_at in rows
+            ],
+        )
+    return len(rows)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - WebSocket 即時通道
+一條 WebSocket 連線同時承載聊天、繪圖增量與分析進度，省去每次 fetch 的 HTTP 與 JSON 外層開銷。
+
+訊框為緊湊的 JSON 陣列 [kind, ref, payload]：
+- 客戶端請求：["chat", 7, {...}]；ref 由客戶端遞增，回覆帶相同 ref
+- 伺服器回覆：["ok", 7, {...}] 或 ["error", 7, {"status": 409, "detail": ...}]
+- 伺服器推送：ref 為 0 或訂閱時的 ref，例如 ["delta", 0, {...}]、["job", 9, {...}]
+- 心跳：伺服器每 heartbeat 秒送出 ["ping", 0, {}]，客戶端回 ["pong", 0, {}]（也可主動 ping）；
+  超過 heartbeat * HEARTBEAT_MISSES 秒沒有收到任何訊框時關閉連線
+
+背壓：
+- 送出佇列有上限；請求的回覆在佇列滿時等待（進而暫停讀取該連線），
+  廣播類推送（其他人的繪圖增量）則直接丟棄，並在佇列有空間時送出 ["resync", 0, {"topics": [...]}]，
+  客戶端再以 HTTP 讀取缺少的增量
+- 每條連線同時處理的請求數有上限，已滿時不再讀取新訊框，由 TCP 流量控制讓客戶端減速
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_MISSES = 2.5
+
+# 連線關閉代碼
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY = 1008
+CLOSE_TIMEOUT = 4000
+
+# 目前處理中的請求所屬的連線（處理函式呼叫的共用程式碼可藉此排除請求者本身）
+current_connection: "contextvars.ContextVar[Optional[Connection]]" = contextvars.ContextVar(
+    "current_connection", default=None
+)
+
+
+class FrameError(ValueError):
+    """訊框格式錯誤"""
+
+
+class RequestError(Exception):
+    """處理請求失敗，回覆 error 訊框"""
+
+    def __init__(self, status: int, detail: Any, **extra):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.extra = extra
+
+
+def encode(kind: str, ref: int, payload: Any) -> str:
+    return json.dumps([kind, ref, payload], ensure_ascii=False, separators=(",", ":"))
+
+
+def decode(text: str) -> Tuple[str, int, Dict[str, Any]]:
+    try:
+        frame = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise FrameError(f"Invalid JSON: {e}")
+    if not isinstance(frame, list) or len(frame) not in (2, 3):
+        raise FrameError("Frame must be [kind, ref, payload]")
+    kind, ref = frame[0], frame[1]
+    payload = frame[2] if len(frame) == 3 else {}
+    if not isinstance(kind, str) or not isinstance(ref, int) or not isinstance(payload, dict):
+        raise FrameError("Frame must be [kind: str, ref: int, payload: object]")
+    return kind, ref, payload
+
+
+Handler = Callable[["Connection", int, Dict[str, Any]], Awaitable[Any]]
+
+
+class Connection:
+    """一條 WebSocket 連線（websocket 需提供 send_text / receive_text / close）"""
+
+    def __init__(self, websocket, send_queue: int = 64, max_inflight: int = 8, heartbeat: float = 20.0):
+        self.websocket = websocket
+        self.heartbeat = heartbeat
+        self.outbox: "asyncio.Queue[str]" = asyncio.Queue(maxsize=send_queue)
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+        self.stale_topics: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.closed = False
+
+    async def send(self, kind: str, ref: int, payload: Any):
+        """送出訊框；佇列滿時等待"""
+        await self.outbox.put(encode(kind, ref, payload))
+
+    def offer(self, kind: str, ref: int, payload: Any, topic: Optional[str] = None) -> bool:
+        """送出可丟棄的推送；佇列滿時丟棄並記錄需要重新同步的主題"""
+        try:
+            self.outbox.put_nowait(encode(kind, ref, payload))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if topic:
+                self.stale_topics.add(topic)
+            return False
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """啟動屬於這條連線的背景工作（連線結束時取消）"""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def close(self, code: int = CLOSE_GOING_AWAY):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def serve(self, handlers: Dict[str, Handler]):
+        """讀取並分派訊框，直到連線關閉"""
+        writer = asyncio.ensure_future(self._write())
+        beat = asyncio.ensure_future(self._heartbeat())
+        try:
+            while not self.closed:
+                text = await self.websocket.receive_text()
+                self.last_seen = time.monotonic()
+                try:
+                    kind, ref, payload = decode(text)
+                except FrameError as e:
+                    await self.send("error", 0, {"status": 400, "detail": str(e)})
+                    continue
+
+                if kind == "pong":
+                    continue
+                if kind == "ping":
+                    await self.send("pong", ref, {})
+                    continue
+                handler = handlers.get(kind)
+                if handler is None:
+                    await self.send("error", ref, {"status": 404, "detail": f"Unknown frame kind: {kind}"})
+                    continue
+
+                # 同時處理的請求已滿時在此等待，不再讀取新訊框
+                await self.inflight.acquire()
+                self.spawn(self._dispatch(handler, ref, payload))
+        finally:
+            self.closed = True
+            for task in list(self.tasks) + [writer, beat]:
+                task.cancel()
+
+    async def _dispatch(self, handler: Handler, ref: int, payload: Dict[str, Any]):
+        current_connection.set(self)
+        try:
+            result = await handler(self, ref, payload)
+        except RequestError as e:
+            await self.send("error", ref, {**e.extra, "status": e.status, "detail": e.detail})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Realtime handler error: {e}")
+            await self.send("error", ref, {"status": 500, "detail": "Internal server error"})
+        else:
+            await self.send("ok", ref, result)
+        finally:
+            self.inflight.release()
+
+    async def _write(self):
+        while True:
+            text = await self.outbox.get()
+            try:
+                await self.websocket.send_text(text)
+            except Exception:
+                # 客戶端已斷線，由讀取端收到斷線後結束
+                self.closed = True
+                return
+            if self.stale_topics and not self.outbox.full():
+                topics, self.stale_topics = sorted(self.stale_topics), set()
+                self.offer("resync", 0, {"topics": topics})
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            if time.monotonic() - self.last_seen > self.heartbeat * HEARTBEAT_MISSES:
+                logger.info("Closing realtime connection after missed heartbeats")
+                await self.close(CLOSE_TIMEOUT)
+                return
+            self.offer("ping", 0, {})
+
+
+class Hub:
+    """主題訂閱（同一個 worker 行程內的連線）
+
+    其他行程的變更不會經過這裡：呼叫端需從共用的資料來源（資料庫）讀取後 publish，
+    並以 revisions 記錄各主題已推送到的版本，判斷哪些變更尚未送出。
+    """
+
+    def __init__(self):
+        self.connections: Set[Connection] = set()
+        self.topics: Dict[str, Set[Connection]] = {}
+        # 主題 -> 已推送給訂閱者的版本（由呼叫端維護，主題沒有訂閱者時移除）
+        self.revisions: Dict[str, int] = {}
+
+    def register(self, connection: Connection):
+        self.connections.add(connection)
+
+    def unregister(self, connection: Connection):
+        self.connections.discard(connection)
+        for topic in [topic for topic, members in self.topics.items() if connection in members]:
+            self.unsubscribe(connection, topic)
+
+    def subscribe(self, connection: Connection, topic: str):
+        self.topics.setdefault(topic, set()).add(connection)
+
+    def unsubscribe(self, connection: Connection, topic: str):
+        members = self.topics.get(topic)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.topics[topic]
+                self.revisions.pop(topic, None)
+
+    def publish(self, topic: str, kind: str, payload: Any, exclude: Optional[Connection] = None) -> int:
+        """推送給主題的訂閱者（可丟棄），回傳送出的連線數"""
+        sent = 0
+        for connection in list(self.topics.get(topic, ())):
+            if connection is not exclude and connection.offer(kind, 0, payload, topic):
+                sent += 1
+        return sent
+
+    async def close_all(self, code: int = CLOSE_GOING_AWAY):
+        for connection in list(self.connections):
+            await connection.close(code)
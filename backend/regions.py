@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 繪圖區域擷取
+依矩形或套索多邊形從已儲存的繪圖取出區域影像，供數學公式辨識使用，
+客戶端不必每次辨識都上傳整張畫布。
+
+有筆劃時只繪製與區域相交的筆劃（先以筆劃外框篩選，套索再逐點判斷）；
+只有儲存的圖片時則直接裁切該圖片。
+"""
+
+import base64
+import io
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lazy import lazy_import
+from render import parse_color, rasterize, stroke_points
+
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+
+# 區域影像的最長邊範圍（像素）
+REGION_MIN_SIZE = 256
+REGION_MAX_SIZE = 1024
+
+# 區域外擴的邊界（畫布像素），避免切到筆劃邊緣
+REGION_PADDING = 8
+
+
+class RegionError(ValueError):
+    """區域參數無效"""
+
+
+class Region:
+    """畫布座標中的矩形或套索多邊形"""
+
+    def __init__(self, bbox: Tuple[float, float, float, float], polygon: Optional[np.ndarray] = None):
+        self.bbox = bbox  # (x0, y0, x1, y1)
+        self.polygon = polygon
+
+    @classmethod
+    def parse(cls, bbox: Optional[Dict[str, Any]] = None, lasso: Optional[Sequence[Any]] = None) -> "Region":
+        """解析請求中的 bbox（x, y, width, height）或 lasso（點列表）"""
+        try:
+            if lasso:
+                polygon = np.array(
+                    [(p["x"], p["y"]) if isinstance(p, dict) else (p[0], p[1]) for p in lasso], dtype=np.float64
+                )
+                if len(polygon) < 3:
+                    raise RegionError("Lasso needs at least 3 points")
+                x0, y0 = polygon.min(axis=0)
+                x1, y1 = polygon.max(axis=0)
+                return cls((float(x0), float(y0), float(x1), float(y1)), polygon)
+
+            if bbox:
+                x, y = float(bbox["x"]), float(bbox["y"])
+                width, height = float(bbox["width"]), float(bbox["height"])
+                if width <= 0 or height <= 0:
+                    raise RegionError("Bounding box must have a positive size")
+                return cls((x, y, x + width, y + height))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            if isinstance(e, RegionError):
+                raise
+            raise RegionError(f"Invalid region: {e}")
+
+        raise RegionError("Either bbox or lasso is required")
+
+    def padded(self, padding: float) -> Tuple[float, float, float, float]:
+        x0, y0, x1, y1 = self.bbox
+        return x0 - padding, y0 - padding, x1 + padding, y1 + padding
+
+
+def stroke_bounds(strokes: List[Dict[str, Any]]) -> np.ndarray:
+    """每個筆劃含筆刷半徑的外框 (N, 4)：x0, y0, x1, y1；沒有座標的筆劃為 NaN"""
+    bounds = np.full((len(strokes), 4), np.nan)
+    for index, stroke in enumerate(strokes):
+        points = stroke_points(stroke)
+        if points is None:
+            continue
+        radius = float(stroke.get("size") or 2) / 2
+        bounds[index, :2] = points.min(axis=0) - radius
+        bounds[index, 2:] = points.max(axis=0) + radius
+    return bounds
+
+
+def points_in_polygon(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """射線法判斷點是否在多邊形內（所有點與所有邊一次計算）"""
+    x, y = points[:, 0:1], points[:, 1:2]
+    ax, ay = polygon[:, 0], polygon[:, 1]
+    bx, by = np.roll(ax, -1), np.roll(ay, -1)
+
+    straddles = (ay > y) != (by > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = ax + (y - ay) * (bx - ax) / (by - ay)
+    return np.count_nonzero(straddles & (x < crossing_x), axis=1) % 2 == 1
+
+
+def select_strokes(
+    strokes: List[Dict[str, Any]], region: Region, candidates: Optional[Sequence[int]] = None, mode: str = "intersects"
+) -> List[int]:
+    """與區域相交（mode="contains" 時為完全落在區域內）的筆劃索引
+
+    candidates 為外框已與區域相交的筆劃（例如空間索引的查詢結果）；未提供時逐一比對外框。
+    套索時另需至少一個點（contains 時為所有點）落在多邊形內。
+    """
+    if not strokes:
+        return []
+    if candidates is None:
+        bounds = stroke_bounds(strokes)
+        x0, y0, x1, y1 = region.bbox
+        with np.errstate(invalid="ignore"):
+            if mode == "contains":
+                hits = (bounds[:, 0] >= x0) & (bounds[:, 1] >= y0) & (bounds[:, 2] <= x1) & (bounds[:, 3] <= y1)
+            else:
+                hits = (bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) & (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0)
+        candidates = np.flatnonzero(hits)
+    candidates = [int(index) for index in candidates]
+    if region.polygon is None:
+        return candidates
+
+    matches = []
+    for index in candidates:
+        points = stroke_points(strokes[index])
+        if points is None:
+            continue
+        inside = points_in_polygon(points, region.polygon)
+        if inside.all() if mode == "contains" else inside.any():
+            matches.append(index)
+    return matches
+
+
+def render_region(drawing_data: Dict[str, Any], region: Region, stroke_indices: Optional[Sequence[int]] = None) -> bytes:
+    """只繪製區域內的筆劃，回傳 PNG"""
+    strokes = drawing_data.get("strokes") or []
+    if stroke_indices is None:
+        stroke_indices = select_strokes(strokes, region)
+
+    x0, y0, x1, y1 = region.padded(REGION_PADDING)
+    image = rasterize(
+        {"canvas": drawing_data.get("canvas"), "strokes": [strokes[index] for index in stroke_indices]},
+        REGION_MAX_SIZE,
+        viewport=(x0, y0, x1 - x0, y1 - y0),
+        min_size=REGION_MIN_SIZE,
+    )
+    return encode_png(image)
+
+
+def crop_image(image_bytes: bytes, canvas: Optional[Dict[str, Any]], region: Region) -> bytes:
+    """從儲存的整張圖片裁切區域（圖片解析度與畫布不同時依比例換算），套索外的部分填背景色"""
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    canvas = canvas or {}
+    scale_x = image.width / float(canvas.get("width") or image.width)
+    scale_y = image.height / float(canvas.get("height") or image.height)
+
+    x0, y0, x1, y1 = region.padded(REGION_PADDING)
+    box = (
+        max(int(np.floor(x0 * scale_x)), 0), max(int(np.floor(y0 * scale_y)), 0),
+        min(int(np.ceil(x1 * scale_x)), image.width), min(int(np.ceil(y1 * scale_y)), image.height),
+    )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        raise RegionError("Region is outside the drawing")
+    cropped = image.crop(box)
+
+    if region.polygon is not None:
+        mask = Image.new("L", cropped.size, 0)
+        outline = [((x * scale_x) - box[0], (y * scale_y) - box[1]) for x, y in region.polygon]
+        ImageDraw.Draw(mask).polygon(outline, fill=255)
+        background = Image.new("RGB", cropped.size, parse_color(canvas.get("background"), (255, 255, 255)))
+        cropped = Image.composite(cropped, background, mask)
+
+    return encode_png(cropped)
+
+
+def decode_data_url(data: str) -> bytes:
+    """解碼 base64（可含 data:image/...;base64, 前綴）"""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    return base64.b64decode(data)
+
+
+def verify_image(data: str):
+    """確認 base64 圖片可以解碼並辨識格式（不載入像素）；無效時拋出例外"""
+    with Image.open(io.BytesIO(decode_data_url(data))) as image:
+        image.verify()
+
+
+def encode_png(image: "Image.Image") -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 正式環境啟動入口
+以多個 uvicorn worker 行程使用所有 CPU 核心，可選擇 uvloop / httptools。
+
+    python serve.py --workers 8 --port 8000
+    python serve.py --loop asyncio --http h11      # 無 uvloop/httptools 的平台
+
+- 啟動前在主行程初始化資料庫並切換為 WAL 模式，worker 共用同一個資料庫檔
+- 每個 worker 以檔案鎖取得自己的計數日誌槽；全表重算等維護工作只由持有維護鎖的 worker 執行
+- SIGTERM 時 /readyz 立即回報 503，uvicorn 等待進行中的請求（含 AI 呼叫）至 --graceful-timeout，
+  之後各 worker 在 lifespan 中寫回縮圖與計數再結束
+- /livez 為存活檢查，/readyz 為就緒檢查，與 /api/health 分開
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).parent
+
+# 事件迴圈與 HTTP 解析器選項（auto 時 uvicorn 會優先使用 uvloop / httptools）
+LOOP_CHOICES = ("auto", "uvloop", "asyncio")
+HTTP_CHOICES = ("auto", "httptools", "h11")
+
+
+def default_workers() -> int:
+    """預設 worker 數：WEB_CONCURRENCY 或 CPU 核心數"""
+    return int(os.getenv("WEB_CONCURRENCY", 0)) or os.cpu_count() or 1
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="UI CoreWork 正式環境伺服器")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=default_workers(), help="worker 行程數（預設為 CPU 核心數）")
+    parser.add_argument("--loop", choices=LOOP_CHOICES, default="auto")
+    parser.add_argument("--http", choices=HTTP_CHOICES, default="auto")
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", 30)),
+        help="關閉時等待進行中請求的秒數",
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true", help="停用每個請求的存取日誌")
+    parser.add_argument(
+        "--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        help="信任其 X-Forwarded-* 標頭的反向代理 IP",
+    )
+    return parser.parse_args(argv)
+
+
+def uvicorn_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """依參數組出 uvicorn.run 的設定；明確指定但未安裝的 uvloop / httptools 視為錯誤"""
+    for choice in (args.loop, args.http):
+        if choice in ("uvloop", "httptools") and importlib.util.find_spec(choice) is None:
+            raise SystemExit(f"{choice} is not installed (pip install {choice}) or choose another option")
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+
+    return {
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "loop": args.loop,
+        "http": args.http,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "log_level": args.log_level,
+        "access_log": not args.no_access_log,
+        "proxy_headers": True,
+        "forwarded_allow_ips": args.forwarded_allow_ips,
+        "app_dir": str(BACKEND_DIR),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    options = uvicorn_options(args)
+
+    import uvicorn
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    import main as backend
+
+    # 在產生 worker 前建立資料表並切換為 WAL，避免多個 worker 同時做結構變更
+    backend.init_database()
+    print(f"Starting UI CoreWork with {options['workers']} workers on {options['host']}:{options['port']}")
+
+    uvicorn.run("main:app", **options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 筆劃簡化
+繪圖儲存時的筆劃前處理：以 Ramer-Douglas-Peucker 移除近乎共線的點；
+指定取樣間距時先依弧長均勻重新取樣（點數有上限）。兩個步驟都對整條筆劃的座標陣列向量化處理。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 重新取樣後每條筆劃的點數上限（筆劃過長時放大間距）
+MAX_RESAMPLED_POINTS = 10000
+
+
+def point_segment_distances(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """每個點到其對應線段（非無限直線）的距離"""
+    direction = ends - starts
+    length_sq = np.einsum("ij,ij->i", direction, direction)
+    t = np.einsum("ij,ij->i", points - starts, direction) / np.where(length_sq > 0, length_sq, 1.0)
+    projection = starts + direction * np.clip(t, 0.0, 1.0)[:, None]
+    return np.hypot(*(points - projection).T)
+
+
+def rdp_mask(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Ramer-Douglas-Peucker：回傳要保留的點的布林遮罩
+
+    每一輪同時處理所有尚未達到容許誤差的區段，而不是逐段遞迴。
+    """
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+    if count < 3:
+        keep[:] = True
+        return keep
+
+    positions = np.arange(count)
+    while True:
+        anchors = np.flatnonzero(keep)
+        segment = np.searchsorted(anchors, positions, side="right") - 1
+        segment = np.minimum(segment, len(anchors) - 2)
+
+        distances = point_segment_distances(points, points[anchors[segment]], points[anchors[segment + 1]])
+        distances[keep] = 0.0
+
+        # 每個區段中距離最大的點
+        order = np.lexsort((-distances, segment))
+        first = np.searchsorted(segment[order], np.arange(len(anchors) - 1))
+        farthest = order[first]
+        split = farthest[distances[farthest] > tolerance]
+        if not len(split):
+            return keep
+        keep[split] = True
+
+
+def resample(points: np.ndarray, spacing: float,
+             max_points: int = MAX_RESAMPLED_POINTS) -> Tuple[np.ndarray, np.ndarray]:
+    """依弧長以固定間距重新取樣，回傳 (新座標, 對應的弧長位置)；點數超過 max_points 時放大間距"""
+    segment_lengths = np.hypot(*np.diff(points, axis=0).T)
+    arc = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    total = arc[-1]
+    if total <= spacing:
+        return points[[0, -1]], arc[[0, -1]]
+    spacing = max(spacing, total / (max_points - 1))
+
+    targets = np.append(np.arange(0.0, total, spacing), total)
+    x = np.interp(targets, arc, points[:, 0])
+    y = np.interp(targets, arc, points[:, 1])
+    return np.stack([x, y], axis=1), targets
+
+
+def simplify_stroke(stroke: Dict[str, Any], tolerance: float, spacing: Optional[float] = None) -> Dict[str, Any]:
+    """簡化單一筆劃；重新取樣時點的其他數值屬性（pressure、timestamp 等）依弧長內插"""
+    raw_points = stroke.get("points") or []
+    if tolerance <= 0 or len(raw_points) < 3:
+        return stroke
+
+    try:
+        coordinates = np.array([(float(p["x"]), float(p["y"])) for p in raw_points], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return stroke
+
+    # 只內插所有點都有的數值屬性
+    extra_keys = [
+        key for key, value in raw_points[0].items()
+        if key not in ("x", "y") and isinstance(value, (int, float)) and not isinstance(value, bool)
+        and all(isinstance(p.get(key), (int, float)) for p in raw_points)
+    ]
+
+    if spacing:
+        segment_lengths = np.hypot(*np.diff(coordinates, axis=0).T)
+        raw_arc = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+        resampled, arc = resample(coordinates, spacing)
+        keep = rdp_mask(resampled, tolerance)
+        kept_points = resampled[keep]
+        columns = {key: np.interp(arc[keep], raw_arc, [p[key] for p in raw_points]) for key in extra_keys}
+    else:
+        # 未指定間距時直接簡化原始點，保留的點沿用原本的屬性值
+        keep = rdp_mask(coordinates, tolerance)
+        kept_points = coordinates[keep]
+        columns = {key: np.array([p[key] for p in raw_points], dtype=np.float64)[keep] for key in extra_keys}
+
+    points = []
+    for index, (x, y) in enumerate(kept_points):
+        point = {"x": round(float(x), 2), "y": round(float(y), 2)}
+        for key, values in columns.items():
+            value = float(values[index])
+            point[key] = int(round(value)) if isinstance(raw_points[0][key], int) else value
+        points.append(point)
+
+    return {**stroke, "points": points}
+
+
+def simplify_strokes(
+    strokes: Optional[List[Dict[str, Any]]], tolerance: float, spacing: Optional[float] = None
+) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, int]]:
+    """簡化整組筆劃，回傳 (簡化後筆劃, 點數統計)"""
+    if not strokes:
+        return strokes, {"points_before": 0, "points_after": 0}
+
+    simplified = [simplify_stroke(stroke, tolerance, spacing) for stroke in strokes]
+    return simplified, {
+        "points_before": sum(len(stroke.get("points") or []) for stroke in strokes),
+        "points_after": sum(len(stroke.get("points") or []) for stroke in simplified),
+    }
+
+
+def polyline_error(raw: np.ndarray, simplified: np.ndarray) -> np.ndarray:
+    """原始每個點到簡化折線的最短距離（用於評估視覺誤差）"""
+    if len(simplified) == 1:
+        return np.hypot(*(raw - simplified[0]).T)
+    starts = np.repeat(simplified[None, :-1], len(raw), axis=0).reshape(-1, 2)
+    ends = np.repeat(simplified[None, 1:], len(raw), axis=0).reshape(-1, 2)
+    repeated = np.repeat(raw, len(simplified) - 1, axis=0)
+    return point_segment_distances(repeated, starts, ends).reshape(len(raw), -1).min(axis=1)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 筆劃空間索引
+以筆劃外框建立均勻網格索引，供套索選取、框選與橡皮擦等區域查詢使用，
+不必逐一走訪 strokes 列表。
+
+索引的外框與筆劃 ID 依版本存在 drawing_stroke_index 表（與 drawing_data 並存），
+網格在載入時以 NumPy 重建；自動儲存的增量會直接套用到既有索引，
+只有快照被覆寫（PUT）時才需要重新計算所有筆劃的外框。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import drawing_store
+from regions import stroke_bounds
+
+# 網格格子數上限（相對於筆劃數）
+MAX_CELLS_PER_STROKE = 4
+
+# 覆蓋超過此格數的大筆劃不放入網格，查詢時直接比對
+MAX_CELLS_PER_ENTRY = 64
+
+# 記憶體中保留的索引數量
+MAX_CACHED_INDEXES = 64
+
+QUERY_MODES = ("intersects", "contains")
+
+
+class StrokeIndex:
+    """單一繪圖版本的筆劃外框網格索引；位置與 materialize 後的 strokes 順序一致"""
+
+    def __init__(self, stroke_ids: List[Optional[str]], bounds: np.ndarray, revision: int):
+        self.stroke_ids = stroke_ids
+        self.bounds = bounds.reshape(-1, 4).astype(np.float64)
+        self.revision = revision
+        self._build_grid()
+
+    @classmethod
+    def build(cls, strokes: List[Dict[str, Any]], revision: int) -> "StrokeIndex":
+        return cls([stroke.get("id") for stroke in strokes], stroke_bounds(strokes), revision)
+
+    def __len__(self) -> int:
+        return len(self.stroke_ids)
+
+    def _build_grid(self):
+        valid = np.flatnonzero(~np.isnan(self.bounds[:, 0]))
+        self.cell_start = np.zeros(1, dtype=np.int64)
+        self.cell_items = np.zeros(0, dtype=np.int64)
+        self.oversized = np.zeros(0, dtype=np.int64)
+        self.shape = (0, 0)
+        if not len(valid):
+            return
+
+        bounds = self.bounds[valid]
+        self.origin = bounds[:, :2].min(axis=0)
+        extent = np.maximum(bounds[:, 2:].max(axis=0) - self.origin, 1.0)
+
+        # 格子約為一般筆劃大小，但總格數不超過筆劃數的 MAX_CELLS_PER_STROKE 倍
+        typical = float(np.median(np.max(bounds[:, 2:] - bounds[:, :2], axis=1)))
+        cell_size = max(typical, 1.0)
+        min_cell = float(np.sqrt(extent[0] * extent[1] / (MAX_CELLS_PER_STROKE * len(valid) + 16)))
+        self.cell_size = max(cell_size, min_cell)
+
+        first = np.floor((bounds[:, :2] - self.origin) / self.cell_size).astype(np.int64)
+        last = np.floor((bounds[:, 2:] - self.origin) / self.cell_size).astype(np.int64)
+        nx, ny = (last.max(axis=0) + 1).tolist()
+        self.shape = (nx, ny)
+
+        spans = last - first + 1
+        counts = spans[:, 0] * spans[:, 1]
+        large = counts > MAX_CELLS_PER_ENTRY
+        self.oversized = valid[large]
+
+        first, spans, counts, entries = first[~large], spans[~large], counts[~large], valid[~large]
+        owner = np.repeat(np.arange(len(entries)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = first[owner, 0] + local % spans[owner, 0]
+        cy = first[owner, 1] + local // spans[owner, 0]
+        cells = cy * nx + cx
+
+        order = np.argsort(cells, kind="stable")
+        self.cell_items = entries[owner[order]]
+        self.cell_start = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=nx * ny))])
+
+    def query(self, bbox: Tuple[float, float, float, float], mode: str = "intersects") -> np.ndarray:
+        """回傳與矩形 (x0, y0, x1, y1) 相交（或被完全包含）的筆劃位置，依位置排序"""
+        if not self.shape[0]:
+            return np.zeros(0, dtype=np.int64)
+
+        x0, y0, x1, y1 = bbox
+        nx, ny = self.shape
+        cx0, cy0 = np.floor((np.array([x0, y0]) - self.origin) / self.cell_size).astype(np.int64)
+        cx1, cy1 = np.floor((np.array([x1, y1]) - self.origin) / self.cell_size).astype(np.int64)
+        cx0, cy0, cx1, cy1 = max(cx0, 0), max(cy0, 0), min(cx1, nx - 1), min(cy1, ny - 1)
+
+        if cx0 > cx1 or cy0 > cy1:
+            candidates = self.oversized
+        else:
+            cells = (np.arange(cy0, cy1 + 1)[:, None] * nx + np.arange(cx0, cx1 + 1)[None, :]).ravel()
+            starts, ends = self.cell_start[cells], self.cell_start[cells + 1]
+            lengths = ends - starts
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            gathered = self.cell_items[np.repeat(starts, lengths) + offsets]
+            candidates = np.unique(np.concatenate([gathered, self.oversized]))
+
+        box = self.bounds[candidates]
+        if mode == "contains":
+            hits = (box[:, 0] >= x0) & (box[:, 1] >= y0) & (box[:, 2] <= x1) & (box[:, 3] <= y1)
+        else:
+            hits = (box[:, 0] <= x1) & (box[:, 2] >= x0) & (box[:, 1] <= y1) & (box[:, 3] >= y0)
+        return np.sort(candidates[hits])
+
+    def apply_delta(self, ops: Dict[str, Any], revision: int) -> "StrokeIndex":
+        """套用一筆增量（與 drawing_store.apply_delta 相同順序：先復原標記，再附加新筆劃）"""
+        stroke_ids = self.stroke_ids
+        bounds = self.bounds
+
+        undo_ids = set(ops.get("undo") or [])
+        if undo_ids:
+            keep = np.array([stroke_id not in undo_ids for stroke_id in stroke_ids], dtype=bool)
+            stroke_ids = [stroke_id for stroke_id, kept in zip(stroke_ids, keep) if kept]
+            bounds = bounds[keep]
+
+        added = ops.get("strokes") or []
+        if added:
+            stroke_ids = stroke_ids + [stroke.get("id") for stroke in added]
+            bounds = np.vstack([bounds, stroke_bounds(added)])
+
+        return StrokeIndex(stroke_ids, bounds, revision)
+
+
+def ensure_schema(cursor):
+    """建立空間索引表"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drawing_stroke_index (
+            drawing_id TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL,
+            stroke_ids TEXT NOT NULL,
+            bounds BLOB NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+
+
+# 以 (資料庫檔, drawing_id) 為鍵：多租戶時各分片的繪圖 ID 互不影響
+_cache: "OrderedDict[Tuple[str, str], StrokeIndex]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_key(conn: sqlite3.Connection, drawing_id: str) -> Tuple[str, str]:
+    return conn.execute("PRAGMA database_list").fetchone()[2], drawing_id
+
+
+def _remember(key: Tuple[str, str], index: StrokeIndex):
+    with _cache_lock:
+        _cache[key] = index
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_INDEXES:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def load_index(conn: sqlite3.Connection, drawing_id: str) -> Optional[StrokeIndex]:
+    """讀取已儲存的索引"""
+    row = conn.execute(
+        "SELECT revision, stroke_ids, bounds FROM drawing_stroke_index WHERE drawing_id = ?", (drawing_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return StrokeIndex(json.loads(row[1]), np.frombuffer(row[2], dtype=np.float64), row[0])
+
+
+def save_index(conn: sqlite3.Connection, drawing_id: str, index: StrokeIndex):
+    """儲存索引（只保存外框與 ID，網格於載入時重建）"""
+    with conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO drawing_stroke_index (drawing_id, revision, stroke_ids, bounds, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (drawing_id, index.revision, json.dumps(index.stroke_ids), index.bounds.tobytes(), int(time.time())),
+        )
+
+
+def current_index(conn: sqlite3.Connection, drawing_id: str) -> Optional[StrokeIndex]:
+    """取得繪圖目前版本的索引；過期時套用增量或重建，並寫回資料表。繪圖不存在時回傳 None"""
+    row = conn.execute(
+        "SELECT revision, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    revision, snapshot_revision = row[0] or 0, row[1] or 0
+
+    key = _cache_key(conn, drawing_id)
+    with _cache_lock:
+        index = _cache.get(key)
+    if index is None or index.revision > revision:
+        index = load_index(conn, drawing_id)
+    if index is not None and index.revision == revision:
+        _remember(key, index)
+        return index
+
+    # 索引早於目前快照（快照被覆寫或增量已壓縮）時從快照重建
+    if index is None or index.revision < snapshot_revision or index.revision > revision:
+        snapshot = conn.execute(
+            "SELECT drawing_data, snapshot_revision FROM drawings WHERE id = ?", (drawing_id,)
+        ).fetchone()
+        if snapshot is None:
+            return None
+        index = StrokeIndex.build(json.loads(snapshot[0] or "{}").get("strokes") or [], snapshot[1] or 0)
+
+    for delta in drawing_store.load_deltas(conn, drawing_id, index.revision):
+        index = index.apply_delta(delta, delta["revision"])
+
+    save_index(conn, drawing_id, index)
+    _remember(key, index)
+    return index
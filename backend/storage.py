@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 資料存取層
+聊天、繪圖、範例與統計的基本讀寫集中在 repository 介面後面，端點不直接撰寫 SQL，
+之後可換成其他資料庫（PostgreSQL 實作見 storage_postgres.py）。
+
+- 介面方法皆為 async：PostgreSQL 驅動為非同步；SQLite 實作與原本端點相同，直接在事件迴圈中執行
+- 回傳的資料列為 dict，JSON 欄位（tags、files、metadata、drawing_data、context）保持字串，
+  由呼叫端解析，兩種實作的結果完全相同
+- 訊息以 (timestamp, id) 鍵集分頁（見 fetch_messages）
+
+兩種實作共用 test_storage.py 的一致性測試。
+"""
+
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+MESSAGE_COLUMNS = ("id", "sender", "message", "message_type", "timestamp")
+CONVERSATION_COLUMNS = ("id", "title", "created_at", "updated_at")
+
+# 可查詢的欄位（投影欄位名稱會直接組進 SQL，只接受這些）
+EXAMPLE_COLUMNS = (
+    "id", "title", "description", "category", "tags", "thumbnail", "files", "file_count",
+    "likes", "downloads", "views", "popularity_score", "trending_score", "created_at", "author", "metadata",
+)
+DRAWING_COLUMNS = (
+    "id", "title", "drawing_data", "thumbnail", "created_at", "updated_at", "metadata",
+    "stroke_count", "revision", "snapshot_revision",
+)
+
+
+def check_columns(columns: Sequence[str], allowed: Tuple[str, ...]) -> List[str]:
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return list(columns)
+
+
+def message_to_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "sender": row[1],
+        "content": row[2],
+        "type": row[3],
+        "timestamp": row[4]
+    }
+
+
+def message_page_query(placeholder, conversation_id: str, limit: int,
+                       before: Optional[tuple] = None, after: Optional[tuple] = None,
+                       oldest_first: bool = False) -> Tuple[str, List[Any], bool]:
+    """組出鍵集分頁查詢，回傳 (sql, params, ascending)；placeholder(n) 產生第 n 個參數的佔位符號"""
+    ascending = oldest_first or after is not None
+    params: List[Any] = [conversation_id]
+    where = f"conversation_id = {placeholder(1)}"
+    for cursor, op in ((after, ">"), (before, "<")):
+        if cursor:
+            params.extend(cursor)
+            where += f" AND (timestamp, id) {op} ({placeholder(len(params) - 1)}, {placeholder(len(params))})"
+    order = "ASC" if ascending else "DESC"
+    params.append(limit)
+    sql = (
+        f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM chat_messages WHERE {where} "
+        f"ORDER BY timestamp {order}, id {order} LIMIT {placeholder(len(params))}"
+    )
+    return sql, params, ascending
+
+
+def fetch_messages(conn: sqlite3.Connection, conversation_id: str, limit: int,
+                   before: Optional[tuple] = None, after: Optional[tuple] = None,
+                   oldest_first: bool = False) -> List[Dict[str, Any]]:
+    """依 (timestamp, id) 鍵集分頁讀取訊息，回傳時間順序
+
+    有 after 或 oldest_first 時取游標之後（或從頭）最舊的 limit 則；否則取 before（或最新）之前最新的 limit 則。
+    """
+    sql, params, ascending = message_page_query(lambda n: "?", conversation_id, limit, before, after, oldest_first)
+    messages = [message_to_dict(row) for row in conn.execute(sql, params).fetchall()]
+    return messages if ascending else messages[::-1]
+
+
+def conversation_title(message: str) -> str:
+    return message[:50] + "..." if len(message) > 50 else message
+
+
+# ============ 介面 ============
+
+class ChatRepository(ABC):
+    @abstractmethod
+    async def append_messages(self, conversation_id: str, title: str, messages: Iterable[Dict[str, Any]],
+                              updated_at: int):
+        """在同一個交易中寫入訊息並建立或更新會話（不改變會話的封存狀態）
+
+        messages 的每一筆含 id、sender、message、message_type、timestamp、context（dict）。
+        """
+
+    @abstractmethod
+    async def conversation_exists(self, conversation_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def list_conversations(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近更新的會話（CONVERSATION_COLUMNS）"""
+
+    @abstractmethod
+    async def get_messages(self, conversation_id: str, limit: int, before: Optional[tuple] = None,
+                           after: Optional[tuple] = None, oldest_first: bool = False) -> List[Dict[str, Any]]:
+        """同 fetch_messages"""
+
+
+class DrawingRepository(ABC):
+    @abstractmethod
+    async def create(self, drawing: Dict[str, Any]):
+        """新增繪圖（欄位見 DRAWING_COLUMNS，未提供的計數欄位為 0）"""
+
+    @abstractmethod
+    async def get(self, drawing_id: str, columns: Sequence[str] = DRAWING_COLUMNS) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def list(self, columns: Sequence[str], limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """依 updated_at 由新到舊"""
+
+
+class ExampleRepository(ABC):
+    @abstractmethod
+    async def create(self, example: Dict[str, Any]):
+        """新增範例（欄位見 EXAMPLE_COLUMNS）"""
+
+    @abstractmethod
+    async def get(self, example_id: str, columns: Sequence[str] = EXAMPLE_COLUMNS) -> Optional[Dict[str, Any]]:
+        ...
+
+
+class StatisticsRepository(ABC):
+    @abstractmethod
+    async def record(self, event_id: str, event_type: str, data: Dict[str, Any], timestamp: int):
+        ...
+
+    @abstractmethod
+    async def count(self, event_type: str, since: int = 0) -> int:
+        ...
+
+
+class Storage:
+    """一組 repository"""
+
+    def __init__(self, chat: ChatRepository, drawings: DrawingRepository,
+                 examples: ExampleRepository, statistics: StatisticsRepository):
+        self.chat = chat
+        self.drawings = drawings
+        self.examples = examples
+        self.statistics = statistics
+
+
+# ============ SQLite 實作 ============
+
+def _insert(conn: sqlite3.Connection, table: str, values: Dict[str, Any]):
+    conn.execute(
+        f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+        list(values.values()),
+    )
+
+
+def _row_dict(cursor: sqlite3.Cursor, row) -> Dict[str, Any]:
+    return {description[0]: value for description, value in zip(cursor.description, row)}
+
+
+class SQLiteChatRepository(ChatRepository):
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    async def append_messages(self, conversation_id, title, messages, updated_at):
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO chat_messages (id, conversation_id, sender, message, message_type, timestamp, context)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (m["id"], conversation_id, m["sender"], m["message"], m.get("message_type", "text"),
+                     m["timestamp"], json.dumps(m.get("context") or {}))
+                    for m in messages
+                ],
+            )
+            # 保留 is_archived：封存工作剛好在還原後搬走舊訊息時，下次開啟仍會還原合併
+            self.conn.execute(
+                """
+                INSERT INTO conversations (id, title, created_at, updated_at, metadata)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    title = excluded.title, updated_at = excluded.updated_at, metadata = excluded.metadata
+                """,
+                (conversation_id, title, updated_at, updated_at, json.dumps({})),
+            )
+
+    async def conversation_exists(self, conversation_id):
+        return self.conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone() is not None
+
+    async def list_conversations(self, limit=50):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(CONVERSATION_COLUMNS)} FROM conversations ORDER BY updated_at DESC LIMIT ?", (limit,)
+        )
+        return [_row_dict(cursor, row) for row in cursor.fetchall()]
+
+    async def get_messages(self, conversation_id, limit, before=None, after=None, oldest_first=False):
+        return fetch_messages(self.conn, conversation_id, limit, before, after, oldest_first)
+
+
+class SQLiteDrawingRepository(DrawingRepository):
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    async def create(self, drawing):
+        with self.conn:
+            _insert(self.conn, "drawings", {
+                column: drawing[column] for column in check_columns(list(drawing), DRAWING_COLUMNS)
+            })
+
+    async def get(self, drawing_id, columns=DRAWING_COLUMNS):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(check_columns(columns, DRAWING_COLUMNS))} FROM drawings WHERE id = ?", (drawing_id,)
+        )
+        row = cursor.fetchone()
+        return _row_dict(cursor, row) if row else None
+
+    async def list(self, columns, limit, offset=0):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(check_columns(columns, DRAWING_COLUMNS))} FROM drawings "
+            "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [_row_dict(cursor, row) for row in cursor.fetchall()]
+
+
+class SQLiteExampleRepository(ExampleRepository):
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    async def create(self, example):
+        with self.conn:
+            _insert(self.conn, "examples", {
+                column: example[column] for column in check_columns(list(example), EXAMPLE_COLUMNS)
+            })
+
+    async def get(self, example_id, columns=EXAMPLE_COLUMNS):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(check_columns(columns, EXAMPLE_COLUMNS))} FROM examples WHERE id = ?", (example_id,)
+        )
+        row = cursor.fetchone()
+        return _row_dict(cursor, row) if row else None
+
+
+class SQLiteStatisticsRepository(StatisticsRepository):
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    async def record(self, event_id, event_type, data, timestamp):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO statistics (id, event_type, event_data, timestamp) VALUES (?, ?, ?, ?)",
+                (event_id, event_type, json.dumps(data), timestamp),
+            )
+
+    async def count(self, event_type, since=0):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM statistics WHERE event_type = ? AND timestamp >= ?", (event_type, since)
+        ).fetchone()[0]
+
+
+class SQLiteStorage(Storage):
+    """以一條 SQLite 連線（例如請求的分片連線）操作"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__(
+            SQLiteChatRepository(conn), SQLiteDrawingRepository(conn),
+            SQLiteExampleRepository(conn), SQLiteStatisticsRepository(conn),
+        )
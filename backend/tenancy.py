@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 多租戶資料分片
+每個租戶（學校或使用者）的聊天、繪圖與統計資料放在自己的 SQLite 檔
+（<database 目錄>/tenants/<tenant>/uicorework.db），寫入鎖的競爭只發生在同一租戶內；
+範例目錄仍在共用的目錄資料庫（原本的 uicorework.db），未指定租戶的請求也使用它。
+
+請求的租戶由中介層從 X-Tenant-ID 標頭取得並放在 context variable 中，
+同一請求內的相依函式、asyncio.to_thread 與背景工作（以 copy_context 排入）都能取得。
+
+ShardPool 依資料庫檔保留可重複使用的連線，開啟的分片超過上限時依 LRU 關閉閒置分片的連線。
+"""
+
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# 租戶 ID：英數字、底線與連字號（同時作為目錄名稱）
+TENANT_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 分片目錄名稱（位於目錄資料庫所在的目錄下）
+TENANTS_DIR = "tenants"
+SHARD_FILE = "uicorework.db"
+
+# 目前請求的租戶（None 表示使用目錄資料庫）
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+
+class TenantError(ValueError):
+    """租戶 ID 不合法"""
+
+
+def validate_tenant(tenant: Optional[str]) -> Optional[str]:
+    if tenant is None or tenant == "":
+        return None
+    if not TENANT_ID.match(tenant):
+        raise TenantError(f"Invalid tenant id: {tenant!r}")
+    return tenant
+
+
+def shard_path(catalog_path: Path, tenant: Optional[str]) -> Path:
+    """租戶的資料庫檔；未指定租戶時為目錄資料庫"""
+    if tenant is None:
+        return Path(catalog_path)
+    return Path(catalog_path).parent / TENANTS_DIR / tenant / SHARD_FILE
+
+
+def list_tenants(catalog_path: Path) -> List[str]:
+    """已建立分片的租戶"""
+    root = Path(catalog_path).parent / TENANTS_DIR
+    if not root.is_dir():
+        return []
+    return sorted(path.parent.name for path in root.glob(f"*/{SHARD_FILE}"))
+
+
+class ShardPool:
+    """依資料庫檔分組的連線池
+
+    - 第一次開啟某個檔案時呼叫 initialize(path) 建立資料表
+    - 每個分片最多保留 max_idle 條閒置連線
+    - 有閒置連線的分片超過 max_shards 個時，關閉最久未使用分片的閒置連線
+    """
+
+    def __init__(self, connect: Callable[[Path], sqlite3.Connection],
+                 initialize: Optional[Callable[[Path], None]] = None,
+                 max_shards: int = 64, max_idle: int = 4):
+        self._connect = connect
+        self._initialize = initialize
+        self.max_shards = max_shards
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: "OrderedDict[str, List[sqlite3.Connection]]" = OrderedDict()
+        self._initialized = set()
+        self._init_locks: Dict[str, threading.Lock] = {}
+
+    def acquire(self, path: Path) -> sqlite3.Connection:
+        key = str(path)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                return idle.pop()
+            init_lock = None if key in self._initialized else self._init_locks.setdefault(key, threading.Lock())
+
+        if init_lock is not None:
+            with init_lock:
+                if key not in self._initialized:
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    if self._initialize:
+                        self._initialize(Path(path))
+                    with self._lock:
+                        self._initialized.add(key)
+        return self._connect(Path(path))
+
+    def release(self, path: Path, conn: sqlite3.Connection, broken: bool = False):
+        """歸還連線；未結束的交易會回滾，發生錯誤的連線直接關閉"""
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        key = str(path)
+        to_close = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if broken or len(idle) >= self.max_idle:
+                to_close.append(conn)
+            else:
+                idle.append(conn)
+            while len(self._idle) > self.max_shards:
+                _, evicted = self._idle.popitem(last=False)
+                to_close.extend(evicted)
+        for connection in to_close:
+            connection.close()
+
+    def open_shards(self) -> List[str]:
+        with self._lock:
+            return [key for key, idle in self._idle.items() if idle]
+
+    def close_all(self):
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+            self._initialized.clear()
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,81 @@
+import sqlite3
+
+import main
+from cache import ResponseCache, SharedInvalidation
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.get("a")
+    cache.set("c", b"123")
+    assert cache.get("a") == b"12345"
+    assert cache.get("b") is None
+    assert cache.stats()["bytes"] == 8
+
+
+def test_invalidate_by_tag_and_stale_generation():
+    cache = ResponseCache()
+    cache.set("page", b"[]", tags=["list", "item:1"])
+    cache.set("detail", b"{}", tags=["item:1"])
+    cache.invalidate("item:1")
+    assert cache.get("page") is None and cache.get("detail") is None
+
+    generation = cache.generation
+    cache.invalidate("list")
+    cache.set("page", b"[]", tags=["list"], generation=generation)
+    assert cache.get("page") is None
+
+
+def test_example_endpoints_are_cached_and_invalidated(client):
+    assert client.get("/api/examples?category=forms").headers["X-Cache"] == "MISS"
+    assert client.get("/api/examples?category=forms").headers["X-Cache"] == "HIT"
+    assert client.get("/api/examples").headers["X-Cache"] == "MISS"
+
+    client.post("/api/examples", json={"title": "New", "description": "", "category": "forms"})
+    response = client.get("/api/examples?category=forms")
+    assert response.headers["X-Cache"] == "MISS"
+    assert "New" in [item["title"] for item in response.json()["examples"]]
+    assert client.get("/api/examples?category=forms").headers["X-Cache"] == "HIT"
+
+
+def test_invalidations_reach_other_worker_caches(db_path):
+    # 兩個 worker 行程各自的快取，共用目錄資料庫
+    conn = sqlite3.connect(db_path)
+    workers = [SharedInvalidation(ResponseCache()) for _ in range(2)]
+    for worker in workers:
+        worker.sync(conn)
+        worker.cache.set("page", b"[]", tags=["list", "item:1"])
+        worker.cache.set("other", b"[]", tags=["list:other"])
+
+    with conn:
+        workers[0].publish(conn, "item:1")
+    assert workers[0].cache.get("page") is None
+    assert workers[1].cache.get("page") == b"[]"
+    workers[1].sync(conn)
+    assert workers[1].cache.get("page") is None and workers[1].cache.get("other") == b"[]"
+
+    # 落後的 worker 漏接已清除的紀錄時清空整個快取
+    with conn:
+        workers[0].publish(conn, "item:2")
+        workers[0].publish(conn, "item:3")
+    assert SharedInvalidation.purge(conn, older_than=float("inf")) == 2
+    workers[1].sync(conn)
+    assert workers[1].cache.get("other") is None
+    conn.close()
+
+
+def test_example_created_by_another_worker_invalidates_cached_list(client, monkeypatch):
+    assert client.get("/api/examples?category=forms").headers["X-Cache"] == "MISS"
+    assert client.get("/api/examples?category=forms").headers["X-Cache"] == "HIT"
+
+    # 另一個 worker 新增範例：只寫入資料庫與失效紀錄，不會動到本行程的快取
+    other_worker = SharedInvalidation(ResponseCache())
+    with monkeypatch.context() as patched:
+        patched.setattr(main, "example_invalidations", other_worker)
+        client.post("/api/examples", json={"title": "Elsewhere", "description": "", "category": "forms"})
+
+    response = client.get("/api/examples?category=forms")
+    assert response.headers["X-Cache"] == "MISS"
+    assert "Elsewhere" in [item["title"] for item in response.json()["examples"]]
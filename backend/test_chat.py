@@ -0,0 +1,104 @@
+import json
+import sqlite3
+
+import main
+
+
+def seed_messages(db_path, conversation_id, count, timestamp=1000, suffix=""):
+    """同一時間戳寫入多則訊息，模擬同一輪內時間戳相同的情況"""
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO conversations (id, title, created_at, updated_at) VALUES (?, 't', ?, ?)",
+        (conversation_id, timestamp, timestamp),
+    )
+    conn.executemany(
+        "INSERT INTO chat_messages (id, conversation_id, sender, message, timestamp) VALUES (?, ?, 'user', ?, ?)",
+        [(f"m{i:03d}" + suffix, conversation_id, f"訊息 {i}", timestamp + i // 4) for i in range(count)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_windowed_history_pages_backwards_without_gaps(client, db_path):
+    seed_messages(db_path, "long", 23)
+
+    page = client.get("/api/chat/conversations/long/messages?limit=10").json()
+    assert [m["id"] for m in page["messages"]] == [f"m{i:03d}" for i in range(13, 23)]
+    assert page["has_more"]
+
+    seen = [m["id"] for m in page["messages"]]
+    while page["has_more"]:
+        page = client.get(f"/api/chat/conversations/long/messages?limit=10&before={page['next_before']}").json()
+        seen = [m["id"] for m in page["messages"]] + seen
+    assert seen == [f"m{i:03d}" for i in range(23)]
+
+    newer = client.get("/api/chat/conversations/long/messages?limit=5&after=1002:m009").json()
+    assert [m["id"] for m in newer["messages"]] == ["m010", "m011", "m012", "m013", "m014"]
+    assert client.get("/api/chat/conversations/long/messages?before=oops").status_code == 400
+
+
+def test_export_streams_ndjson_in_order(client, db_path, monkeypatch):
+    monkeypatch.setattr(main, "MESSAGE_EXPORT_BATCH", 7)
+    seed_messages(db_path, "export", 20)
+
+    response = client.get("/api/chat/conversations/export/export")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [f"m{i:03d}" for i in range(20)]
+    assert lines[0]["content"] == "訊息 0"
+
+    assert client.get("/api/chat/conversations/missing/export").status_code == 404
+
+
+def test_idle_conversations_are_archived_and_rehydrated_on_open(client, db_path, monkeypatch):
+    seed_messages(db_path, "old", 9, timestamp=1000)
+    seed_messages(db_path, "older", 3, timestamp=500, suffix="-older")
+    monkeypatch.setattr(main, "ARCHIVE_BATCH_SIZE", 1)
+    before = client.get("/api/chat/conversations/old/messages").json()["messages"]
+
+    # 範例會話剛建立不會封存；兩個閒置會話分兩批封存
+    assert main.archive_idle_conversations() == 2
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM chat_messages WHERE conversation_id = 'old'").fetchone()[0] == 0
+    assert conn.execute("SELECT is_archived FROM conversations WHERE id = 'old'").fetchone()[0] == 1
+
+    # 開啟時透明還原
+    assert client.get("/api/chat/conversations/old/messages").json()["messages"] == before
+    assert conn.execute("SELECT is_archived FROM conversations WHERE id = 'old'").fetchone()[0] == 0
+    conn.close()
+
+    # 在已封存的會話中繼續對話，舊訊息會先還原
+    main.archive_idle_conversations()
+    client.post("/api/chat", json={"message": "繼續", "conversation_id": "old"})
+    messages = client.get("/api/chat/conversations/old/messages?limit=200").json()["messages"]
+    assert len(messages) == 11 and messages[:9] == before
+
+
+def test_search_ranks_groups_and_handles_cjk(client, db_path):
+    first = client.post("/api/chat", json={"message": "請解釋微積分的基本定理"}).json()["conversation_id"]
+    client.post("/api/chat", json={"message": "微積分的應用有哪些？", "conversation_id": first})
+    second = client.post("/api/chat", json={"message": "線性代數與微積分哪個先學"}).json()["conversation_id"]
+
+    response = client.get("/api/chat/search", params={"q": "微積分"}).json()
+    groups = {group["conversation_id"]: group for group in response["conversations"]}
+    assert set(groups) >= {first, second}
+    assert groups[first]["match_count"] >= 2
+    assert "<mark>微積分</mark>" in groups[first]["matches"][0]["snippet"]
+    assert groups[first]["title"] and groups[first]["archived"] is False
+
+    # 兩個字元的中日韓詞以二元組索引比對
+    short = client.get("/api/chat/search", params={"q": "線性"}).json()["conversations"]
+    assert [group["conversation_id"] for group in short] == [second]
+    assert "<mark>線性</mark>" in short[0]["matches"][0]["snippet"]
+
+    assert client.get("/api/chat/search", params={"q": "  "}).status_code == 400
+    assert client.get("/api/chat/search", params={"q": "不存在的內容"}).json()["conversations"] == []
+
+
+def test_archived_messages_stay_searchable(client, db_path):
+    seed_messages(db_path, "old", 4, timestamp=1000)
+    main.index_chat_messages()
+    assert main.archive_idle_conversations() == 1
+
+    groups = client.get("/api/chat/search", params={"q": "訊息 3"}).json()["conversations"]
+    assert groups[0]["conversation_id"] == "old" and groups[0]["archived"] is True
@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+import chat_search
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    """建立熱資料庫的訊息表並索引，回傳 search.db 路徑"""
+    hot = sqlite3.connect(":memory:")
+    hot.execute("CREATE TABLE chat_messages (id TEXT PRIMARY KEY, conversation_id TEXT, sender TEXT, "
+                "message TEXT, timestamp INTEGER)")
+    chat_search.ensure_queue(hot)
+    hot.executemany(
+        "INSERT INTO chat_messages VALUES (?, 'c1', 'user', ?, ?)",
+        [
+            ("m1", "什麼是反函數？", 1),
+            ("m2", "二次函數的圖形是拋物線", 2),
+            ("m3", "函館的夜景", 3),
+            ("m4", "微積分裡的函數極限", 4),
+        ],
+    )
+    path = tmp_path / "search.db"
+    assert chat_search.index_pending(hot, path) == 4
+    hot.close()
+    return path
+
+
+def test_cjk_bigrams_split_each_run():
+    assert chat_search.cjk_bigrams("微積分 ok 函數") == "微積 積分 函數"
+    assert chat_search.cjk_bigrams("a 字 b") == ""
+    assert chat_search.parse_query("函數 微積分 x") == (["微積分"], ["函數"], ["x"])
+
+
+def test_two_character_cjk_query_uses_the_bigram_index(index_path, monkeypatch):
+    def no_like(term):
+        raise AssertionError(f"LIKE fallback for {term}")
+
+    monkeypatch.setattr(chat_search, "like_pattern", no_like)
+
+    results = chat_search.search(index_path, "函數")
+    assert sorted(result["message_id"] for result in results) == ["m1", "m2", "m4"]
+    assert all("<mark>函數</mark>" in result["snippet"] for result in results)
+
+    # 與 trigram 長詞並用
+    assert [result["message_id"] for result in chat_search.search(index_path, "函數 微積分")] == ["m4"]
+
+
+def test_existing_index_is_backfilled(index_path):
+    conn = sqlite3.connect(index_path)
+    conn.execute("DROP TABLE message_bigram_fts")
+    conn.commit()
+    conn.close()
+
+    assert [result["message_id"] for result in chat_search.search(index_path, "夜景")] == ["m3"]
@@ -0,0 +1,76 @@
+import sqlite3
+
+import main
+from counters import CounterService
+
+
+def stored_counts(db_path, example_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT likes, downloads, views FROM examples WHERE id = ?", (example_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_bump_merges_pending_and_flushes_in_batch(client, db_path):
+    example_id = client.get("/api/examples").json()["examples"][0]["id"]
+    likes, downloads, views = stored_counts(db_path, example_id)
+
+    client.post(f"/api/examples/{example_id}/like")
+    response = client.post(f"/api/examples/{example_id}/view").json()
+    assert response["likes"] == likes + 1 and response["views"] == views + 1
+    assert stored_counts(db_path, example_id) == (likes, downloads, views)
+
+    assert main.flush_counters() == [example_id]
+    assert stored_counts(db_path, example_id) == (likes + 1, downloads, views + 1)
+    assert client.get(f"/api/examples/{example_id}/counters").json()["likes"] == likes + 1
+
+    assert client.post(f"/api/examples/{example_id}/share").status_code == 404
+
+
+def test_recover_replays_only_unapplied_batches(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    example_id = conn.execute("SELECT id FROM examples").fetchone()[0]
+    likes = stored_counts(db_path, example_id)[0]
+    log_dir = tmp_path / "crash_log"
+
+    service = CounterService(log_dir, shards=2)
+    service.increment(example_id, "likes", 3)
+    service.flush(conn)
+    service.close()
+
+    # 模擬兩次中斷的寫回：一次已提交、一次尚未提交
+    (log_dir / "applied.0.flushing").write_text(f"{example_id}\tlikes\t5\n")
+    conn.execute("INSERT INTO counter_flushes (batch_id, flushed_at) VALUES ('applied', 0)")
+    conn.commit()
+    (log_dir / "lost.1.flushing").write_text(f"{example_id}\tlikes\t2\n{example_id}\tlik")
+
+    restarted = CounterService(log_dir, shards=2)
+    assert restarted.recover(conn) == 1
+    assert stored_counts(db_path, example_id)[0] == likes + 3 + 2
+    assert not list(log_dir.glob("*.flushing"))
+    conn.close()
+
+
+def test_workers_claim_separate_slots_and_adopt_stopped_ones(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    example_id = conn.execute("SELECT id FROM examples").fetchone()[0]
+    likes = stored_counts(db_path, example_id)[0]
+    base_dir = tmp_path / "counter_log"
+
+    first = CounterService.claim(base_dir, shards=2)
+    second = CounterService.claim(base_dir, shards=2)
+    assert (first.log_dir.name, second.log_dir.name) == ("slot-0", "slot-1")
+
+    # 第二個 worker 結束前未寫回：由持有其他槽的 worker 接手
+    second.increment(example_id, "likes", 4)
+    assert first.adopt_orphans(conn) == 0
+    second.close()
+    assert first.adopt_orphans(conn) == 1
+    assert stored_counts(db_path, example_id)[0] == likes + 4
+    assert first.adopt_orphans(conn) == 0
+
+    # 已釋放的槽可再被取得
+    assert CounterService.claim(base_dir, shards=2).log_dir.name == "slot-1"
+    first.close()
+    conn.close()
@@ -0,0 +1,80 @@
+import sqlite3
+
+import drawing_store
+
+
+def stroke(stroke_id):
+    return {"id": stroke_id, "tool": "pen", "points": [{"x": 0, "y": 0}, {"x": 5, "y": 5}]}
+
+
+def create_drawing(client):
+    return client.post("/api/drawings", json={
+        "id": "local", "image_data": "", "strokes": [stroke("s0")], "canvas": {"width": 800, "height": 600}
+    }).json()["id"]
+
+
+def test_patch_appends_strokes_and_undo_markers(client):
+    drawing_id = create_drawing(client)
+
+    assert client.patch(f"/api/drawings/{drawing_id}", json={
+        "base_revision": 0, "strokes": [stroke("s1"), stroke("s2")]
+    }).json()["revision"] == 1
+    assert client.patch(f"/api/drawings/{drawing_id}", json={
+        "base_revision": 1, "undo": ["s1"]
+    }).json()["revision"] == 2
+
+    stale = client.patch(f"/api/drawings/{drawing_id}", json={"base_revision": 1, "strokes": [stroke("s3")]})
+    assert stale.status_code == 409 and stale.json()["revision"] == 2
+
+    drawing = client.get(f"/api/drawings/{drawing_id}").json()
+    assert drawing["revision"] == 2
+    assert [s["id"] for s in drawing["drawing_data"]["strokes"]] == ["s0", "s2"]
+    assert len(client.get(f"/api/drawings/{drawing_id}/deltas?since=1").json()["deltas"]) == 1
+
+
+def test_deltas_are_compacted_into_snapshot(client, monkeypatch):
+    monkeypatch.setattr(drawing_store, "COMPACT_EVERY", 3)
+    drawing_id = create_drawing(client)
+
+    for revision in range(3):
+        client.patch(f"/api/drawings/{drawing_id}", json={"base_revision": revision, "strokes": [stroke(f"n{revision}")]})
+
+    assert client.get(f"/api/drawings/{drawing_id}/deltas?since=0").status_code == 410
+    drawing = client.get(f"/api/drawings/{drawing_id}").json()
+    assert drawing["stroke_count"] == 4
+    assert len(drawing["drawing_data"]["strokes"]) == 4
+
+
+def test_put_replaces_snapshot(client):
+    drawing_id = create_drawing(client)
+    client.patch(f"/api/drawings/{drawing_id}", json={"base_revision": 0, "strokes": [stroke("s1")]})
+
+    response = client.put(f"/api/drawings/{drawing_id}", json={"id": drawing_id, "image_data": "", "strokes": []})
+    assert response.json()["revision"] == 2
+    assert client.get(f"/api/drawings/{drawing_id}").json()["drawing_data"]["strokes"] == []
+
+
+def test_put_between_patch_check_and_write_turns_patch_into_conflict(client, db_path):
+    drawing_id = create_drawing(client)
+    patcher = sqlite3.connect(db_path, isolation_level="IMMEDIATE")
+    writer = sqlite3.connect(db_path, isolation_level="IMMEDIATE")
+
+    def put_once(statement):
+        # PATCH 開始寫入交易的瞬間（讀取版本之後），另一個連線的 PUT 搶先完成
+        if statement.startswith("BEGIN"):
+            patcher.set_trace_callback(None)
+            drawing_store.replace_snapshot(writer, drawing_id, {"strokes": [stroke("p1")]})
+
+    patcher.set_trace_callback(put_once)
+    try:
+        drawing_store.append_delta(patcher, drawing_id, 0, strokes=[stroke("s1")])
+        assert False, "expected a revision conflict"
+    except drawing_store.RevisionConflict as e:
+        assert e.current_revision == 1
+    finally:
+        patcher.close()
+        writer.close()
+
+    drawing = client.get(f"/api/drawings/{drawing_id}").json()
+    assert drawing["revision"] == 1
+    assert [s["id"] for s in drawing["drawing_data"]["strokes"]] == ["p1"]
@@ -0,0 +1,45 @@
+import formula
+
+
+def test_equivalent_outputs_canonicalize_to_the_same_latex():
+    variants = [
+        "\\[x^{2} + 1 \\le y\\]",
+        "Here it is:\n$$ x^2+1\\leq y $$",
+        "```latex\nx^{2}+ 1 \\leq  y\n```",
+    ]
+    results = {formula.process(text).latex for text in variants}
+    assert results == {"\\[x^2+1\\leq y\\]"}
+
+
+def test_spacing_is_kept_where_it_matters():
+    processed = formula.process("\\[\\alpha b + \\text{if } x\\]")
+    assert processed.body == "\\alpha b+\\text{if }x"
+    assert formula.process("\\[\\left\\{ x \\right.\\]").body == "\\left\\{x\\right."
+
+
+def test_validation_drives_confidence():
+    valid = formula.process("\\[\\begin{aligned} 2x &= 5 \\\\ y &= 0 \\end{aligned}\\]")
+    assert valid.valid and valid.confidence > 0.9 and not valid.errors
+
+    broken = formula.process("\\[\\frac{1}{2 + \\begin{cases} x \\end{aligned}\\]")
+    assert not broken.valid and broken.confidence < 0.5
+    assert any("Unbalanced" in error for error in broken.errors)
+    assert any("Unmatched" in error for error in broken.errors)
+
+    unknown = formula.process("\\[\\foo{x}\\]")
+    assert unknown.errors == ["Unsupported command \\foo"]
+
+    assert formula.process("沒有公式").latex is None
+    assert formula.process("\\[x + 1\\]", mean_logprob=-0.5).confidence < valid.confidence
+
+
+def test_prefers_valid_candidates_and_merges_display_blocks():
+    text = "答案 $x{$ 或\n\\[a = 1\\]\n\\[b = 2\\]"
+    assert formula.process(text).body == "\\begin{gathered}a=1\\\\b=2\\end{gathered}"
+
+
+def test_processing_is_memoized_on_raw_text():
+    formula._process_text.cache_clear()
+    formula.process("\\[z\\]")
+    formula.process("\\[z\\]", mean_logprob=-0.1)
+    assert formula._process_text.cache_info().hits == 1
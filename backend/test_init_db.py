@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+
+import init_db
+
+
+def test_online_backup_includes_uncheckpointed_wal(db_path, tmp_path):
+    # 保持一個連線開啟，讓寫入留在 -wal 檔而不寫回主檔
+    writer = sqlite3.connect(db_path)
+    writer.execute("PRAGMA wal_autocheckpoint=0")
+    writer.execute("INSERT INTO statistics (event_type, event_data, timestamp) VALUES ('backup-test', '{}', 0)")
+    writer.commit()
+    assert db_path.with_name(db_path.name + "-wal").stat().st_size > 0
+
+    backup_path = tmp_path / "backup.db"
+    assert init_db.backup_database(backup_path, pages=1, pause=0, quiet=True)
+    writer.close()
+
+    copy = sqlite3.connect(backup_path)
+    assert copy.execute("SELECT COUNT(*) FROM statistics WHERE event_type = 'backup-test'").fetchone()[0] == 1
+    assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    copy.close()
+
+
+def test_backup_finishes_while_another_connection_keeps_writing(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO statistics (event_type, event_data, timestamp) VALUES ('bulk', ?, 0)", [("x" * 2000,)] * 200
+    )
+    conn.commit()
+    stop = threading.Event()
+
+    def keep_writing():
+        writer = sqlite3.connect(db_path)
+        deadline = time.monotonic() + 15
+        while not stop.is_set() and time.monotonic() < deadline:
+            writer.execute("INSERT INTO statistics (event_type, event_data, timestamp) VALUES ('tick', '{}', 0)")
+            writer.commit()
+            time.sleep(0.002)
+        writer.close()
+
+    thread = threading.Thread(target=keep_writing)
+    thread.start()
+    try:
+        # 每步只複製一頁：每次寫入都會讓備份重新開始，超過上限後改為單一步驟完成
+        started = time.monotonic()
+        assert init_db.backup_database(tmp_path / "backup.db", pages=1, pause=0.005, quiet=True, max_restarts=2)
+        assert time.monotonic() - started < 10
+    finally:
+        stop.set()
+        thread.join()
+        conn.close()
+
+    copy = sqlite3.connect(tmp_path / "backup.db")
+    assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert copy.execute("SELECT COUNT(*) FROM statistics WHERE event_type = 'bulk'").fetchone()[0] == 200
+    copy.close()
+
+
+def test_compact_and_incremental_vacuum_release_free_pages(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO statistics (event_type, event_data, timestamp) VALUES ('bulk', ?, 0)", [("x" * 2000,)] * 200
+    )
+    conn.commit()
+    conn.execute("DELETE FROM statistics WHERE event_type = 'bulk'")
+    conn.commit()
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+    assert free_pages > 50
+
+    compacted = tmp_path / "compact.db"
+    assert init_db.compact_database(compacted)
+    assert compacted.stat().st_size < db_path.stat().st_size
+
+    assert init_db.incremental_vacuum() == free_pages
+
+
+def test_info_reads_statistics_without_scanning(db_path):
+    conn = sqlite3.connect(db_path)
+    assert init_db.database_stats(conn)["objects"]["examples"]["rows"] is None
+
+    init_db.analyze_database()
+    examples = conn.execute("SELECT COUNT(*) FROM examples").fetchone()[0]
+    stats = init_db.database_stats(conn)
+    assert stats["journal_mode"] == "wal" and stats["auto_vacuum"] == "INCREMENTAL"
+    assert stats["objects"]["examples"]["rows"] == examples
+    assert stats["objects"]["examples"]["bytes"] > 0
+    conn.close()
+
+
+def test_server_and_init_script_drop_the_same_obsolete_indexes(db_path):
+    import main
+
+    assert main.OBSOLETE_INDEXES == init_db.OBSOLETE_INDEXES
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE INDEX idx_examples_featured ON examples(is_featured)")
+    main.create_indexes(conn.cursor())
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert not names & set(init_db.OBSOLETE_INDEXES)
+
+
+def test_server_created_database_uses_incremental_auto_vacuum(tmp_path):
+    import main
+
+    path = tmp_path / "fresh.db"
+    main.init_database(path)
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+from starlette.testclient import TestClient
+
+import jobs
+import main
+
+
+def test_queue_orders_by_priority_and_dedupes_queued_jobs(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.db")
+    low = queue.enqueue("a", {"n": 1})
+    high = queue.enqueue("b", {"n": 2}, priority=5)
+    assert queue.enqueue("c", dedupe_key="k") == queue.enqueue("c", {"other": True}, dedupe_key="k")
+    queue.enqueue("a", delay=60)
+
+    assert [queue.claim().id for _ in range(2)] == [high, low]
+    deduped = queue.claim()
+    assert deduped.kind == "c" and deduped.payload == {}
+    # 執行中的工作不擋住新的相同 dedupe_key
+    assert queue.enqueue("c", dedupe_key="k") != deduped.id
+    assert queue.claim(kinds=["a"]) is None
+
+
+def test_failed_jobs_retry_with_backoff_then_fail(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.db")
+    job_id = queue.enqueue("flaky", max_attempts=2)
+
+    job = queue.claim()
+    assert queue.fail(job, "boom")
+    assert queue.get(job_id)["run_after"] > time.time() and queue.claim() is None
+
+    conn = queue.connect()
+    with conn:
+        conn.execute("UPDATE jobs SET run_after = 0")
+    conn.close()
+    job = queue.claim()
+    assert job.attempts == 2
+    assert not queue.fail(job, "boom again")
+    assert queue.get(job_id)["status"] == jobs.FAILED
+
+    metrics = queue.metrics()
+    assert metrics["failed"] == 1 and metrics["recent_retries"] == 1 and metrics["by_kind"]["flaky"] == {"failed": 1}
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.db", lease=-1)
+    job_id = queue.enqueue("slow")
+    assert queue.claim().id == job_id
+    # 租約已到期：視為 worker 已結束，重新取出
+    assert queue.claim().attempts == 2
+
+
+def test_expired_lease_stops_after_the_last_attempt(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.db", lease=-1)
+    job_id = queue.enqueue("crashy", max_attempts=2)
+    assert [queue.claim().attempts for _ in range(2)] == [1, 2]
+
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == jobs.FAILED and "last attempt" in job["last_error"]
+
+
+def test_crashed_job_yields_to_a_requeued_duplicate(tmp_path):
+    queue = jobs.JobQueue(tmp_path / "jobs.db", lease=-1)
+    crashed = queue.enqueue("rank", dedupe_key="ranking")
+    assert queue.claim().id == crashed
+    # worker 崩潰期間又加入相同 dedupe_key 的工作；重新排隊舊工作會違反唯一索引
+    fresh = queue.enqueue("rank", dedupe_key="ranking")
+    assert fresh != crashed
+
+    assert queue.claim().id == fresh
+    assert queue.get(crashed)["status"] == jobs.FAILED
+    # 佇列沒有卡住：之後的工作照常取出
+    later = queue.enqueue("rank", dedupe_key="ranking")
+    assert queue.claim().id == later
+
+
+def test_drawing_save_enqueues_asset_job_for_the_tenant(client):
+    headers = {"X-Tenant-ID": "school-a"}
+    drawing_id = client.post("/api/drawings", headers=headers, json={
+        "id": "local", "canvas": {"width": 400, "height": 200},
+        "strokes": [{"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 300, "y": 150}]}],
+    }).json()["id"]
+    client.patch(f"/api/drawings/{drawing_id}", headers=headers, json={"base_revision": 0, "strokes": []})
+    assert client.get("/api/jobs/metrics").json()["by_kind"]["drawing.assets"] == {"queued": 1}
+
+    pool = jobs.WorkerPool(main.job_queue(), main.job_handlers())
+    assert pool.run_once() and not pool.run_once()
+    assert list((main.THUMBNAIL_DIR / "school-a").glob(f"{drawing_id}-r1-*.png"))
+    assert client.get("/api/jobs/metrics").json()["done"] == 1
+
+
+def test_new_example_is_ranked_without_a_full_recompute(client):
+    example_id = client.post("/api/examples", json={"title": "new", "description": "", "category": "forms"}).json()["id"]
+
+    # 寫入時已計算分數，不排入全表重算的工作
+    assert "examples.rankings" not in client.get("/api/jobs/metrics").json()["by_kind"]
+    ranked = client.get("/api/examples?category=forms&sort=trending").json()["examples"]
+    assert ranked[0]["id"] == example_id
+
+
+def test_async_analysis_returns_job_and_is_idempotent(db_path, monkeypatch):
+    calls = []
+
+    async def fake_analysis(body, provider, api_key, model):
+        calls.append(body)
+        await asyncio.sleep(0.05)
+        return {"success": True, "analysis": f"分析 {body['image_data']}"}
+
+    monkeypatch.setattr(main, "run_image_analysis", fake_analysis)
+    monkeypatch.setattr(main, "JOB_EVENT_INTERVAL", 0.01)
+    headers = {"Idempotency-Key": "upload-1"}
+    with TestClient(main.app) as client:
+        submitted = client.post("/api/analyze-image?mode=async", json={"image_data": "a"}, headers=headers)
+        assert submitted.status_code == 202
+        job_id = submitted.json()["id"]
+        assert client.post("/api/analyze-image", json={"image_data": "a"},
+                           headers={**headers, "Prefer": "respond-async"}).json()["id"] == job_id
+        assert client.post("/api/analyze-image?mode=async", json={"image_data": "b"}, headers=headers).status_code == 409
+
+        events = client.get(f"/api/jobs/{job_id}/events").text
+        assert events.rstrip().splitlines()[-2] == "event: done"
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["status"] == "succeeded"
+        assert job["result"] == {"success": True, "analysis": "分析 a", "suggested_examples": None, "error": None}
+        assert len(calls) == 1
+        assert client.get("/api/jobs/missing").status_code == 404
@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import io
+
+from PIL import Image
+
+import main
+import math_batch
+
+
+def png_data_url() -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), "white").save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_parse_sections_by_index():
+    text = "[[2]]\n\\[b\\]\n[[1]]\n\\[a\\]\n[[9]]\n\\[z\\]"
+    assert math_batch.parse_sections(text, 2) == {1: "\\[a\\]", 2: "\\[b\\]"}
+    assert math_batch.parse_sections("\\[x\\]", 1) == {1: "\\[x\\]"}
+    assert math_batch.parse_sections("\\[x\\]", 2) == {}
+
+
+def test_recognize_batch_packs_calls_and_retries_missing_items():
+    calls = []
+    active = {"now": 0, "peak": 0}
+
+    async def call_model(images, prompt):
+        calls.append(list(images))
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        if "bad" in images:
+            raise RuntimeError("boom")
+        # 多張時故意漏掉 "skip"，單獨重試時才回答
+        return "\n".join(
+            f"[[{number}]]\n\\[{image}\\]"
+            for number, image in enumerate(images, start=1)
+            if image != "skip" or len(images) == 1
+        )
+
+    images = ["a", "b", "skip", None, "c", "d", "e", "bad"]
+    batch = asyncio.run(math_batch.recognize_batch(
+        images, call_model, lambda text: {"latex": text}, batch_size=4, concurrency=2
+    ))
+    results = batch["results"]
+
+    # 7 張可用圖片平均分成 4 + 3 張兩批；第二批呼叫失敗後逐一重試，只有 "bad" 失敗
+    assert [results[i]["latex"] for i in (0, 1, 2, 4, 5, 6)] == [
+        "\\[a\\]", "\\[b\\]", "\\[skip\\]", "\\[c\\]", "\\[d\\]", "\\[e\\]"
+    ]
+    assert results[7]["success"] is False and "boom" in results[7]["error"]
+    assert 3 not in results
+    assert sorted(map(len, calls)) == [1, 1, 1, 1, 3, 4]
+    assert batch["model_calls"] == 6 and active["peak"] <= 2
+
+
+def test_batch_endpoint_reports_partial_failures(client, monkeypatch):
+    async def call_model(images, prompt):
+        return "\n".join(f"[[{n}]]\n\\[x_{n}\\]" for n in range(1, len(images) + 1))
+
+    monkeypatch.setattr(main, "get_math_model_call", lambda *args: call_model)
+    drawing_id = client.post("/api/drawings", json={"id": "local", "strokes": [
+        {"id": "s", "points": [{"x": 10, "y": 10}, {"x": 50, "y": 50}]}
+    ]}).json()["id"]
+
+    response = client.post("/api/analyze-math/batch", json={"drawing_id": drawing_id, "items": [
+        {"bbox": {"x": 0, "y": 0, "width": 60, "height": 60}},
+        {"image_data": png_data_url()},
+        {"bbox": {"x": 0, "y": 0, "width": 0, "height": 5}},
+        {"image_data": "aGVsbG8="},
+    ]}).json()
+
+    assert (response["success"], response["partial"], response["model_calls"]) == (False, True, 1)
+    assert [r["success"] for r in response["results"]] == [True, True, False, False]
+    assert response["results"][2]["error"]
+    # 損壞的圖片在載入時就失敗，不送進模型呼叫
+    assert response["results"][3]["error"].startswith("Invalid image data")
+    assert client.post("/api/analyze-math/batch", json={"items": []}).status_code == 400
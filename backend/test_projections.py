@@ -0,0 +1,38 @@
+def large_bundle():
+    return [{"name": f"page{i}.html", "type": "html", "content": "<div>" * 20000} for i in range(5)]
+
+
+def test_example_list_is_summary_projection(client):
+    example_id = client.post("/api/examples", json={
+        "title": "Big", "description": "large bundle", "category": "forms", "files": large_bundle()
+    }).json()["id"]
+
+    listing = client.get("/api/examples?category=forms")
+    card = next(item for item in listing.json()["examples"] if item["id"] == example_id)
+    assert "files" not in card and "metadata" not in card
+    assert card["file_count"] == 5
+
+    detail = client.get(f"/api/examples/{example_id}")
+    assert len(detail.json()["files"]) == 5
+    assert len(listing.content) * 10 < len(detail.content)
+
+
+def test_fields_selector(client):
+    listing = client.get("/api/examples?fields=title,likes").json()["examples"]
+    assert all(set(item) == {"id", "title", "likes"} for item in listing)
+
+    assert client.get("/api/examples?fields=files").status_code == 400
+
+
+def test_drawing_projections(client):
+    drawing_id = client.post("/api/drawings", json={
+        "id": "d1", "image_data": "data:image/png;base64,AAAA", "strokes": [{"points": []}, {"points": []}]
+    }).json()["id"]
+
+    summary = client.get("/api/drawings").json()["drawings"][0]
+    assert summary["stroke_count"] == 2
+    assert "thumbnail" not in summary and "drawing_data" not in summary
+
+    detail = client.get(f"/api/drawings/{drawing_id}?fields=drawing_data").json()
+    assert set(detail) == {"id", "drawing_data"}
+    assert len(detail["drawing_data"]["strokes"]) == 2
@@ -0,0 +1,80 @@
+import re
+import sqlite3
+
+import pytest
+
+import main
+
+# 沒有 USING INDEX 的 SCAN 即為全表掃描
+FULL_SCAN = re.compile(r"^SCAN (?!.*\bUSING\b)")
+TEMP_SORT = "USE TEMP B-TREE"
+
+
+@pytest.fixture
+def traced_statements(db_path):
+    """記錄 API 端點實際執行的 SQL"""
+    statements = []
+
+    def get_traced_db():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.set_trace_callback(statements.append)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # 範例端點使用目錄資料庫的連線（get_catalog_db，get_catalog_storage 也經由它取得）
+    dependencies = (main.get_db, main.get_catalog_db)
+    for dependency in dependencies:
+        main.app.dependency_overrides[dependency] = get_traced_db
+    yield statements
+    for dependency in dependencies:
+        main.app.dependency_overrides.pop(dependency, None)
+
+
+def explain(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    finally:
+        conn.close()
+
+
+def test_api_queries_use_indexes(client, db_path, traced_statements):
+    conversation_id = client.post("/api/chat", json={"message": "你好"}).json()["conversation_id"]
+    drawing_id = client.post("/api/drawings", json={"id": "d1", "image_data": "", "strokes": []}).json()["id"]
+    example_id = client.get("/api/examples").json()["examples"][0]["id"]
+
+    # 範例查詢各自應使用的複合索引或主鍵索引
+    example_indexes = {
+        "/api/examples?category=forms": "idx_examples_category_created_id",
+        "/api/examples?sort=popular": "idx_examples_popular_id",
+        "/api/examples?category=forms&sort=trending": "idx_examples_category_trending_id",
+        f"/api/examples/{example_id}": "sqlite_autoindex_examples_1",
+    }
+    for url in [
+        "/api/chat/conversations",
+        f"/api/chat/conversations/{conversation_id}/messages",
+        f"/api/chat/conversations/{conversation_id}/messages?before=9999999999:z",
+        f"/api/chat/conversations/{conversation_id}/messages?after=0:a",
+        *example_indexes,
+        "/api/drawings",
+        f"/api/drawings/{drawing_id}",
+    ]:
+        traced = len(traced_statements)
+        assert client.get(url).status_code == 200
+        if url in example_indexes:
+            # 取出資料列的查詢（COUNT(*) 走任一涵蓋索引即可）
+            plans = [explain(db_path, sql) for sql in traced_statements[traced:]
+                     if "FROM examples" in sql and "COUNT(*)" not in sql]
+            assert plans, url
+            assert all(any(example_indexes[url] in step for step in plan) for plan in plans), (url, plans)
+
+    queries = [sql for sql in traced_statements if sql.lstrip().upper().startswith("SELECT")]
+    assert queries
+
+    for sql in queries:
+        plan = explain(db_path, sql)
+        assert not any(FULL_SCAN.match(step) for step in plan), (sql, plan)
+        assert not any(TEMP_SORT in step for step in plan), (sql, plan)
@@ -0,0 +1,45 @@
+import sqlite3
+
+import main
+from ranking import popularity_score, trending_score
+
+
+def test_trending_prefers_recent_items_with_equal_engagement():
+    assert trending_score(10, 0, 0, created_at=2_000_000) > trending_score(10, 0, 0, created_at=1_000_000)
+    assert trending_score(100, 0, 0, created_at=1_000_000) > trending_score(1, 0, 0, created_at=1_000_000)
+
+
+def test_popular_sort_follows_flushed_counters(client):
+    main.refresh_rankings()
+    ranked = client.get("/api/examples?sort=popular").json()["examples"]
+    scores = [popularity_score(item["likes"], item["downloads"], item["views"]) for item in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+    underdog = ranked[-1]["id"]
+    client.post(f"/api/examples/{underdog}/like")
+    main.counter_service.increment(underdog, "likes", 1000)
+    main.flush_counters()
+
+    assert client.get("/api/examples?sort=popular").json()["examples"][0]["id"] == underdog
+    assert client.get("/api/examples?sort=random").status_code == 400
+
+
+def test_tied_scores_page_in_a_stable_order(client, db_path):
+    created = {
+        client.post("/api/examples", json={"title": f"t{n}", "description": "", "category": "ties"}).json()["id"]
+        for n in range(5)
+    }
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE examples SET created_at = 1700000000 WHERE category = 'ties'")
+    conn.close()
+    main.refresh_rankings()
+
+    for sort in ("newest", "popular", "trending"):
+        pages = [
+            client.get(f"/api/examples?category=ties&sort={sort}&limit=2&page={page}").json()["examples"]
+            for page in (1, 2, 3)
+        ]
+        ids = [item["id"] for page in pages for item in page]
+        # 同時間建立、分數都是 0：以 id 遞減排序，分頁不重複也不遺漏
+        assert ids == sorted(created, reverse=True), sort
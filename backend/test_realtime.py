@@ -0,0 +1,201 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import drawing_store
+import main
+import realtime
+import tenancy
+
+
+def frame(ws):
+    return json.loads(ws.receive_text())
+
+
+def test_chat_and_errors_share_one_connection(client):
+    with client.websocket_connect("/ws?tenant=school-a") as ws:
+        ws.send_text('["chat",1,{"message":"哈囉"}]')
+        kind, ref, reply = frame(ws)
+        assert (kind, ref) == ("ok", 1) and reply["conversation_id"]
+
+        ws.send_text('["chat",2,{}]')
+        assert frame(ws)[:2] == ["error", 2]
+        ws.send_text('["nope",3,{}]')
+        assert frame(ws) == ["error", 3, {"status": 404, "detail": "Unknown frame kind: nope"}]
+        ws.send_text("not json")
+        assert frame(ws)[2]["status"] == 400
+        ws.send_text('["ping",4]')
+        assert frame(ws) == ["pong", 4, {}]
+
+    conversations = client.get("/api/chat/conversations", headers={"X-Tenant-ID": "school-a"}).json()
+    assert [c["id"] for c in conversations["conversations"]] == [reply["conversation_id"]]
+
+
+def test_stroke_deltas_are_broadcast_to_other_subscribers(client):
+    headers = {"X-Tenant-ID": "school-a"}
+    drawing_id = client.post("/api/drawings", headers=headers, json={
+        "id": "local", "canvas": {"width": 400, "height": 200}, "strokes": [],
+    }).json()["id"]
+    stroke = {"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 300, "y": 150}]}
+
+    with client.websocket_connect("/ws", headers=headers) as author, \
+            client.websocket_connect("/ws?tenant=school-a") as viewer, \
+            client.websocket_connect("/ws?tenant=school-b") as other_tenant:
+        viewer.send_text(json.dumps(["sub", 1, {"drawing_id": drawing_id}]))
+        assert frame(viewer) == ["ok", 1, {"drawing_id": drawing_id, "revision": 0}]
+        other_tenant.send_text(json.dumps(["sub", 1, {"drawing_id": drawing_id}]))
+        assert frame(other_tenant)[2]["status"] == 404
+
+        author.send_text(json.dumps(["stroke", 1, {"drawing_id": drawing_id, "base_revision": 0, "strokes": [stroke]}]))
+        assert frame(author) == ["ok", 1, {"id": drawing_id, "revision": 1}]
+        kind, ref, delta = frame(viewer)
+        assert (kind, ref, delta["revision"], delta["strokes"]) == ("delta", 0, 1, [stroke])
+
+        author.send_text(json.dumps(["stroke", 2, {"drawing_id": drawing_id, "base_revision": 0, "undo": ["s1"]}]))
+        assert frame(author) == ["error", 2, {"revision": 1, "status": 409, "detail": "Revision conflict"}]
+
+
+def test_rest_edits_reach_websocket_subscribers(client):
+    headers = {"X-Tenant-ID": "school-a"}
+    drawing_id = client.post("/api/drawings", headers=headers, json={
+        "id": "local", "canvas": {"width": 400, "height": 200}, "strokes": [],
+    }).json()["id"]
+    stroke = {"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 300, "y": 150}]}
+
+    with client.websocket_connect("/ws?tenant=school-a") as viewer:
+        viewer.send_text(json.dumps(["sub", 1, {"drawing_id": drawing_id}]))
+        assert frame(viewer)[2]["revision"] == 0
+
+        patch = {"base_revision": 0, "strokes": [stroke]}
+        assert client.patch(f"/api/drawings/{drawing_id}", headers=headers, json=patch).json()["revision"] == 1
+        kind, _, delta = frame(viewer)
+        assert (kind, delta["base_revision"], delta["revision"], delta["strokes"]) == ("delta", 0, 1, [stroke])
+
+        # PUT 取代快照，沒有增量可送：改送 resync
+        client.put(f"/api/drawings/{drawing_id}", headers=headers, json={
+            "id": drawing_id, "canvas": {"width": 400, "height": 200}, "strokes": [],
+        })
+        topic = f"drawing:school-a:{drawing_id}"
+        assert frame(viewer) == ["resync", 0, {"topics": [topic]}]
+        assert main.realtime_hub.revisions[topic] == 2
+
+
+def test_writes_from_other_workers_are_polled_and_pushed(db_path, monkeypatch):
+    monkeypatch.setattr(main, "WS_DELTA_POLL_INTERVAL", 0.01)
+    headers = {"X-Tenant-ID": "school-a"}
+    stroke = {"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 300, "y": 150}]}
+    on_loop = []
+    read_drawing_changes = main.read_drawing_changes
+
+    def record_reads(*args):
+        # 記錄每次讀取是否在事件迴圈的執行緒上
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return read_drawing_changes(*args)
+
+    monkeypatch.setattr(main, "read_drawing_changes", record_reads)
+    with TestClient(main.app) as client, client.websocket_connect("/ws", headers=headers) as viewer:
+        drawing_id = client.post("/api/drawings", headers=headers, json={
+            "id": "local", "canvas": {"width": 400, "height": 200}, "strokes": [],
+        }).json()["id"]
+        viewer.send_text(json.dumps(["sub", 1, {"drawing_id": drawing_id}]))
+        assert frame(viewer)[2]["revision"] == 0
+        on_loop.clear()
+
+        # 另一個 worker 行程直接寫入分片
+        other_worker = sqlite3.connect(tenancy.shard_path(db_path, "school-a"))
+        assert drawing_store.append_delta(other_worker, drawing_id, 0, strokes=[stroke]) == 1
+        assert drawing_store.append_delta(other_worker, drawing_id, 1, undo=["s1"]) == 2
+        assert [(f[0], f[2]["revision"]) for f in (frame(viewer), frame(viewer))] == [("delta", 1), ("delta", 2)]
+        # 輪詢的資料庫讀取不佔用事件迴圈
+        assert on_loop and not any(on_loop)
+
+        # 另一個 worker 取代快照（PUT）：沒有增量可補送，改送 resync
+        assert drawing_store.replace_snapshot(other_worker, drawing_id, {"strokes": [stroke]}) == 3
+        other_worker.close()
+        assert frame(viewer)[0] == "resync"
+
+        viewer.send_text(json.dumps(["sub", 2, {"drawing_id": drawing_id}]))
+        assert frame(viewer)[2]["revision"] == 3
+
+
+def test_analysis_progress_is_pushed_on_the_request_ref(db_path, monkeypatch):
+    async def fake_analysis(body, provider, api_key, model):
+        await asyncio.sleep(0.05)
+        return {"success": True, "analysis": f"{provider}:{body['image_data']}"}
+
+    monkeypatch.setitem(main.ANALYSIS_KINDS, "analyze-image", (fake_analysis, main.ImageAnalysisResponse))
+    monkeypatch.setattr(main, "JOB_EVENT_INTERVAL", 0.01)
+    with TestClient(main.app) as client, client.websocket_connect("/ws") as ws:
+        request = {"kind": "analyze-image", "body": {"image_data": "a"}, "ai": {"provider": "Gemini"},
+                   "idempotency_key": "upload-1"}
+        ws.send_text(json.dumps(["analyze", 5, request]))
+        kind, ref, job = frame(ws)
+        assert (kind, ref, job["status"]) == ("ok", 5, "queued")
+
+        events = []
+        while not events or events[-1]["event"] != "done":
+            kind, ref, pushed = frame(ws)
+            assert (kind, ref) == ("job", 5)
+            events.append(pushed)
+        assert events[-1]["job"]["result"]["analysis"] == "gemini:a"
+
+        ws.send_text(json.dumps(["job", 6, {"job_id": job["id"]}]))
+        assert frame(ws)[2]["status"] == "succeeded"
+        # 重送已完成的工作：回覆即為結果，之後沒有推送
+        ws.send_text(json.dumps(["analyze", 7, request]))
+        assert frame(ws)[2]["id"] == job["id"]
+        ws.send_text('["ping",8]')
+        assert frame(ws) == ["pong", 8, {}]
+
+
+def test_missed_heartbeats_close_the_connection(client, monkeypatch):
+    monkeypatch.setattr(main, "WS_HEARTBEAT_INTERVAL", 0.02)
+    with client.websocket_connect("/ws") as ws:
+        assert frame(ws) == ["ping", 0, {}]
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                ws.receive_text()
+        assert closed.value.code == realtime.CLOSE_TIMEOUT
+
+
+def test_full_send_queue_drops_broadcasts_and_requests_resync():
+    class SlowSocket:
+        def __init__(self):
+            self.sent = []
+            self.ready = asyncio.Event()
+
+        async def send_text(self, text):
+            await self.ready.wait()
+            self.sent.append(json.loads(text))
+
+    async def scenario():
+        socket = SlowSocket()
+        connection = realtime.Connection(socket, send_queue=2)
+        hub = realtime.Hub()
+        hub.subscribe(connection, "drawing:a")
+        writer = asyncio.ensure_future(connection._write())
+        hub.publish("drawing:a", "delta", {"n": 0})
+        await asyncio.sleep(0)
+        # 寫出端卡在第一個訊框，佇列只剩兩格
+        assert [hub.publish("drawing:a", "delta", {"n": n}) for n in range(1, 4)] == [1, 1, 0]
+        assert connection.dropped == 1
+
+        socket.ready.set()
+        while len(socket.sent) < 4:
+            await asyncio.sleep(0)
+        writer.cancel()
+        hub.unregister(connection)
+        assert hub.topics == {}
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    assert [f[2].get("n") for f in sent[:3]] == [0, 1, 2]
+    assert sent[3] == ["resync", 0, {"topics": ["drawing:a"]}]
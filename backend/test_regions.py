@@ -0,0 +1,74 @@
+import base64
+import io
+import tracemalloc
+
+from PIL import Image
+
+import main
+from regions import Region, render_region, select_strokes
+
+
+def line(stroke_id, x0, y0, x1, y1):
+    return {"id": stroke_id, "size": 4, "points": [{"x": x0, "y": y0}, {"x": x1, "y": y1}]}
+
+
+STROKES = [
+    line("left", 10, 10, 90, 90),
+    line("right", 500, 10, 590, 90),
+    line("corner", 150, 150, 300, 160),
+]
+
+
+def test_select_strokes_by_bbox_and_lasso():
+    assert select_strokes(STROKES, Region.parse(bbox={"x": 0, "y": 0, "width": 200, "height": 200})) == [0, 2]
+
+    # 套索外框涵蓋 corner，但多邊形內沒有它的任何點
+    lasso = [{"x": 0, "y": 0}, {"x": 200, "y": 0}, {"x": 0, "y": 200}]
+    assert select_strokes(STROKES, Region.parse(lasso=lasso)) == [0]
+
+
+def test_render_region_draws_only_the_selected_area():
+    image = Image.open(io.BytesIO(render_region({"strokes": STROKES}, Region.parse(bbox={
+        "x": 0, "y": 0, "width": 100, "height": 100
+    }))))
+
+    assert max(image.size) >= 256
+    assert image.getpixel((image.width // 2, image.height // 2)) == (0, 0, 0)
+
+
+def test_tiny_region_over_long_stroke_stays_small():
+    strokes = [{"id": "long", "size": 10, "points": [{"x": 0, "y": 100}, {"x": 700, "y": 100}]}]
+    tracemalloc.start()
+    try:
+        png = render_region({"strokes": strokes}, Region.parse(bbox={"x": 350, "y": 99, "width": 2, "height": 2}))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # 放大倍數與筆刷半徑有上限，畫面外的取樣點不展開印章
+    assert peak < 50 * 1024 * 1024
+    image = Image.open(io.BytesIO(png))
+    assert image.getpixel((image.width // 2, image.height // 2)) == (0, 0, 0)
+
+
+def test_analyze_math_accepts_drawing_region(client, monkeypatch):
+    drawing_id = client.post("/api/drawings", json={"id": "local", "strokes": STROKES}).json()["id"]
+    received = []
+
+    async def fake_analyze(image_data):
+        received.append(image_data)
+        return {"success": True, "latex": "\\[x\\]", "confidence": 1.0}
+
+    monkeypatch.setattr(main, "analyze_math_formula", fake_analyze)
+
+    response = client.post("/api/analyze-math", json={
+        "drawing_id": drawing_id, "bbox": {"x": 480, "y": 0, "width": 120, "height": 100}
+    }).json()
+    assert response["success"] and len(received) == 1
+    assert Image.open(io.BytesIO(base64.b64decode(received[0]))).format == "PNG"
+
+    missing = client.post("/api/analyze-math", json={
+        "drawing_id": "nope", "bbox": {"x": 0, "y": 0, "width": 1, "height": 1}
+    }).json()
+    assert (missing["success"], missing["error"]) == (False, "Drawing not found")
+    assert not client.post("/api/analyze-math", json={"drawing_id": drawing_id}).json()["success"]
@@ -0,0 +1,63 @@
+import io
+import time
+import tracemalloc
+
+from PIL import Image
+
+from render import rasterize, render_png
+
+
+def test_rasterize_scales_canvas_and_draws_strokes():
+    drawing_data = {
+        "canvas": {"width": 400, "height": 200},
+        "strokes": [
+            {"tool": "pen", "color": "#ff0000", "size": 8, "points": [{"x": 0, "y": 100}, {"x": 400, "y": 100}]},
+            {"tool": "eraser", "size": 40, "points": [{"x": 200, "y": 100}]},
+        ],
+    }
+    image = rasterize(drawing_data, max_size=200)
+
+    assert image.size == (200, 100)
+    assert image.getpixel((20, 50)) == (255, 0, 0)
+    assert image.getpixel((100, 50)) == (255, 255, 255)
+    assert image.getpixel((20, 10)) == (255, 255, 255)
+
+
+def test_thumbnail_endpoint_renders_current_revision(client):
+    drawing_id = client.post("/api/drawings", json={
+        "id": "local", "canvas": {"width": 800, "height": 400},
+        "strokes": [{"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 700, "y": 300}]}]
+    }).json()["id"]
+
+    response = client.get(f"/api/drawings/{drawing_id}/thumbnail?size=small")
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.content)).size == (128, 64)
+
+    client.patch(f"/api/drawings/{drawing_id}", json={"base_revision": 0, "strokes": []})
+    assert "-r1-" in client.get(f"/api/drawings/{drawing_id}/thumbnail?size=small").headers["etag"]
+    assert client.get("/api/drawings").json()["drawings"][0]["thumbnail_url"].endswith("size=small")
+
+
+def test_far_off_canvas_stroke_is_clipped_before_sampling():
+    drawing_data = {
+        "canvas": {"width": 800, "height": 600},
+        "strokes": [
+            {"size": 4, "points": [{"x": 0, "y": 300}, {"x": 5e7, "y": 300}]},
+            {"size": 4, "points": [{"x": -1e9, "y": -1e9}, {"x": 1e9, "y": 1e9}]},
+            {"size": 4, "points": [{"x": "nan", "y": 0}, {"x": 2e9, "y": -5e8}]},
+        ],
+    }
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(render_png(drawing_data, "large")))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # 取樣點只涵蓋畫面內的部分
+    assert peak < 50 * 1024 * 1024 and elapsed < 2
+    assert image.getpixel((400, 300)) == (0, 0, 0)
+    assert image.getpixel((200, 200)) == (0, 0, 0)
+    assert image.getpixel((400, 100)) == (255, 255, 255)
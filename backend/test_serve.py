@@ -0,0 +1,24 @@
+import main
+import serve
+from starlette.testclient import TestClient
+
+
+def test_uvicorn_options_follow_cli_arguments():
+    options = serve.uvicorn_options(serve.parse_args(
+        ["--workers", "3", "--loop", "asyncio", "--http", "h11", "--graceful-timeout", "12"]
+    ))
+    assert (options["workers"], options["loop"], options["http"]) == (3, "asyncio", "h11")
+    assert options["timeout_graceful_shutdown"] == 12
+    assert serve.parse_args([]).workers >= 1
+
+
+def test_readiness_tracks_lifespan_and_draining(db_path):
+    with TestClient(main.app) as client:
+        assert client.get("/livez").status_code == 200
+        ready = client.get("/readyz")
+        assert ready.status_code == 200 and ready.json()["ai_inflight"] == 0
+
+        main.app.state.draining = True
+        assert client.get("/readyz").json()["status"] == "draining"
+        assert client.get("/livez").status_code == 200
+    assert main.app.state.maintenance_lock is None
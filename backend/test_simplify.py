@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+
+from simplify import MAX_RESAMPLED_POINTS, polyline_error, rdp_mask, simplify_stroke
+
+
+def test_rdp_drops_collinear_points_and_keeps_corners():
+    points = np.array([[x, 0.0] for x in range(10)] + [[9.0, y] for y in range(1, 10)])
+    kept = points[rdp_mask(points, tolerance=0.5)]
+
+    assert kept.tolist() == [[0, 0], [9, 0], [9, 9]]
+
+
+def test_simplified_stroke_stays_within_tolerance():
+    t = np.linspace(0, 2 * np.pi, 400)
+    raw = [{"x": float(x), "y": float(y), "pressure": 0.5, "timestamp": i}
+           for i, (x, y) in enumerate(zip(200 + 150 * np.cos(t), 200 + 150 * np.sin(t)))]
+    stroke = simplify_stroke({"id": "s1", "color": "#000", "points": raw}, tolerance=1.0)
+
+    assert stroke["id"] == "s1" and stroke["color"] == "#000"
+    assert len(stroke["points"]) < len(raw) / 4
+    assert {"pressure", "timestamp"} <= set(stroke["points"][0])
+
+    simplified = np.array([(p["x"], p["y"]) for p in stroke["points"]])
+    error = polyline_error(np.array([(p["x"], p["y"]) for p in raw]), simplified)
+    assert error.max() <= 1.5
+
+
+def test_huge_stroke_is_not_densified():
+    raw = [{"x": 0.0, "y": 0.0, "pressure": 0.2}, {"x": 2.5e6, "y": 0.5, "pressure": 0.4},
+           {"x": 5e6, "y": 0.0, "pressure": 0.6}]
+    started = time.perf_counter()
+    stroke = simplify_stroke({"points": raw}, tolerance=0.75)
+    assert time.perf_counter() - started < 0.5
+    # 沒有指定間距時只簡化原始點，不插入新點
+    assert stroke["points"] == [{"x": 0.0, "y": 0.0, "pressure": 0.2}, {"x": 5e6, "y": 0.0, "pressure": 0.6}]
+
+    resampled = simplify_stroke({"points": raw + [{"x": 0.0, "y": 9.0, "pressure": 0.1}]},
+                                tolerance=0.0001, spacing=1.0)
+    assert len(resampled["points"]) <= MAX_RESAMPLED_POINTS
+
+
+def test_drawing_ingest_simplifies_and_optionally_keeps_raw(client):
+    raw = [{"x": float(x), "y": 50.0} for x in range(0, 300, 2)]
+    drawing_id = client.post("/api/drawings", json={
+        "id": "local", "keep_raw": True, "strokes": [{"id": "s1", "points": raw}]
+    }).json()["id"]
+
+    client.patch(f"/api/drawings/{drawing_id}", json={
+        "base_revision": 0, "keep_raw": True, "strokes": [{"id": "s2", "points": raw}], "undo": ["s1"]
+    })
+
+    data = client.get(f"/api/drawings/{drawing_id}").json()["drawing_data"]
+    assert [len(s["points"]) for s in data["strokes"]] == [2]
+    assert [(s["id"], len(s["points"])) for s in data["raw_strokes"]] == [("s2", len(raw))]
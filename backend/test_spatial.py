@@ -0,0 +1,83 @@
+import json
+import sqlite3
+
+import numpy as np
+
+import drawing_store
+import spatial
+from spatial import StrokeIndex
+
+
+def random_strokes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(0, 5000, (count, 2))
+    ends = starts + rng.normal(0, 30, (count, 2))
+    ends[:5] = starts[:5] + 3000  # 幾筆橫跨大半畫布的筆劃
+    return [
+        {"id": f"s{i}", "size": 2, "points": [{"x": a[0], "y": a[1]}, {"x": b[0], "y": b[1]}]}
+        for i, (a, b) in enumerate(zip(starts, ends))
+    ]
+
+
+def brute_force(index, bbox, mode):
+    x0, y0, x1, y1 = bbox
+    b = index.bounds
+    with np.errstate(invalid="ignore"):
+        if mode == "contains":
+            hits = (b[:, 0] >= x0) & (b[:, 1] >= y0) & (b[:, 2] <= x1) & (b[:, 3] <= y1)
+        else:
+            hits = (b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)
+    return np.flatnonzero(hits).tolist()
+
+
+def test_grid_query_matches_linear_scan():
+    index = StrokeIndex.build(random_strokes(5000) + [{"id": "empty", "points": []}], revision=0)
+
+    for bbox in [(100, 100, 400, 300), (-50, -50, 20, 20), (2500, 0, 2600, 5000), (6000, 6000, 7000, 7000)]:
+        for mode in spatial.QUERY_MODES:
+            assert index.query(bbox, mode).tolist() == brute_force(index, bbox, mode)
+
+
+def test_deltas_update_index_and_persist(db_path):
+    conn = sqlite3.connect(db_path)
+    strokes = random_strokes(50)
+    conn.execute(
+        "INSERT INTO drawings (id, title, drawing_data, created_at, updated_at) VALUES ('d', 'd', ?, 0, 0)",
+        (json.dumps({"strokes": strokes[:40]}),),
+    )
+    conn.commit()
+
+    assert spatial.current_index(conn, "d").revision == 0
+    drawing_store.append_delta(conn, "d", 0, strokes=strokes[40:], undo=["s0", "s1"])
+
+    index = spatial.current_index(conn, "d")
+    assert index.revision == 1
+    assert index.stroke_ids == [s["id"] for s in strokes[2:]]
+
+    spatial.clear_cache()
+    assert spatial.load_index(conn, "d").stroke_ids == index.stroke_ids
+    conn.close()
+
+
+def test_region_query_endpoint(client):
+    strokes = [
+        {"id": "a", "size": 2, "points": [{"x": 10, "y": 10}, {"x": 50, "y": 50}]},
+        {"id": "b", "size": 2, "points": [{"x": 300, "y": 300}, {"x": 320, "y": 310}]},
+        {"id": "c", "size": 2, "points": [{"x": 40, "y": 10}, {"x": 200, "y": 10}]},
+    ]
+    drawing_id = client.post("/api/drawings", json={"id": "local", "strokes": strokes}).json()["id"]
+    url = f"/api/drawings/{drawing_id}/strokes/query"
+
+    box = {"x": 0, "y": 0, "width": 100, "height": 100}
+    assert client.post(url, json={"bbox": box}).json()["stroke_ids"] == ["a", "c"]
+    assert client.post(url, json={"bbox": box, "mode": "contains"}).json()["stroke_ids"] == ["a"]
+
+    lasso = [{"x": 0, "y": 0}, {"x": 60, "y": 0}, {"x": 60, "y": 60}, {"x": 0, "y": 60}]
+    assert client.post(url, json={"lasso": lasso, "mode": "contains"}).json()["stroke_ids"] == ["a"]
+
+    client.patch(f"/api/drawings/{drawing_id}", json={"base_revision": 0, "undo": ["a"]})
+    response = client.post(url, json={"bbox": box}).json()
+    assert (response["revision"], response["stroke_ids"]) == (1, ["c"])
+
+    assert client.post(url, json={"bbox": box, "mode": "nearest"}).status_code == 400
+    assert client.post("/api/drawings/missing/strokes/query", json={"bbox": box}).status_code == 404
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from starlette.testclient import TestClient
+
+import lazy
+import main
+
+
+def test_importing_main_defers_ai_sdks_and_pil():
+    code = "import sys, main; print(sorted(m for m in ('openai', 'google.generativeai', 'PIL.Image') if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_lazy_module_imports_on_first_attribute_access():
+    module = lazy.LazyModule("colorsys")
+    assert not module.loaded
+    assert module.rgb_to_hsv(1, 0, 0) == (0.0, 1.0, 1)
+    assert module.loaded and "colorsys" in lazy.load_times
+
+
+def test_lifespan_starts_and_stops_background_tasks(db_path):
+    with TestClient(main.app) as client:
+        assert not main.app.state.counter_flush_task.done()
+        assert client.get("/api/health").status_code == 200
+    assert main.app.state.counter_flush_task.cancelled()
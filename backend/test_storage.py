@@ -0,0 +1,128 @@
+"""資料存取層一致性測試：SQLite 與 PostgreSQL 實作須有相同行為
+
+PostgreSQL 部分需設定 STORAGE_TEST_POSTGRES_DSN（例如 postgresql://postgres@localhost/uicorework_test）
+並安裝 asyncpg；測試會清空該資料庫的資料表。
+"""
+
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+
+import pytest
+
+import init_db
+import storage
+
+POSTGRES_DSN = os.getenv("STORAGE_TEST_POSTGRES_DSN")
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def open_storage(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        path = tmp_path / "storage.db"
+        monkeypatch.setattr(init_db, "DATABASE_PATH", path)
+        init_db.create_database()
+
+        @asynccontextmanager
+        async def opener():
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield storage.SQLiteStorage(conn)
+            finally:
+                conn.close()
+
+        return opener
+
+    if not POSTGRES_DSN:
+        pytest.skip("STORAGE_TEST_POSTGRES_DSN is not set")
+    pytest.importorskip("asyncpg")
+    from storage_postgres import PostgresStorage
+
+    @asynccontextmanager
+    async def opener():
+        store = await PostgresStorage.connect(POSTGRES_DSN)
+        await store.pool.execute("TRUNCATE conversations, chat_messages, drawings, examples, statistics")
+        try:
+            yield store
+        finally:
+            await store.close()
+
+    return opener
+
+
+def run(open_storage, scenario):
+    async def main():
+        async with open_storage() as store:
+            await scenario(store)
+
+    asyncio.run(main())
+
+
+def message(message_id, timestamp, sender="user"):
+    return {"id": message_id, "sender": sender, "message": f"內容 {message_id}", "timestamp": timestamp}
+
+
+def test_chat_conversations_and_keyset_pages(open_storage):
+    async def scenario(store):
+        await store.chat.append_messages("c1", "第一個", [message(f"m{i}", 100 + i // 3) for i in range(7)], 102)
+        await store.chat.append_messages("c2", "第二個", [message("x", 50)], 50)
+        await store.chat.append_messages("c2", "第二個（更新）", [message("y", 200, "assistant")], 200)
+
+        conversations = await store.chat.list_conversations(10)
+        assert [(c["id"], c["title"]) for c in conversations] == [("c2", "第二個（更新）"), ("c1", "第一個")]
+        assert conversations[0]["created_at"] == 50 and conversations[0]["updated_at"] == 200
+        assert await store.chat.conversation_exists("c1")
+        assert not await store.chat.conversation_exists("missing")
+
+        latest = await store.chat.get_messages("c1", 3)
+        assert [m["id"] for m in latest] == ["m4", "m5", "m6"]
+        older = await store.chat.get_messages("c1", 3, before=(latest[0]["timestamp"], latest[0]["id"]))
+        assert [m["id"] for m in older] == ["m1", "m2", "m3"]
+        newer = await store.chat.get_messages("c1", 2, after=(101, "m3"))
+        assert [m["id"] for m in newer] == ["m4", "m5"]
+        first = await store.chat.get_messages("c1", 2, oldest_first=True)
+        assert first[0] == {"id": "m0", "sender": "user", "content": "內容 m0", "type": "text", "timestamp": 100}
+
+    run(open_storage, scenario)
+
+
+def test_drawings_project_columns_and_list_newest_first(open_storage):
+    async def scenario(store):
+        for index in range(3):
+            await store.drawings.create({
+                "id": f"d{index}", "title": f"圖 {index}", "drawing_data": '{"strokes": []}',
+                "created_at": index, "updated_at": 10 - index, "metadata": "{}", "stroke_count": index,
+            })
+
+        assert await store.drawings.get("d1", ["id", "stroke_count", "revision"]) == {
+            "id": "d1", "stroke_count": 1, "revision": 0
+        }
+        assert await store.drawings.get("missing") is None
+        listed = await store.drawings.list(["id", "title"], limit=2, offset=1)
+        assert listed == [{"id": "d1", "title": "圖 1"}, {"id": "d2", "title": "圖 2"}]
+        with pytest.raises(ValueError):
+            await store.drawings.list(["id; DROP TABLE drawings"], limit=1)
+
+    run(open_storage, scenario)
+
+
+def test_examples_and_statistics(open_storage):
+    async def scenario(store):
+        await store.examples.create({
+            "id": "e1", "title": "登入表單", "category": "forms", "tags": '["login"]',
+            "files": "[]", "file_count": 0, "popularity_score": 1.5, "created_at": 10, "author": "User",
+        })
+        assert await store.examples.get("e1", ["id", "title", "likes", "popularity_score"]) == {
+            "id": "e1", "title": "登入表單", "likes": 0, "popularity_score": 1.5
+        }
+        assert await store.examples.get("missing", ["id"]) is None
+
+        await store.statistics.record("s1", "page_view", {"page": "/"}, 100)
+        await store.statistics.record("s2", "page_view", {"page": "/draw"}, 200)
+        await store.statistics.record("s3", "drawing_saved", {}, 200)
+        assert await store.statistics.count("page_view") == 2
+        assert await store.statistics.count("page_view", since=150) == 1
+
+    run(open_storage, scenario)
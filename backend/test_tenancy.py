@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+import main
+import tenancy
+
+DRAWING = {
+    "id": "local",
+    "canvas": {"width": 400, "height": 200},
+    "strokes": [{"id": "s1", "points": [{"x": 10, "y": 10}, {"x": 300, "y": 150}]}],
+}
+
+
+def test_tenants_get_isolated_shards_and_share_the_catalog(client, db_path):
+    school_a = {"X-Tenant-ID": "school-a"}
+    school_b = {"X-Tenant-ID": "school-b"}
+
+    chat = client.post("/api/chat", json={"message": "你好"}, headers=school_a).json()
+    drawing_id = client.post("/api/drawings", json=DRAWING, headers=school_a).json()["id"]
+
+    shard = sqlite3.connect(db_path.parent / "tenants" / "school-a" / "uicorework.db")
+    # 分片由 init_database 建立，與目錄資料庫一樣可線上回收空頁
+    assert shard.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert shard.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    shard.close()
+    assert [c["id"] for c in client.get("/api/chat/conversations", headers=school_a).json()["conversations"]] == [
+        chat["conversation_id"]
+    ]
+    assert client.get("/api/chat/conversations", headers=school_b).json()["conversations"] == []
+    assert client.get(f"/api/drawings/{drawing_id}", headers=school_b).status_code == 404
+    assert client.get(f"/api/drawings/{drawing_id}").status_code == 404
+
+    # 縮圖放在租戶的子目錄
+    assert client.get(f"/api/drawings/{drawing_id}/thumbnail?size=small", headers=school_a).status_code == 200
+    assert list((main.THUMBNAIL_DIR / "school-a").glob(f"{drawing_id}-r*.png"))
+
+    # 範例來自共用目錄資料庫
+    catalog = client.get("/api/examples").json()["examples"]
+    assert catalog and client.get("/api/examples", headers=school_b).json()["examples"] == catalog
+    assert tenancy.list_tenants(db_path) == ["school-a", "school-b"]
+
+
+def test_invalid_tenant_is_rejected(client):
+    assert client.get("/api/chat/conversations", headers={"X-Tenant-ID": "../etc"}).status_code == 400
+
+
+def test_maintenance_visits_every_shard(client, db_path, monkeypatch):
+    client.post("/api/chat", json={"message": "三角形的面積"}, headers={"X-Tenant-ID": "school-a"})
+    now = main.get_timestamp()
+    monkeypatch.setattr(main, "get_timestamp", lambda: now + 31 * 86400)
+
+    assert main.for_each_shard(main.archive_idle_conversations) >= 2
+    shard = sqlite3.connect(tenancy.shard_path(db_path, "school-a"))
+    assert shard.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0] == 0
+    shard.close()
+
+
+def test_shard_pool_reuses_connections_and_closes_least_recent_shards(tmp_path):
+    initialized = []
+    pool = tenancy.ShardPool(sqlite3.connect, initialized.append, max_shards=2, max_idle=1)
+    paths = [tmp_path / name / "shard.db" for name in ("a", "b", "c")]
+
+    first = pool.acquire(paths[0])
+    pool.release(paths[0], first)
+    assert pool.acquire(paths[0]) is first
+    pool.release(paths[0], first)
+
+    for path in paths[1:]:
+        pool.release(path, pool.acquire(path))
+
+    assert pool.open_shards() == [str(paths[1]), str(paths[2])]
+    assert initialized == paths
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+    pool.close_all()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+UI CoreWork - 背景工作 worker
+在獨立行程執行 database/jobs.db 中的工作（縮圖與空間索引、排行重算等），
+web 行程設定 JOB_WORKERS=0 時由它負責；兩者同時執行也不會重複處理同一個工作。
+
+    python worker.py --workers 4
+    python worker.py --kinds drawing.assets       # 只處理指定種類
+    python worker.py --metrics                    # 顯示佇列狀態後結束
+"""
+
+import argparse
+import json
+import signal
+import sys
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="UI CoreWork 背景工作 worker")
+    parser.add_argument("--workers", type=int, default=2, help="worker 執行緒數")
+    parser.add_argument("--kinds", default="", help="只處理這些工作種類（逗號分隔）")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="沒有工作時的檢查間隔（秒）")
+    parser.add_argument("--metrics", action="store_true", help="顯示佇列狀態後結束")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import jobs
+    import main as backend
+
+    queue = backend.job_queue()
+    if args.metrics:
+        print(json.dumps(queue.metrics(), ensure_ascii=False, indent=2))
+        return
+
+    handlers = backend.job_handlers()
+    if args.kinds:
+        kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+        unknown = [kind for kind in kinds if kind not in handlers]
+        if unknown:
+            raise SystemExit(f"Unknown job kinds: {', '.join(unknown)} (available: {', '.join(handlers)})")
+        handlers = {kind: handlers[kind] for kind in kinds}
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+
+    pool = jobs.WorkerPool(queue, handlers, args.workers, args.poll_interval, name="worker")
+    stopping = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: stopping.set())
+
+    print(f"Processing {', '.join(handlers)} with {args.workers} workers from {queue.path}")
+    pool.start()
+    stopping.wait()
+    print("Stopping: waiting for running jobs")
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()
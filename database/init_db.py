@@ -14,11 +14,18 @@ from datetime import datetime
 # 資料庫路徑
 DATABASE_PATH = Path(__file__).parent / "uicorework.db"
 
+# PRAGMA auto_vacuum 的數值對應
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
 def create_database():
     """創建資料庫和表格"""
     print("Creating UI CoreWork database...")
     
     conn = sqlite3.connect(DATABASE_PATH)
+    # 只對尚未建立任何表格的新資料庫生效；之後可用 vacuum-incremental 線上回收空頁
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # 後端多個 worker 同時讀寫，使用 WAL 讓讀取不被寫入阻擋
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     
     # 聊天訊息表
@@ -48,6 +55,22 @@ def create_database():
         )
     """)
     
+    # 全文搜尋待索引佇列：新訊息由觸發器排入，後端分批寫入 search.db 的 FTS5 索引
+    queue_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'chat_messages_search_queue'"
+    ).fetchone()
+    cursor.execute("CREATE TABLE IF NOT EXISTS chat_search_queue (message_id TEXT PRIMARY KEY)")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_queue
+        AFTER INSERT ON chat_messages
+        BEGIN
+            INSERT OR IGNORE INTO chat_search_queue (message_id) VALUES (new.id);
+        END
+    """)
+    if not queue_exists:
+        # 既有訊息全部排入，由後端補建索引
+        cursor.execute("INSERT OR IGNORE INTO chat_search_queue (message_id) SELECT id FROM chat_messages")
+    
     # 繪圖資料表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS drawings (
@@ -60,7 +83,41 @@ def create_database():
             metadata TEXT DEFAULT '{}',
             tags TEXT DEFAULT '[]',
             is_public BOOLEAN DEFAULT 0,
-            likes_count INTEGER DEFAULT 0
+            likes_count INTEGER DEFAULT 0,
+            stroke_count INTEGER DEFAULT 0,
+            revision INTEGER DEFAULT 0,
+            snapshot_revision INTEGER DEFAULT 0
+        )
+    """)
+    
+    # 繪圖增量紀錄表（自動儲存的筆劃增量，定期壓縮進 drawings.drawing_data）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drawing_deltas (
+            drawing_id TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            ops TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (drawing_id, revision)
+        )
+    """)
+    
+    # 筆劃空間索引表（各繪圖最新版本的筆劃外框，網格於載入時重建）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drawing_stroke_index (
+            drawing_id TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL,
+            stroke_ids TEXT NOT NULL,
+            bounds BLOB NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    
+    # 範例快取的跨 worker 失效紀錄（與 backend/cache.py 的 ensure_invalidation_log 保持一致）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tags TEXT NOT NULL,
+            created_at REAL NOT NULL
         )
     """)
     
@@ -77,6 +134,9 @@ def create_database():
             likes INTEGER DEFAULT 0,
             downloads INTEGER DEFAULT 0,
             views INTEGER DEFAULT 0,
+            file_count INTEGER DEFAULT 0,
+            popularity_score REAL DEFAULT 0,
+            trending_score REAL DEFAULT 0,
             created_at INTEGER NOT NULL,
             updated_at INTEGER DEFAULT NULL,
             author TEXT,
@@ -110,6 +170,9 @@ def create_database():
         )
     """)
     
+    # 舊版資料庫補上新增欄位
+    upgrade_schema(cursor)
+    
     # 創建索引
     create_indexes(cursor)
     
@@ -119,25 +182,89 @@ def create_database():
     print(f"Database created successfully at: {DATABASE_PATH}")
     return True
 
+def upgrade_schema(cursor):
+    """為舊版資料庫補上後續新增的欄位，並回填計數欄位"""
+    added_columns = {
+        "examples": {
+            "views": "INTEGER DEFAULT 0",
+            "file_count": "INTEGER DEFAULT 0",
+            "popularity_score": "REAL DEFAULT 0",
+            "trending_score": "REAL DEFAULT 0",
+        },
+        "conversations": {
+            "is_archived": "BOOLEAN DEFAULT 0",
+        },
+        "drawings": {
+            "stroke_count": "INTEGER DEFAULT 0",
+            "revision": "INTEGER DEFAULT 0",
+            "snapshot_revision": "INTEGER DEFAULT 0",
+        },
+    }
+    backfills = {
+        "file_count": "UPDATE examples SET file_count = COALESCE(json_array_length(files), 0) WHERE json_valid(files)",
+        "stroke_count": "UPDATE drawings SET stroke_count = COALESCE(json_array_length(drawing_data, '$.strokes'), 0) WHERE json_valid(drawing_data)",
+    }
+    
+    for table, columns in added_columns.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, definition in columns.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                if column in backfills:
+                    cursor.execute(backfills[column])
+                print(f"Added column {table}.{column}")
+
+
+# 已被複合索引取代或沒有任何查詢使用的舊索引（backend/main.py 的 OBSOLETE_INDEXES 需相同）
+OBSOLETE_INDEXES = (
+    "idx_chat_messages_conversation_id",
+    "idx_chat_messages_timestamp",
+    "idx_conversations_updated_at",
+    "idx_drawings_created_at",
+    "idx_drawings_public",
+    "idx_drawings_list",
+    "idx_examples_category",
+    "idx_examples_created_at",
+    "idx_examples_featured",
+    "idx_examples_active",
+    # 排序加上 id 作為次序後，以結尾為 id 的索引取代
+    "idx_examples_category_created",
+    "idx_examples_created",
+    "idx_examples_popular",
+    "idx_examples_category_popular",
+    "idx_examples_trending",
+    "idx_examples_category_trending",
+)
+
+
 def create_indexes(cursor):
-    """創建資料庫索引以提升查詢效能"""
+    """創建資料庫索引以提升查詢效能
+
+    索引依照 API 實際的查詢形狀設計（WHERE + ORDER BY 的複合順序），
+    列表查詢盡量使用覆蓋索引，避免讀取 files、thumbnail 等大型欄位。
+    """
+    for index_name in OBSOLETE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
     indexes = [
-        # 聊天訊息索引
-        "CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_id ON chat_messages(conversation_id)",
-        "CREATE INDEX IF NOT EXISTS idx_chat_messages_timestamp ON chat_messages(timestamp)",
+        # 聊天訊息索引：WHERE conversation_id = ? ORDER BY timestamp
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_ts ON chat_messages(conversation_id, timestamp, id)",
         
-        # 會話索引
-        "CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at)",
+        # 會話索引：ORDER BY updated_at DESC 的列表覆蓋索引
+        "CREATE INDEX IF NOT EXISTS idx_conversations_list ON conversations(updated_at DESC, id, title, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_idle ON conversations(is_archived, updated_at)",
         
-        # 繪圖索引
-        "CREATE INDEX IF NOT EXISTS idx_drawings_created_at ON drawings(created_at)",
-        "CREATE INDEX IF NOT EXISTS idx_drawings_public ON drawings(is_public)",
+        # 繪圖索引：ORDER BY updated_at DESC 的列表覆蓋索引
+        "CREATE INDEX IF NOT EXISTS idx_drawings_summary ON drawings(updated_at DESC, id, title, created_at, stroke_count)",
         
-        # 範例索引
-        "CREATE INDEX IF NOT EXISTS idx_examples_category ON examples(category)",
-        "CREATE INDEX IF NOT EXISTS idx_examples_created_at ON examples(created_at)",
-        "CREATE INDEX IF NOT EXISTS idx_examples_featured ON examples(is_featured)",
-        "CREATE INDEX IF NOT EXISTS idx_examples_active ON examples(is_active)",
+        # 範例索引：WHERE category = ? ORDER BY created_at / 排行分數 DESC, id DESC，以及不分類別的列表
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_created_id ON examples(category, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_created_id ON examples(created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_popular_id ON examples(popularity_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_popular_id ON examples(category, popularity_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_trending_id ON examples(trending_score DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_examples_category_trending_id ON examples(category, trending_score DESC, id DESC)",
         
         # 統計索引
         "CREATE INDEX IF NOT EXISTS idx_statistics_event_type ON statistics(event_type)",
@@ -340,8 +467,8 @@ def insert_sample_data():
         cursor.execute("""
             INSERT INTO examples 
             (id, title, description, category, tags, thumbnail, files, likes, downloads, views, 
-             created_at, author, metadata, is_featured, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             file_count, created_at, author, metadata, is_featured, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             example['id'],
             example['title'],
@@ -353,6 +480,7 @@ def insert_sample_data():
             example['likes'],
             example['downloads'],
             example['views'],
+            len(example['files']),
             timestamp,
             example['author'],
             json.dumps({}),
@@ -399,79 +527,271 @@ def reset_database():
     create_database()
     insert_sample_data()
 
-def backup_database(backup_path=None):
-    """備份資料庫"""
+def default_output_path(prefix):
+    """資料庫同目錄下帶時間戳的輸出檔名"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return DATABASE_PATH.parent / f"{prefix}_uicorework_{timestamp}.db"
+
+class BackupRestarted(Exception):
+    """分段備份重新開始的次數超過上限"""
+
+def backup_database(backup_path=None, pages=256, pause=0.005, quiet=False, max_restarts=3):
+    """線上備份資料庫（SQLite backup API）
+    
+    每次複製 pages 頁後暫停 pause 秒，讓伺服器的寫入有機會取得鎖；
+    WAL 中尚未寫回主檔的內容也會一併備份。備份期間若有其他連線寫入，SQLite 會從頭重新複製；
+    重新開始超過 max_restarts 次時改為單一步驟（pages=-1）複製剩下的整個資料庫，
+    在同一個讀取交易中完成，不會再被寫入打斷。
+    """
     if not DATABASE_PATH.exists():
         print("Database not found, nothing to backup")
         return False
     
-    if backup_path is None:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = DATABASE_PATH.parent / f"backup_uicorework_{timestamp}.db"
-    
+    backup_path = Path(backup_path) if backup_path else default_output_path("backup")
+    restarts = 0
+    last_remaining = None
+    
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                # 從回呼拋出例外會中止這次備份
+                raise BackupRestarted()
+        last_remaining = remaining
+        if not quiet:
+            done = total - remaining
+            print(f"\r  Backup progress: {done}/{total} pages ({done * 100 // max(total, 1)}%)", end="", flush=True)
+        if pause and remaining:
+            time.sleep(pause)
+    
+    source = sqlite3.connect(DATABASE_PATH, timeout=30)
+    target = sqlite3.connect(backup_path)
     try:
-        import shutil
-        shutil.copy2(DATABASE_PATH, backup_path)
-        print(f"Database backed up to: {backup_path}")
+        started = time.perf_counter()
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            if not quiet:
+                print()
+            print(f"Backup restarted {restarts} times by concurrent writes; copying in a single step")
+            source.backup(target, pages=-1)
+        if not quiet:
+            print()
+        print(f"Database backed up to: {backup_path} ({time.perf_counter() - started:.2f}s, {restarts} restarts)")
         return True
-    except Exception as e:
+    except sqlite3.Error as e:
         print(f"Backup failed: {e}")
+        target.close()
+        Path(backup_path).unlink(missing_ok=True)
+        return False
+    finally:
+        target.close()
+        source.close()
+
+def compact_database(output_path=None):
+    """以 VACUUM INTO 輸出重整後的資料庫副本（單一讀取交易，內容一致且不含空頁）
+    
+    伺服器可照常運作；要以副本取代正式資料庫時須先停止伺服器再替換檔案。
+    """
+    if not DATABASE_PATH.exists():
+        print("Database not found, nothing to compact")
         return False
+    
+    output_path = Path(output_path) if output_path else default_output_path("compact")
+    if output_path.exists():
+        print(f"Output already exists: {output_path}")
+        return False
+    
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        started = time.perf_counter()
+        conn.execute("VACUUM INTO ?", (str(output_path),))
+    except sqlite3.Error as e:
+        print(f"Compaction failed: {e}")
+        return False
+    finally:
+        conn.close()
+    
+    before = DATABASE_PATH.stat().st_size
+    after = output_path.stat().st_size
+    print(f"Compacted copy written to: {output_path}")
+    print(f"  {before} -> {after} bytes ({time.perf_counter() - started:.2f}s)")
+    return True
+
+def incremental_vacuum(pages=None):
+    """回收空頁（需 auto_vacuum=INCREMENTAL）；pages 為 None 時回收全部，回傳回收的頁數"""
+    if not DATABASE_PATH.exists():
+        print("Database not found")
+        return 0
+    
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if auto_vacuum != 2:
+            print("auto_vacuum is not INCREMENTAL; run 'python init_db.py enable-incremental-vacuum' "
+                  "while the server is stopped")
+            return 0
+        
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # 每執行一步只回收一頁；executescript 會一直執行到完成
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)});")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    
+    print(f"Incremental vacuum released {before - after} pages ({after} free pages left)")
+    return before - after
+
+def enable_incremental_vacuum():
+    """將既有資料庫切換為 auto_vacuum=INCREMENTAL（需完整 VACUUM，請在伺服器停止時執行）"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"auto_vacuum mode: {AUTO_VACUUM_MODES.get(mode, mode)}")
+
+def analyze_database(limit=None):
+    """更新查詢規劃器統計（sqlite_stat1）；limit 為每個索引抽樣的列數上限"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        started = time.perf_counter()
+        if limit:
+            conn.execute(f"PRAGMA analysis_limit={int(limit)}")
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"ANALYZE completed in {time.perf_counter() - started:.2f}s")
+
+def database_stats(conn):
+    """不掃描表格的資料庫統計：頁面資訊、各表/索引大小（dbstat）與估計列數（sqlite_stat1）"""
+    pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+    stats = {
+        "page_size": pragma("page_size"),
+        "page_count": pragma("page_count"),
+        "freelist_count": pragma("freelist_count"),
+        "journal_mode": pragma("journal_mode"),
+        "auto_vacuum": AUTO_VACUUM_MODES.get(pragma("auto_vacuum")),
+        "objects": {},
+    }
+    
+    objects = stats["objects"]
+    for name, kind, table in conn.execute(
+        "SELECT name, type, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"
+    ):
+        objects[name] = {"type": kind, "table": table, "bytes": None, "rows": None}
+    
+    # dbstat 需要 SQLITE_ENABLE_DBSTAT_VTAB；aggregate 模式每個物件只回傳一列
+    try:
+        for name, size in conn.execute("SELECT name, pgsize FROM dbstat WHERE aggregate = TRUE"):
+            if name in objects:
+                objects[name]["bytes"] = size
+    except sqlite3.OperationalError:
+        pass
+    
+    # sqlite_stat1 的 stat 第一個數字為（ANALYZE 當時的）列數
+    has_stat1 = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stat1:
+        for table, index, stat in conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"):
+            rows = int(stat.split()[0])
+            objects.setdefault(table, {"type": "table", "table": table, "bytes": None, "rows": None})
+            objects[table]["rows"] = rows
+            if index in objects:
+                objects[index]["rows"] = rows
+    return stats
 
 def show_database_info():
-    """顯示資料庫資訊"""
+    """顯示資料庫資訊（不掃描表格，列數為最近一次 ANALYZE 的估計值）"""
     if not DATABASE_PATH.exists():
         print("Database not found")
         return
     
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        stats = database_stats(conn)
+    finally:
+        conn.close()
     
+    wal_path = DATABASE_PATH.with_name(DATABASE_PATH.name + "-wal")
     print("\n=== Database Information ===")
     print(f"Database path: {DATABASE_PATH}")
-    print(f"Database size: {DATABASE_PATH.stat().st_size} bytes")
-    
-    # 取得表格列表
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = cursor.fetchall()
+    print(f"Database size: {DATABASE_PATH.stat().st_size} bytes"
+          + (f" (+{wal_path.stat().st_size} bytes WAL)" if wal_path.exists() else ""))
+    print(f"Pages: {stats['page_count']} x {stats['page_size']} bytes, {stats['freelist_count']} free")
+    print(f"Journal mode: {stats['journal_mode']}, auto_vacuum: {stats['auto_vacuum']}")
     
+    tables = {name: info for name, info in stats["objects"].items() if info["type"] == "table"}
     print(f"\nTables ({len(tables)}):")
-    for table in tables:
-        table_name = table[0]
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        count = cursor.fetchone()[0]
-        print(f"  - {table_name}: {count} records")
-    
-    conn.close()
+    for name, info in sorted(tables.items()):
+        rows = f"~{info['rows']} records" if info["rows"] is not None else "not analyzed"
+        size = f", {info['bytes']} bytes" if info["bytes"] is not None else ""
+        indexes = sum(
+            other["bytes"] or 0 for other in stats["objects"].values()
+            if other["type"] == "index" and other["table"] == name
+        )
+        print(f"  - {name}: {rows}{size}" + (f" (+{indexes} bytes indexes)" if indexes else ""))
 
 def main():
     """主程式"""
-    import sys
-    
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python init_db.py create    - Create database and tables")
-        print("  python init_db.py reset     - Reset database (delete and recreate)")
-        print("  python init_db.py sample    - Insert sample data")
-        print("  python init_db.py backup    - Backup database")
-        print("  python init_db.py info      - Show database information")
-        return
-    
-    command = sys.argv[1].lower()
-    
-    if command == "create":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="UI CoreWork database tool")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("create", help="Create database and tables")
+    commands.add_parser("reset", help="Reset database (delete and recreate)")
+    commands.add_parser("sample", help="Insert sample data")
+    
+    backup = commands.add_parser("backup", help="Online backup through the SQLite backup API")
+    backup.add_argument("path", nargs="?", help="Backup file (default: backup_uicorework_<time>.db)")
+    backup.add_argument("--pages", type=int, default=256, help="Pages copied per step")
+    backup.add_argument("--pause", type=float, default=0.005, help="Seconds to wait between steps")
+    backup.add_argument("--quiet", action="store_true", help="Do not print progress")
+    backup.add_argument("--max-restarts", type=int, default=3,
+                        help="Restarts caused by concurrent writes before copying in a single step")
+    
+    compact = commands.add_parser("compact", help="Write a compacted copy with VACUUM INTO")
+    compact.add_argument("path", nargs="?", help="Output file (default: compact_uicorework_<time>.db)")
+    
+    vacuum = commands.add_parser("vacuum-incremental", help="Release free pages (auto_vacuum=INCREMENTAL)")
+    vacuum.add_argument("--pages", type=int, help="Maximum pages to release (default: all)")
+    commands.add_parser(
+        "enable-incremental-vacuum", help="Switch an existing database to incremental vacuum (offline)"
+    )
+    
+    analyze = commands.add_parser("analyze", help="Refresh query planner statistics")
+    analyze.add_argument("--limit", type=int, help="Rows sampled per index (PRAGMA analysis_limit)")
+    commands.add_parser("info", help="Show database information")
+    
+    args = parser.parse_args()
+    
+    if args.command == "create":
         create_database()
         insert_sample_data()
-    elif command == "reset":
+    elif args.command == "reset":
         reset_database()
-    elif command == "sample":
+    elif args.command == "sample":
         insert_sample_data()
-    elif command == "backup":
-        backup_database()
-    elif command == "info":
+    elif args.command == "backup":
+        backup_database(args.path, pages=args.pages, pause=args.pause, quiet=args.quiet,
+                        max_restarts=args.max_restarts)
+    elif args.command == "compact":
+        compact_database(args.path)
+    elif args.command == "vacuum-incremental":
+        incremental_vacuum(args.pages)
+    elif args.command == "enable-incremental-vacuum":
+        enable_incremental_vacuum()
+    elif args.command == "analyze":
+        analyze_database(args.limit)
+    elif args.command == "info":
         show_database_info()
     else:
-        print(f"Unknown command: {command}")
+        parser.print_help()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -50,6 +50,16 @@ class APIModule {
             return config;
         });
         
+        // 請求攔截器 - 添加租戶標頭（後端依此選擇資料庫分片）
+        this.addRequestInterceptor((config) => {
+            const tenantId = this.options.tenantId || window.UICoreworkConfig?.api?.tenantId;
+            if (tenantId) {
+                config.headers = config.headers || {};
+                config.headers['X-Tenant-ID'] = tenantId;
+            }
+            return config;
+        });
+        
         // 請求攔截器 - 添加時間戳
         this.addRequestInterceptor((config) => {
             config.headers = config.headers || {};
@@ -372,6 +382,39 @@ class APIModule {
         return response.data;
     }
 
+    /**
+     * 取得會話訊息視窗（預設最新 limit 則；before / after 為上一頁回傳的 next_before / next_after）
+     */
+    async getConversationMessages(conversationId, { before = null, after = null, limit = 50 } = {}) {
+        const response = await this.get(`/chat/conversations/${conversationId}/messages`, { before, after, limit });
+        
+        if (!response.ok) {
+            throw new Error(`Chat history API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 搜尋聊天記錄（依會話分組，片段以 <mark> 標示命中處）
+     */
+    async searchChat(query, { limit = 10, perConversation = 3 } = {}) {
+        const response = await this.get('/chat/search', { q: query, limit, per_conversation: perConversation });
+        
+        if (!response.ok) {
+            throw new Error(`Chat search API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 會話 NDJSON 匯出網址（供下載連結使用）
+     */
+    getConversationExportURL(conversationId) {
+        return this.buildURL(`/chat/conversations/${conversationId}/export`);
+    }
+
     /**
      * 取得範例列表
      */
@@ -445,6 +488,31 @@ class APIModule {
         return response.data;
     }
 
+    /**
+     * 自動儲存繪圖增量（只送出自 baseRevision 以來新增的筆劃與復原標記）
+     */
+    async patchDrawing(id, baseRevision, { strokes = [], undo = [], canvas = null } = {}) {
+        const payload = {
+            base_revision: baseRevision,
+            strokes,
+            undo
+        };
+        if (canvas) {
+            payload.canvas = canvas;
+        }
+        
+        const response = await this.patch(`/drawings/${id}`, payload);
+        
+        if (!response.ok) {
+            const error = new Error(`Patch drawing API error: ${response.status} ${response.statusText}`);
+            error.status = response.status;
+            error.revision = response.data?.revision;
+            throw error;
+        }
+        
+        return response.data;
+    }
+
     /**
      * AI 圖像分析
      */
@@ -464,6 +532,114 @@ class APIModule {
         return response.data;
     }
 
+    /**
+     * 數學公式辨識：以已儲存繪圖的區域取代上傳圖片
+     * region 為 { bbox: {x, y, width, height} } 或 { lasso: [{x, y}, ...] }（畫布座標）
+     */
+    async analyzeMathRegion(drawingId, region) {
+        const payload = {
+            drawing_id: drawingId,
+            ...region
+        };
+        
+        const response = await this.post('/analyze-math', payload);
+        
+        if (!response.ok) {
+            throw new Error(`Math analysis API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 批次數學公式辨識：items 為 { image_data } 或 { bbox } / { lasso }（搭配 drawingId）
+     * 回傳每個項目的 latex 與 confidence，個別項目可能失敗（results[i].success）
+     */
+    async analyzeMathBatch(items, drawingId = null) {
+        const payload = { items };
+        if (drawingId) {
+            payload.drawing_id = drawingId;
+        }
+        
+        const response = await this.post('/analyze-math/batch', payload);
+        
+        if (!response.ok) {
+            throw new Error(`Math batch API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 非同步分析：立即取得工作 ID，結果以 getJob 查詢或 watchJob 接收
+     * kind 為 'analyze-image' 或 'analyze-math'；重送時帶相同的 idempotencyKey 不會重複呼叫模型
+     */
+    async submitAnalysisJob(kind, payload, idempotencyKey = null) {
+        const headers = { 'Content-Type': 'application/json' };
+        if (idempotencyKey) {
+            headers['Idempotency-Key'] = idempotencyKey;
+        }
+        
+        const response = await this.post(`/${kind}?mode=async`, payload, { headers });
+        
+        if (!response.ok) {
+            throw new Error(`Analysis job API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 查詢分析工作狀態（完成後含 result）
+     */
+    async getJob(jobId) {
+        // 輪詢時狀態會改變，加上時間參數避開 GET 快取
+        const response = await this.get(`/jobs/${encodeURIComponent(jobId)}`, { _: Date.now() });
+        
+        if (!response.ok) {
+            throw new Error(`Job API error: ${response.status} ${response.statusText}`);
+        }
+        
+        return response.data;
+    }
+
+    /**
+     * 以 Server-Sent Events 接收工作狀態，完成時呼叫 onDone(job)；回傳關閉函式
+     */
+    watchJob(jobId, { onStatus = () => {}, onDone = () => {}, onError = () => {} } = {}) {
+        const source = new EventSource(this.buildURL(`/jobs/${encodeURIComponent(jobId)}/events`));
+        source.addEventListener('status', (event) => onStatus(JSON.parse(event.data)));
+        source.addEventListener('done', (event) => {
+            source.close();
+            onDone(JSON.parse(event.data));
+        });
+        source.addEventListener('expired', () => {
+            source.close();
+            onError(new Error('Job expired'));
+        });
+        source.onerror = (error) => {
+            source.close();
+            onError(error);
+        };
+        return () => source.close();
+    }
+
+    /**
+     * 開啟 WebSocket 即時通道（聊天、繪圖增量與分析進度共用一條連線）
+     */
+    connectRealtime(options = {}) {
+        const tenantId = this.options.tenantId || window.UICoreworkConfig?.api?.tenantId;
+        const url = new URL(this.options.baseURL.replace(/\/?api\/?$/, '') + '/ws', window.location.href);
+        url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+        if (tenantId) {
+            url.searchParams.set('tenant', tenantId);
+        }
+        
+        const channel = new RealtimeChannel(url.toString(), options);
+        channel.connect();
+        return channel;
+    }
+
     /**
      * 設定認證 Token
      */
@@ -662,8 +838,226 @@ class APIModule {
     }
 }
 
+// WebSocket 即時通道：訊框為 [kind, ref, payload]，回覆與推送帶請求的 ref（格式見 backend/realtime.py）
+class RealtimeChannel {
+    constructor(url, options = {}) {
+        this.url = url;
+        this.options = {
+            heartbeatInterval: 20000,   // 與伺服器的 WS_HEARTBEAT_INTERVAL 相同
+            maxBufferedBytes: 256 * 1024, // 瀏覽器送出緩衝超過此值時先留在本地佇列
+            maxQueued: 200,             // 本地佇列上限，超過時直接拒絕新請求
+            reconnectDelay: 1000,
+            maxReconnectDelay: 30000,
+            ...options
+        };
+        
+        this.ws = null;
+        this.nextRef = 1;
+        this.pending = new Map();       // ref -> { resolve, reject, onPush }
+        this.outbox = [];               // 尚未送出的訊框（斷線中或送出緩衝已滿）
+        this.subscriptions = new Map(); // drawingId -> { onDelta, onResync }
+        this.lastSeen = 0;
+        this.reconnectAttempts = 0;
+        this.closed = false;
+    }
+
+    connect() {
+        this.ws = new WebSocket(this.url);
+        
+        this.ws.onopen = () => {
+            this.reconnectAttempts = 0;
+            this.lastSeen = Date.now();
+            this.startHeartbeatCheck();
+            Utils.events.emit('realtime:open');
+            
+            // 重新訂閱；斷線期間錯過的增量由 onResync 以 REST 補齊
+            this.subscriptions.forEach((subscription, drawingId) => {
+                this.request('sub', { drawing_id: drawingId })
+                    .then((state) => subscription.onResync(state))
+                    .catch((error) => Utils.log.warn('Realtime resubscribe failed:', error));
+            });
+            this.flush();
+        };
+        
+        this.ws.onmessage = (event) => {
+            this.lastSeen = Date.now();
+            this.handleFrame(JSON.parse(event.data));
+            this.flush();
+        };
+        
+        this.ws.onclose = (event) => {
+            clearInterval(this.heartbeatTimer);
+            clearTimeout(this.flushTimer);
+            
+            // 伺服器端的請求狀態隨連線消失，未完成的請求一律失敗
+            this.pending.forEach(({ reject }) => reject(new Error('Realtime connection closed')));
+            this.pending.clear();
+            Utils.events.emit('realtime:close', { code: event.code });
+            
+            if (!this.closed && event.code !== 1008) {
+                const delay = Math.min(
+                    this.options.reconnectDelay * 2 ** this.reconnectAttempts++,
+                    this.options.maxReconnectDelay
+                );
+                this.reconnectTimer = setTimeout(() => this.connect(), delay);
+            }
+        };
+        
+        this.ws.onerror = (error) => {
+            Utils.log.error('Realtime connection error:', error);
+        };
+    }
+
+    handleFrame([kind, ref, payload]) {
+        if (kind === 'ping') {
+            this.sendFrame(['pong', 0, {}]);
+            return;
+        }
+        if (kind === 'delta') {
+            this.subscriptions.get(payload.drawing_id)?.onDelta(payload);
+            return;
+        }
+        if (kind === 'resync') {
+            // 送出佇列已滿時伺服器丟棄了部分增量
+            payload.topics.forEach((topic) => {
+                const drawingId = topic.split(':').slice(2).join(':');
+                const subscription = this.subscriptions.get(drawingId);
+                if (subscription) {
+                    this.request('sub', { drawing_id: drawingId }).then((state) => subscription.onResync(state));
+                }
+            });
+            return;
+        }
+        
+        const entry = this.pending.get(ref);
+        if (!entry) {
+            return;
+        }
+        if (kind === 'ok') {
+            entry.resolve(payload);
+            if (!entry.onPush) {
+                this.pending.delete(ref);
+            }
+        } else if (kind === 'error') {
+            const error = new Error(typeof payload.detail === 'string' ? payload.detail : `Realtime error ${payload.status}`);
+            error.status = payload.status;
+            error.data = payload;
+            entry.reject(error);
+            this.pending.delete(ref);
+        } else {
+            entry.onPush(kind, payload, () => this.pending.delete(ref));
+        }
+    }
+
+    /**
+     * 送出請求並等待回覆；onPush(kind, payload, done) 接收之後以相同 ref 推送的訊框
+     */
+    request(kind, payload = {}, onPush = null) {
+        if (this.outbox.length >= this.options.maxQueued) {
+            return Promise.reject(new Error('Realtime send queue is full'));
+        }
+        
+        const ref = this.nextRef++;
+        const promise = new Promise((resolve, reject) => {
+            this.pending.set(ref, { resolve, reject, onPush });
+            this.sendFrame([kind, ref, payload]);
+        });
+        promise.ref = ref;
+        return promise;
+    }
+
+    sendFrame(frame) {
+        this.outbox.push(JSON.stringify(frame));
+        this.flush();
+    }
+
+    flush() {
+        clearTimeout(this.flushTimer);
+        if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        while (this.outbox.length && this.ws.bufferedAmount < this.options.maxBufferedBytes) {
+            this.ws.send(this.outbox.shift());
+        }
+        if (this.outbox.length) {
+            // 送出緩衝已滿，等網路消化後再送
+            this.flushTimer = setTimeout(() => this.flush(), 50);
+        }
+    }
+
+    startHeartbeatCheck() {
+        clearInterval(this.heartbeatTimer);
+        this.heartbeatTimer = setInterval(() => {
+            // 超過 3 個心跳週期沒有收到任何訊框：視為斷線並重新連線
+            if (Date.now() - this.lastSeen > this.options.heartbeatInterval * 3) {
+                this.ws.close();
+            }
+        }, this.options.heartbeatInterval);
+    }
+
+    chat(message, conversationId = null, context = null) {
+        return this.request('chat', { message, conversation_id: conversationId, context });
+    }
+
+    /**
+     * 訂閱繪圖：其他人的增量交給 onDelta；可能漏接時以 onResync({ revision }) 通知，由呼叫端以 REST 讀取 /deltas
+     */
+    subscribe(drawingId, { onDelta = () => {}, onResync = () => {} } = {}) {
+        this.subscriptions.set(drawingId, { onDelta, onResync });
+        return this.request('sub', { drawing_id: drawingId });
+    }
+
+    unsubscribe(drawingId) {
+        this.subscriptions.delete(drawingId);
+        return this.request('unsub', { drawing_id: drawingId });
+    }
+
+    /**
+     * 送出自 baseRevision 以來的筆劃增量（同 PATCH /drawings/{id}），版本衝突時 error.status 為 409
+     */
+    sendStrokes(drawingId, baseRevision, { strokes = null, undo = null, canvas = null } = {}) {
+        return this.request('stroke', { drawing_id: drawingId, base_revision: baseRevision, strokes, undo, canvas });
+    }
+
+    /**
+     * 送出分析工作並接收進度；回傳的 Promise 在工作完成時 resolve(job)
+     */
+    analyze(kind, body, { idempotencyKey = null, ai = null, onStatus = () => {} } = {}) {
+        return new Promise((resolve, reject) => {
+            const onPush = (pushKind, { event, job }, done) => {
+                if (event === 'done') {
+                    done();
+                    resolve(job);
+                } else if (event === 'expired') {
+                    done();
+                    reject(new Error('Job expired'));
+                } else {
+                    onStatus(job);
+                }
+            };
+            const request = this.request('analyze', { kind, body, idempotency_key: idempotencyKey, ai }, onPush);
+            request.then((job) => {
+                // 以相同 idempotencyKey 重送已完成的工作時不會再有推送
+                if (job.status === 'succeeded' || job.status === 'failed') {
+                    this.pending.delete(request.ref);
+                    resolve(job);
+                } else {
+                    onStatus(job);
+                }
+            }, reject);
+        });
+    }
+
+    close() {
+        this.closed = true;
+        clearTimeout(this.reconnectTimer);
+        this.ws?.close();
+    }
+}
+
 // 建立全域 API 實例
 window.API = new APIModule();
 
 // 匯出類別
-window.APIModule = APIModule;
\ No newline at end of file
+window.APIModule = APIModule;
+window.RealtimeChannel = RealtimeChannel;
\ No newline at end of file
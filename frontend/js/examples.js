@@ -448,10 +448,15 @@ class ExamplesModule {
     /**
      * 處理範例點擊
      */
-    handleExampleClick(exampleId) {
+    async handleExampleClick(exampleId) {
         const example = this.examples.find(ex => ex.id === exampleId);
         if (!example) return;
         
+        // 列表只包含摘要欄位，files 等詳細內容在開啟時才載入
+        if (example.files === undefined && example.file_count !== undefined) {
+            await this.loadExampleDetail(example);
+        }
+        
         if (this.options.enablePreview) {
             this.showPreview(example);
         } else {
@@ -461,6 +466,20 @@ class ExamplesModule {
         Utils.events.emit('example:click', { example });
     }
 
+    /**
+     * 載入範例詳情（files、metadata）並合併到列表項目
+     */
+    async loadExampleDetail(example) {
+        try {
+            const detail = await Utils.http.get(`${this.apiConfig.endpoint}/${example.id}`, {
+                timeout: this.apiConfig.timeout
+            });
+            Object.assign(example, detail);
+        } catch (error) {
+            Utils.log.error('Load example detail error:', error);
+        }
+    }
+
     /**
      * 顯示範例預覽
      */
@@ -2,21 +2,81 @@
 """
 UI CoreWork 安裝引擎
 通用安裝框架，支持配置驅動的安裝流程
+
+安裝步驟以相依圖執行：互不相依的步驟（例如初始化資料庫與安裝依賴）同時進行，
+依賴套件先下載到本機 wheelhouse，重新安裝與升級時可離線完成；
+各步驟耗時寫入 logs/install_timings.json。
 """
 
+import hashlib
 import json
 import os
 import sys
 import subprocess
 import platform
+import re
 import shutil
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List, Tuple
 import urllib.request
 import tempfile
 
 
+@dataclass
+class InstallStep:
+    """安裝步驟：名稱、執行函式與必須先成功的步驟"""
+    key: str
+    name: str
+    func: Callable[[], bool]
+    depends: Tuple[str, ...] = ()
+
+
+def file_hash(path: str) -> str:
+    """檔案內容的 SHA-256"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# 需求行開頭的套件名稱（可帶 extras，例如 uvicorn[standard]）
+REQUIREMENT_NAME = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+# 虛擬環境中記錄已安裝需求的檔案
+VENV_LOCK_FILE = ".requirements.lock.json"
+
+
+def parse_requirements(path: str) -> Dict[str, str]:
+    """讀取 requirements：{正規化套件名稱: 需求行}；pip 選項行以原文作為鍵"""
+    requirements = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split(" #", 1)[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            match = REQUIREMENT_NAME.match(line)
+            if line.startswith("-") or not match:
+                requirements[line] = line
+            else:
+                requirements[re.sub(r"[-_.]+", "-", match.group(1)).lower()] = line
+    return requirements
+
+
+def venv_python_version(venv_dir: str) -> Optional[str]:
+    """從 pyvenv.cfg 讀取虛擬環境的 Python 版本"""
+    cfg = os.path.join(venv_dir, "pyvenv.cfg")
+    if not os.path.exists(cfg):
+        return None
+    with open(cfg, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, _, value = line.partition("=")
+            if key.strip() in ("version", "version_info"):
+                return value.strip()
+    return None
+
+
 class InstallEngine:
     """通用安裝引擎"""
 
@@ -45,6 +105,14 @@ class InstallEngine:
         except:
             return False
 
+    @property
+    def venv_python(self) -> str:
+        """虛擬環境中的 Python 路徑"""
+        venv_dir = self.config["directories"]["venv"]
+        if self.is_windows:
+            return os.path.join(venv_dir, "Scripts", "python.exe")
+        return os.path.join(venv_dir, "bin", "python")
+
     def run_command(self, cmd: List[str], cwd: Optional[str] = None,
                    capture_output: bool = False) -> subprocess.CompletedProcess:
         """執行系統命令"""
@@ -82,6 +150,10 @@ class InstallEngine:
         except:
             return False
 
+    def ensure_python(self) -> bool:
+        """確認 Python 版本符合要求，不符合時才安裝"""
+        return self.check_python() or self.install_python()
+
     def install_python(self) -> bool:
         """安裝 Python"""
         if not self.is_windows:
@@ -132,8 +204,29 @@ class InstallEngine:
                 pass
 
     def create_virtualenv(self) -> bool:
-        """建立虛擬環境"""
+        """建立或沿用虛擬環境
+
+        既有環境的 Python 主次版本與目前相同時直接沿用（修訂版不同時以 venv --upgrade 更新），
+        版本變更或 install.venv_update 設為 rebuild 時才備份舊環境並重建。
+        """
         venv_dir = self.config["directories"]["venv"]
+        current = platform.python_version()
+        existing = venv_python_version(venv_dir)
+        rebuild = self.config.get("install", {}).get("venv_update", "incremental") == "rebuild"
+
+        if existing and os.path.exists(self.venv_python) and not rebuild:
+            if existing.split(".")[:2] == current.split(".")[:2]:
+                try:
+                    if existing != current:
+                        self.run_command([sys.executable, "-m", "venv", "--upgrade", venv_dir])
+                        print(f"✅ 虛擬環境已更新為 Python {current}")
+                    else:
+                        print(f"♻️ 沿用既有虛擬環境 (Python {current})")
+                    return True
+                except Exception as e:
+                    print(f"⚠️ 虛擬環境更新失敗，改為重建: {e}")
+            else:
+                print(f"🔄 Python 版本由 {existing} 變更為 {current}，重建虛擬環境")
 
         # 備份現有環境
         if os.path.exists(venv_dir):
@@ -152,31 +245,128 @@ class InstallEngine:
             print(f"❌ 虛擬環境建立失敗: {e}")
             return False
 
+    def wheelhouse_stamp(self) -> str:
+        """wheelhouse 對應的需求版本：requirements 內容、Python 版本與平台"""
+        requirements_file = self.config["dependencies"]["requirements_file"]
+        return f"{file_hash(requirements_file)} {platform.python_version()} {platform.machine()} {self.system}"
+
+    def prefetch_wheels(self) -> bool:
+        """將依賴套件下載到本機 wheelhouse（requirements 未變時略過）
+
+        下載失敗（例如離線）但已有 wheelhouse 時沿用舊內容，由安裝步驟決定是否仍需連網。
+        """
+        wheelhouse = self.config["dependencies"].get("wheelhouse", "wheelhouse")
+        requirements_file = self.config["dependencies"]["requirements_file"]
+        stamp_file = os.path.join(wheelhouse, ".requirements.stamp")
+
+        if not os.path.exists(requirements_file):
+            print(f"❌ 找不到依賴檔案: {requirements_file}")
+            return False
+
+        stamp = self.wheelhouse_stamp()
+        if os.path.exists(stamp_file) and Path(stamp_file).read_text(encoding='utf-8') == stamp:
+            print(f"♻️ 依賴未變更，使用既有 wheelhouse: {wheelhouse}")
+            return True
+
+        print(f"📥 下載依賴套件到 {wheelhouse}...")
+        os.makedirs(wheelhouse, exist_ok=True)
+        cmd = [sys.executable, "-m", "pip", "download", "-r", requirements_file, "-d", wheelhouse,
+               "--find-links", wheelhouse, "--timeout", str(self.config["dependencies"].get("timeout", 300))]
+        for host in self.config["dependencies"].get("trusted_hosts", []):
+            cmd += ["--trusted-host", host]
+        try:
+            self.run_command(cmd, capture_output=True)
+            Path(stamp_file).write_text(stamp, encoding='utf-8')
+            print("✅ 依賴套件下載完成")
+        except Exception:
+            print("⚠️ 無法下載依賴套件，將使用既有的 wheelhouse 或直接連網安裝")
+        return True
+
+    def read_venv_lock(self) -> Dict[str, Any]:
+        """讀取虛擬環境中上次成功安裝的需求紀錄"""
+        lock_path = os.path.join(self.config["directories"]["venv"], VENV_LOCK_FILE)
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_venv_lock(self, requirements_file: str):
+        lock_path = os.path.join(self.config["directories"]["venv"], VENV_LOCK_FILE)
+        with open(lock_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "hash": file_hash(requirements_file),
+                "python": platform.python_version(),
+                "requirements": parse_requirements(requirements_file),
+            }, f, ensure_ascii=False, indent=2)
+
+    def smoke_test(self) -> bool:
+        """在虛擬環境中匯入核心套件，確認安裝可用"""
+        modules = self.config["dependencies"].get("smoke_imports", [])
+        if not modules:
+            return True
+        try:
+            self.run_command([self.venv_python, "-c", "import " + ", ".join(modules)], capture_output=True)
+            return True
+        except Exception:
+            return False
+
     def install_dependencies(self) -> bool:
-        """安裝依賴套件"""
-        venv_dir = self.config["directories"]["venv"]
+        """安裝依賴套件（優先使用本機 wheelhouse）
+
+        虛擬環境中的需求紀錄與 requirements 雜湊相同時只做匯入測試；
+        不同時只安裝有變更的需求行、移除已刪除的套件，選項行有變更或匯入測試失敗時才完整安裝。
+        """
         requirements_file = self.config["dependencies"]["requirements_file"]
+        wheelhouse = self.config["dependencies"].get("wheelhouse", "wheelhouse")
 
         if not os.path.exists(requirements_file):
             print(f"❌ 找不到依賴檔案: {requirements_file}")
             return False
 
-        # 啟動虛擬環境
-        if self.is_windows:
-            python_exe = os.path.join(venv_dir, "Scripts", "python.exe")
-            pip_exe = os.path.join(venv_dir, "Scripts", "pip.exe")
-        else:
-            python_exe = os.path.join(venv_dir, "bin", "python")
-            pip_exe = os.path.join(venv_dir, "bin", "pip")
+        python_exe = self.venv_python
+        lock = self.read_venv_lock()
+        if lock.get("hash") == file_hash(requirements_file) and self.smoke_test():
+            print("♻️ 依賴未變更，略過安裝")
+            return True
+
+        # wheelhouse 與目前的 requirements 相符時完全離線安裝
+        stamp_file = os.path.join(wheelhouse, ".requirements.stamp")
+        offline = (os.path.exists(stamp_file)
+                   and Path(stamp_file).read_text(encoding='utf-8') == self.wheelhouse_stamp())
+        source_args = ["--find-links", wheelhouse] if os.path.isdir(wheelhouse) else []
+        if offline:
+            source_args.append("--no-index")
+
+        requirements = parse_requirements(requirements_file)
+        previous = lock.get("requirements")
+        changed, removed = [], []
+        if previous is not None:
+            changed = [line for name, line in requirements.items() if previous.get(name) != line]
+            removed = [name for name in previous if name not in requirements and not name.startswith("-")]
+        incremental = previous is not None and not any(line.startswith("-") for line in changed)
 
-        print("📦 安裝依賴套件...")
         try:
-            # 升級 pip
-            if self.config["dependencies"]["upgrade_pip"]:
-                self.run_command([python_exe, "-m", "pip", "install", "--upgrade", "pip"])
+            if incremental:
+                print(f"📦 更新依賴套件：{len(changed)} 個變更、{len(removed)} 個移除")
+                if removed:
+                    self.run_command([python_exe, "-m", "pip", "uninstall", "-y"] + removed)
+                if changed:
+                    self.run_command([python_exe, "-m", "pip", "install"] + changed + source_args)
+
+            if not incremental or not self.smoke_test():
+                print("📦 安裝依賴套件" + ("（離線）..." if offline else "..."))
+                # 升級 pip（離線時略過）
+                if self.config["dependencies"]["upgrade_pip"] and not offline:
+                    self.run_command([python_exe, "-m", "pip", "install", "--upgrade", "pip"])
+
+                # 安裝依賴
+                self.run_command([python_exe, "-m", "pip", "install", "-r", requirements_file] + source_args)
+                if not self.smoke_test():
+                    print("❌ 依賴安裝後匯入測試失敗")
+                    return False
 
-            # 安裝依賴
-            self.run_command([pip_exe, "install", "-r", requirements_file])
+            self.write_venv_lock(requirements_file)
             print("✅ 依賴安裝完成")
             return True
         except Exception as e:
@@ -248,6 +438,7 @@ class InstallEngine:
         checks = [
             ("虛擬環境", lambda: os.path.exists(self.config["directories"]["venv"])),
             ("依賴檔案", lambda: os.path.exists(self.config["dependencies"]["requirements_file"])),
+            ("套件匯入", self.smoke_test),
             ("資料庫檔案", lambda: os.path.exists(self.config["database"]["data_file"])),
         ]
 
@@ -287,33 +478,97 @@ class InstallEngine:
         else:
             print("   • 終端機: ./start_simple.sh")
 
-    def install(self) -> bool:
-        """執行完整安裝流程"""
-        print(f"🎨 {self.config['project']['name']} - {self.config['project']['description']}")
-        print("=" * 60)
-        print("")
-
-        steps = [
-            ("檢查 Python", self.check_python),
-            ("安裝 Python", self.install_python),
-            ("建立虛擬環境", self.create_virtualenv),
-            ("安裝依賴", self.install_dependencies),
-            ("初始化資料庫", self.initialize_database),
-            ("建立捷徑", self.create_shortcuts),
-            ("驗證安裝", self.validate_installation),
+    def install_steps(self) -> List[InstallStep]:
+        """安裝步驟與相依關係"""
+        return [
+            InstallStep("python", "檢查/安裝 Python", self.ensure_python),
+            InstallStep("venv", "建立虛擬環境", self.create_virtualenv, ("python",)),
+            InstallStep("wheels", "下載依賴套件", self.prefetch_wheels, ("python",)),
+            InstallStep("dependencies", "安裝依賴", self.install_dependencies, ("venv", "wheels")),
+            # init_db.py 只使用標準函式庫，不需等待虛擬環境
+            InstallStep("database", "初始化資料庫", self.initialize_database, ("python",)),
+            InstallStep("shortcuts", "建立捷徑", self.create_shortcuts),
+            InstallStep("validate", "驗證安裝", self.validate_installation,
+                        ("venv", "dependencies", "database", "shortcuts")),
         ]
 
-        for step_name, step_func in steps:
-            if step_func is None:
-                continue
+    def run_steps(self, steps: List[InstallStep], max_workers: int = 4) -> bool:
+        """依相依圖執行步驟：相依步驟都成功後立即排入，互不相依的步驟同時執行
+
+        任一步驟失敗後不再排入新步驟，等待執行中的步驟結束後回傳 False。
+        """
+        self.timings: Dict[str, float] = {}
+        done: Dict[str, bool] = {}
+        pending = {step.key: step for step in steps}
+        print_lock = threading.Lock()
 
+        def run(step: InstallStep) -> bool:
+            started = time.perf_counter()
             try:
-                if not step_func():
-                    print(f"❌ 安裝失敗於步驟: {step_name}")
-                    return False
+                return bool(step.func())
             except Exception as e:
-                print(f"❌ 安裝失敗於步驟: {step_name} - {e}")
+                with print_lock:
+                    print(f"❌ 安裝失敗於步驟: {step.name} - {e}")
                 return False
+            finally:
+                self.timings[step.key] = time.perf_counter() - started
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                if all(done.values()):
+                    for key, step in list(pending.items()):
+                        if all(done.get(dependency) for dependency in step.depends):
+                            running[pool.submit(run, step)] = step
+                            del pending[key]
+
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    done[step.key] = future.result()
+                    if not done[step.key]:
+                        with print_lock:
+                            print(f"❌ 安裝失敗於步驟: {step.name}")
+
+        self.save_timings(steps)
+        return not pending and all(done.values())
+
+    def save_timings(self, steps: List[InstallStep]):
+        """顯示並記錄各步驟耗時"""
+        total = time.perf_counter() - self.install_started
+        print("")
+        print("⏱️ 步驟耗時:")
+        for step in steps:
+            if step.key in self.timings:
+                print(f"   {self.timings[step.key]:7.1f}s  {step.name}")
+        print(f"   {total:7.1f}s  總計")
+
+        logs_dir = self.config["directories"].get("logs", "logs")
+        try:
+            os.makedirs(logs_dir, exist_ok=True)
+            record = {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "host": platform.node(),
+                "total": round(total, 3),
+                "steps": {key: round(seconds, 3) for key, seconds in self.timings.items()},
+            }
+            with open(os.path.join(logs_dir, "install_timings.json"), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ 無法寫入耗時紀錄: {e}")
+
+    def install(self) -> bool:
+        """執行完整安裝流程"""
+        print(f"🎨 {self.config['project']['name']} - {self.config['project']['description']}")
+        print("=" * 60)
+        print("")
+
+        self.install_started = time.perf_counter()
+        max_workers = self.config.get("install", {}).get("max_parallel_steps", 4)
+        if not self.run_steps(self.install_steps(), max_workers=max_workers):
+            return False
 
         self.show_completion_message()
         return True
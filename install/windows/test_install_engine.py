@@ -0,0 +1,198 @@
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import install_engine
+from install_engine import InstallEngine, InstallStep, parse_requirements
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """以暫存目錄中的設定建立安裝引擎，外部命令改為記錄"""
+    monkeypatch.chdir(tmp_path)
+    Path("requirements.txt").write_text("fastapi==0.104.1\nuvicorn[standard]==0.24.0\n", encoding="utf-8")
+    Path("install_config.json").write_text(json.dumps({
+        "directories": {"venv": "venv", "logs": "logs"},
+        "dependencies": {
+            "requirements_file": "requirements.txt", "wheelhouse": "wheelhouse",
+            "upgrade_pip": False, "smoke_imports": ["fastapi"],
+        },
+        "backup": {"backup_suffix": "_backup"},
+    }), encoding="utf-8")
+
+    engine = InstallEngine("install_config.json")
+    engine.install_started = time.perf_counter()
+    engine.commands = []
+
+    def run_command(cmd, cwd=None, capture_output=False):
+        engine.commands.append(cmd)
+    monkeypatch.setattr(engine, "run_command", run_command)
+    return engine
+
+
+def recorder(log, key, result=True, delay=0.0):
+    def run():
+        time.sleep(delay)
+        log.append(key)
+        return result
+    return run
+
+
+def test_steps_run_after_their_dependencies(engine):
+    log = []
+    steps = [
+        InstallStep("validate", "驗證", recorder(log, "validate"), ("deps", "db")),
+        InstallStep("deps", "依賴", recorder(log, "deps", delay=0.02), ("python",)),
+        InstallStep("db", "資料庫", recorder(log, "db"), ("python",)),
+        InstallStep("python", "Python", recorder(log, "python")),
+    ]
+
+    assert engine.run_steps(steps)
+    assert log[0] == "python" and log[-1] == "validate"
+    assert set(engine.timings) == {"python", "deps", "db", "validate"}
+    assert json.loads(Path("logs/install_timings.json").read_text(encoding="utf-8"))["steps"].keys() == engine.timings.keys()
+
+
+def test_independent_steps_run_in_parallel(engine):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet():
+        # 兩個步驟都必須同時在執行中才能通過
+        barrier.wait()
+        return True
+
+    assert engine.run_steps([InstallStep("a", "A", meet), InstallStep("b", "B", meet)], max_workers=2)
+
+
+def test_failed_step_skips_its_dependents(engine, capsys):
+    log = []
+
+    def broken():
+        raise RuntimeError("disk full")
+
+    steps = [
+        InstallStep("python", "Python", recorder(log, "python")),
+        InstallStep("venv", "虛擬環境", broken, ("python",)),
+        InstallStep("deps", "依賴", recorder(log, "deps"), ("venv",)),
+        InstallStep("shortcuts", "捷徑", recorder(log, "shortcuts", delay=0.05)),
+    ]
+
+    assert not engine.run_steps(steps)
+    # 已在執行的獨立步驟會完成，相依於失敗步驟的不會執行
+    assert sorted(log) == ["python", "shortcuts"]
+    assert "deps" not in engine.timings
+    assert "disk full" in capsys.readouterr().out
+
+
+def test_unknown_dependency_fails_without_running_the_step(engine):
+    log = []
+    assert not engine.run_steps([InstallStep("deps", "依賴", recorder(log, "deps"), ("missing",))])
+    assert log == []
+
+
+def test_prefetch_skips_download_when_wheelhouse_stamp_matches(engine):
+    assert engine.prefetch_wheels()
+    assert engine.commands[0][2:4] == ["pip", "download"]
+    assert Path("wheelhouse/.requirements.stamp").read_text(encoding="utf-8") == engine.wheelhouse_stamp()
+
+    engine.commands.clear()
+    assert engine.prefetch_wheels()
+    assert engine.commands == []
+
+    # requirements 變更後重新下載
+    Path("requirements.txt").write_text("fastapi==0.110.0\n", encoding="utf-8")
+    assert engine.prefetch_wheels()
+    assert engine.commands[0][2:4] == ["pip", "download"]
+
+
+def make_venv(engine, version):
+    """建立只有 pyvenv.cfg 與 python 執行檔的假虛擬環境"""
+    Path(engine.venv_python).parent.mkdir(parents=True)
+    Path(engine.venv_python).touch()
+    Path("venv/pyvenv.cfg").write_text(f"home = /usr/bin\nversion = {version}\n", encoding="utf-8")
+
+
+def pip_commands(engine):
+    return [cmd[3:] for cmd in engine.commands if cmd[1:3] == ["-m", "pip"]]
+
+
+def test_parse_requirements_normalizes_names_and_keeps_options(tmp_path):
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text(
+        "# comment\n--find-links wheels\nPillow==10.1.0  # 影像\nPython_Multipart>=0.0.6\n\n", encoding="utf-8")
+    assert parse_requirements(str(requirements)) == {
+        "--find-links wheels": "--find-links wheels",
+        "pillow": "Pillow==10.1.0",
+        "python-multipart": "Python_Multipart>=0.0.6",
+    }
+
+
+def test_unchanged_lock_only_runs_the_smoke_test(engine):
+    make_venv(engine, install_engine.platform.python_version())
+    engine.write_venv_lock("requirements.txt")
+
+    assert engine.install_dependencies()
+    assert pip_commands(engine) == []
+    assert engine.commands == [[engine.venv_python, "-c", "import fastapi"]]
+
+
+def test_changed_pins_install_only_those_packages(engine):
+    make_venv(engine, install_engine.platform.python_version())
+    Path("requirements.txt").write_text("fastapi==0.104.1\nuvicorn[standard]==0.24.0\nrequests==2.31.0\n",
+                                        encoding="utf-8")
+    engine.write_venv_lock("requirements.txt")
+    Path("requirements.txt").write_text("fastapi==0.110.0\nuvicorn[standard]==0.24.0\nnumpy==1.26.2\n",
+                                        encoding="utf-8")
+
+    assert engine.install_dependencies()
+    assert pip_commands(engine) == [
+        ["uninstall", "-y", "requests"],
+        ["install", "fastapi==0.110.0", "numpy==1.26.2"],
+    ]
+    assert engine.read_venv_lock()["requirements"] == parse_requirements("requirements.txt")
+
+
+def test_changed_option_line_falls_back_to_full_install(engine):
+    make_venv(engine, install_engine.platform.python_version())
+    engine.write_venv_lock("requirements.txt")
+    Path("requirements.txt").write_text("--extra-index-url https://mirror\nfastapi==0.104.1\n", encoding="utf-8")
+
+    assert engine.install_dependencies()
+    assert pip_commands(engine) == [["install", "-r", "requirements.txt"]]
+
+
+def test_missing_lock_does_a_full_install(engine):
+    make_venv(engine, install_engine.platform.python_version())
+
+    assert engine.install_dependencies()
+    assert pip_commands(engine) == [["install", "-r", "requirements.txt"]]
+    assert Path("venv", install_engine.VENV_LOCK_FILE).exists()
+
+
+def test_venv_with_same_python_is_reused(engine, monkeypatch):
+    monkeypatch.setattr(install_engine.platform, "python_version", lambda: "3.11.7")
+    make_venv(engine, "3.11.7")
+    assert engine.create_virtualenv()
+    assert engine.commands == []
+
+    # 只有修訂版不同時就地升級
+    monkeypatch.setattr(install_engine.platform, "python_version", lambda: "3.11.9")
+    assert engine.create_virtualenv()
+    assert engine.commands == [[install_engine.sys.executable, "-m", "venv", "--upgrade", "venv"]]
+    assert not Path("venv_backup").exists()
+
+
+def test_python_minor_change_rebuilds_the_venv(engine, monkeypatch):
+    monkeypatch.setattr(install_engine.platform, "python_version", lambda: "3.12.1")
+    make_venv(engine, "3.11.7")
+
+    assert engine.create_virtualenv()
+    assert engine.commands == [[install_engine.sys.executable, "-m", "venv", "venv"]]
+    assert Path("venv_backup/pyvenv.cfg").read_text(encoding="utf-8").endswith("version = 3.11.7\n")
+    assert not Path("venv").exists()